@@ -0,0 +1,367 @@
+''' Structured audit log output.
+
+The text audit trail ('[FILE I/O]', '[INET]') is formatted like the
+debug log, which makes it slow to write and hard to query at high
+verbosity. AuditHandler is a logging handler for the audit logger that
+writes one structured event per record instead: newline-delimited JSON
+(gzip-compressed if the path ends in .gz) or Arrow IPC record batches
+(zstd-compressed). Logging only appends the event to a buffer; a
+background thread writes the buffer every `flush_interval` seconds, or
+sooner once FLUSH_EVENTS events are waiting. When the file reaches
+`max_bytes` on disk, it is rotated like logging.handlers.
+RotatingFileHandler does (path -> path.1 -> path.2 ...), keeping
+`backups` old files.
+
+Events carry the fields of EVENT_FIELDS; fields a record does not have
+are left out of the JSON (null in Arrow). The event types are 'inet',
+'file_read', 'files_read' (one event for many files, with their count
+and total size), 'file_write' and 'message' for anything else.
+
+read_audit streams an audit log, rotated files included and oldest
+first, and yields the events matching a module, event type and/or path
+prefix. JSON lines are checked for the wanted values as plain text
+before they are decoded, so filtering a multi-GB log costs little more
+than decompressing it, and memory stays at one line (or batch).
+
+Functions:
+    read_audit: Yields the matching events of an audit log.
+    check: Round trip of every format through rotation and read_audit.
+
+Classes:
+    AuditHandler: Writes audit records as structured, rotating files.
+
+Example usage:
+    >>> from between_bytes.core.audit_log import read_audit
+    >>> for e in read_audit('audit.ndjson.gz', module='facebook_act', event='file_read'):
+    ...     print(e['path'])
+
+    $ python3 audit_log.py audit.ndjson.gz --event files_read --prefix /data/export/messages
+    {"ts":1718035200.12,"pid":4242,"module":"facebook_act","level":"INFO","event":"files_read",...}
+
+    $ python3 audit_log.py audit.ndjson.gz --module ip_loc --count
+    17
+
+    $ python3 audit_log.py --check
+    ndjson.gz: 20021 events in 4 files read back
+    arrow: 20021 events in 4 files read back
+
+Author:
+    between_bytes contributors
+
+Version:
+    1.0
+'''
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from typing import Iterator
+
+FORMATS = ('ndjson', 'arrow')
+AUDIT_MAX_BYTES = 64 * 2**20
+AUDIT_BACKUPS = 5
+FLUSH_INTERVAL = 1.0
+FLUSH_EVENTS = 4096
+ARROW_COMPRESSION = 'zstd'
+GZIP_LEVEL = 3  # compresses the repetitive events about as well as 9, at twice the speed
+
+# (name, Arrow type) of every event field, in output order
+EVENT_FIELDS = (('ts', 'float64'), ('pid', 'int64'), ('module', 'string'), ('level', 'string'),
+                ('event', 'string'), ('access', 'string'), ('path', 'string'), ('size', 'int64'),
+                ('count', 'int64'), ('url', 'string'), ('message', 'string'))
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ARROW_MAGIC = b'\xff\xff\xff\xff'  # continuation marker opening an IPC stream
+_encode = json.JSONEncoder(separators=(',', ':'), default=str).encode
+
+
+def _module(name: str) -> str:
+    # 'root_audit.facebook_act.messages' -> 'facebook_act.messages'
+    return name.partition('.')[2] or 'main'
+
+
+class AuditHandler(logging.Handler):
+    """ Writes audit records as structured events to a rotating file.
+
+    Records logged with `extra={'audit': {...}}` contribute those fields
+    to their event; records with `extra={'audit': None}` are skipped
+    (e.g. the '[FILE I/O] - Full path' records, whose path every event
+    already has).
+
+    Args:
+        path (str): The file to write. With fmt 'ndjson', a path ending
+            in .gz is gzip-compressed.
+        fmt (str): 'ndjson' or 'arrow'.
+        max_bytes (int): Rotate once the file is this big on disk;
+            0 never rotates.
+        backups (int): How many rotated files to keep.
+        flush_interval (float): Seconds between background writes.
+
+    Raises:
+        ValueError: If `fmt` is unknown.
+    """
+    def __init__(self, path, fmt: str = 'ndjson', max_bytes: int = AUDIT_MAX_BYTES,
+                 backups: int = AUDIT_BACKUPS, flush_interval: float = FLUSH_INTERVAL):
+        if fmt not in FORMATS:
+            raise ValueError(f'Invalid audit format {fmt}')
+        if fmt == 'arrow':
+            import pyarrow as pa  # pylint: disable=import-outside-toplevel
+        super().__init__()
+        self.path = os.path.abspath(path)
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self._raw = self._out = None
+        # not self.lock: logging.shutdown() holds that while close() joins the flusher
+        self._buffer_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._pa = self._schema = None
+        if fmt == 'arrow':
+            self._pa = pa
+            self._schema = pa.schema([(name, pa.type_for_alias(t)) for name, t in EVENT_FIELDS])
+            # the first conversion imports pandas lazily, which takes seconds;
+            # do it here rather than stall the flusher while events pile up
+            pa.RecordBatch.from_pylist([], schema=self._schema)
+            # an Arrow stream cannot be appended to, so an old one is rotated away
+            if os.path.exists(self.path):
+                self._rotate()
+        self._flusher = threading.Thread(target=self._flush_loop, name='btb-audit-flush', daemon=True)
+        self._flusher.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        fields = getattr(record, 'audit', {})
+        if fields is None:
+            return
+        try:
+            event = {'ts': record.created, 'pid': record.process, 'module': _module(record.name),
+                     'level': record.levelname, 'event': 'message', **fields}
+            if event.get('path') is not None:
+                event['path'] = os.path.abspath(event['path'])
+            if event['event'] == 'message':
+                event['message'] = record.getMessage()
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        with self._buffer_lock:
+            self.buffer.append(event)
+            full = len(self.buffer) >= FLUSH_EVENTS
+        if full:
+            self._wake.set()
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                # keep flushing later batches, as emit() does for bad records
+                traceback.print_exc(file=sys.stderr)
+
+    def flush(self) -> None:
+        """ Write the buffered events now."""
+        with self._buffer_lock:
+            events, self.buffer = self.buffer, []
+        if not events:
+            return
+        with self._io_lock:
+            if self._out is None:
+                self._open()
+            if self.fmt == 'arrow':
+                self._out.write_batch(self._pa.RecordBatch.from_pylist(events, schema=self._schema))
+            else:
+                self._out.write(''.join(_encode(e) + '\n' for e in events).encode('utf-8'))
+            if self.max_bytes and self._raw.tell() >= self.max_bytes:
+                self._close_file()
+                self._rotate()
+
+    def _open(self) -> None:
+        if self.fmt == 'arrow':
+            pa = self._pa
+            self._raw = pa.OSFile(self.path, 'wb')
+            self._out = pa.ipc.new_stream(self._raw, self._schema,
+                                          options=pa.ipc.IpcWriteOptions(compression=ARROW_COMPRESSION))
+        else:
+            # appending adds a gzip member, which readers decompress as one stream
+            self._raw = open(self.path, 'ab')  # pylint: disable=consider-using-with
+            self._out = (gzip.GzipFile(fileobj=self._raw, mode='ab', compresslevel=GZIP_LEVEL)
+                         if self.path.endswith('.gz') else self._raw)
+
+    def _close_file(self) -> None:
+        if self._out is not None:
+            self._out.close()
+            if self._raw is not self._out:
+                self._raw.close()
+            self._raw = self._out = None
+
+    def _rotate(self) -> None:
+        # as RotatingFileHandler.doRollover
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f'{self.path}.{i}'):
+                    os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+    def close(self) -> None:
+        """ Stop the background thread and write what is left."""
+        if not self._closed:
+            self._closed = True
+            self._wake.set()
+            self._flusher.join()
+            self.flush()
+            with self._io_lock:
+                self._close_file()
+        super().close()
+
+
+def _files(path) -> list:
+    # rotated files first, oldest (highest number) first
+    path = os.fspath(path)
+    old = []
+    i = 1
+    while os.path.exists(f'{path}.{i}'):
+        old.append(f'{path}.{i}')
+        i += 1
+    return old[::-1] + ([path] if os.path.exists(path) else [])
+
+
+def _read_json(path: str, module: str, event: str, path_prefix: str) -> Iterator:
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == _GZIP_MAGIC
+    # the text each wanted value has in a matching line, written as the handler writes it
+    needles = [n for n in (module and f'"module":{json.dumps(module)}'[:-1],
+                           event and f'"event":{json.dumps(event)}',
+                           path_prefix and f'"path":{json.dumps(path_prefix)}'[:-1]) if n]
+    with (gzip.open if compressed else open)(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if all(n in line for n in needles):
+                e = json.loads(line)
+                if _match(e, module, event, path_prefix):
+                    yield e
+
+
+def _match(e: dict, module: str, event: str, path_prefix: str) -> bool:
+    return ((module is None or e.get('module') == module or e.get('module', '').startswith(module + '.'))
+            and (event is None or e.get('event') == event)
+            and (path_prefix is None or (e.get('path') or '').startswith(path_prefix)))
+
+
+def _read_arrow(path: str, module: str, event: str, path_prefix: str) -> Iterator:
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+    import pyarrow.compute as pc  # pylint: disable=import-outside-toplevel
+    with pa.OSFile(path, 'rb') as f, pa.ipc.open_stream(f) as reader:
+        for batch in reader:
+            mask = pa.array([True] * batch.num_rows)
+            if module is not None:
+                mask = pc.and_(mask, pc.or_(pc.equal(batch['module'], module),
+                                            pc.starts_with(batch['module'], module + '.')))
+            if event is not None:
+                mask = pc.and_(mask, pc.equal(batch['event'], event))
+            if path_prefix is not None:
+                mask = pc.and_(mask, pc.starts_with(batch['path'], path_prefix))
+            for e in batch.filter(pc.fill_null(mask, False)).to_pylist():
+                yield {k: v for k, v in e.items() if v is not None}
+
+
+def read_audit(path, module: str = None, event: str = None, path_prefix: str = None) -> Iterator:
+    """ Yields the events of an audit log that match all given filters.
+
+    The log is streamed, its rotated files (path.N ... path.1) first,
+    so memory does not grow with its size. The format (NDJSON, gzipped
+    NDJSON or Arrow) is detected per file.
+
+    Args:
+        path (str or Path): The audit log written by AuditHandler.
+        module (str, optional): Only events of this module or its
+            children (e.g. 'facebook_act' matches 'facebook_act.messages').
+        event (str, optional): Only events of this type, e.g. 'file_read'.
+        path_prefix (str, optional): Only events whose (absolute) path
+            starts with this.
+
+    Yields:
+        dict: The matching events, oldest first.
+    """
+    if path_prefix is not None:
+        # abspath drops a trailing separator, which tells 'a/b/' from 'a/bc'
+        path_prefix = os.path.abspath(path_prefix) + (os.sep if path_prefix.endswith(os.sep) else '')
+    for part in _files(path):
+        with open(part, 'rb') as f:
+            arrow = f.read(4) == _ARROW_MAGIC
+        yield from (_read_arrow if arrow else _read_json)(part, module, event, path_prefix)
+
+
+def check(n: int = 20000) -> None:
+    """ Writes n file events (plus some others) in every format with
+    rotation, and checks that read_audit gives them all back, in order,
+    and filters them right.
+
+    Raises:
+        AssertionError: If an event is lost, changed or filtered wrongly.
+    """
+    for suffix, fmt in (('ndjson.gz', 'ndjson'), ('arrow', 'arrow')):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f'audit.{suffix}')
+            handler = AuditHandler(path, fmt, max_bytes=16 * 1024, backups=n, flush_interval=0.01)
+            loggers = {name: logging.getLogger(f'btb_check.{name}') for name in ('fba.messages', 'ipl')}
+            for logger in loggers.values():
+                logger.handlers, logger.propagate = [handler], False
+                logger.setLevel(logging.INFO)
+            paths = [os.path.join(tmp, 'inbox', f'thread_{i % 500}', f'message_{i}.json') for i in range(n)]
+            for i, p in enumerate(paths):
+                loggers['fba.messages'].info('read', extra={'audit': {'event': 'file_read', 'access': 'contents',
+                                                                      'path': p}})
+                if i % 1000 == 0:
+                    loggers['ipl'].warning('inet', extra={'audit': {'event': 'inet', 'url': f'https://x/{i}'}})
+                    loggers['ipl'].info('message %i', i)
+                    loggers['ipl'].debug('skipped', extra={'audit': None})
+            handler.close()
+            for logger in loggers.values():
+                logger.handlers = []
+
+            assert len(_files(path)) > 1, 'not rotated'
+            events = list(read_audit(path))
+            assert len(events) == n + 2 * (n // 1000), len(events)
+            assert [e['path'] for e in events if e['event'] == 'file_read'] == paths
+            assert [e['message'] for e in events if e['event'] == 'message'] == [f'message {i}' for i in range(0, n, 1000)]
+            assert sum(1 for _ in read_audit(path, module='fba')) == n
+            assert sum(1 for _ in read_audit(path, module='ipl', event='inet')) == n // 1000
+            prefix = os.path.join(tmp, 'inbox', 'thread_7') + os.sep
+            assert sum(1 for _ in read_audit(path, path_prefix=prefix)) == n // 500
+            print(f'{suffix}: {len(events)} events in {len(_files(path))} files read back')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='audit_log', description='Filter a structured audit log')
+    parser.add_argument('audit', nargs='?', help='audit log (NDJSON, gzipped NDJSON or Arrow)')
+    parser.add_argument('--module', help='only events of this module (and its children)')
+    parser.add_argument('--event', help='only events of this type (inet, file_read, files_read, file_write)')
+    parser.add_argument('--prefix', help='only events whose path starts with this')
+    parser.add_argument('--count', action='store_true', help='print the number of matching events only')
+    parser.add_argument('--check', action='store_true', help='run the write/rotate/read round trip check instead')
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+        sys.exit(0)
+    if args.audit is None:
+        parser.error('give an audit log, or --check')
+    if not Path(args.audit).exists():
+        sys.exit(f'No such file: {args.audit}')
+    matches = read_audit(args.audit, args.module, args.event, args.prefix)
+    if args.count:
+        print(sum(1 for _ in matches))
+    else:
+        for e in matches:
+            print(json.dumps(e, separators=(',', ':')))
@@ -0,0 +1,185 @@
+''' GitHub-style activity calendars for any timestamped data.
+
+Every year of activity becomes a 7 x 53 grid (ISO weekday x ISO week).
+All years are filled at once by scattering events onto a flat
+(year, weekday, week) index with np.bincount, so building the grids costs
+one pass over the data no matter how many years it spans. Per-year date
+labels and month ticks come from year_calendar, which is cached.
+
+ISO years are used throughout, so e.g. 1 January 2021 (ISO week 53 of
+2020) lands in the last column of the 2020 grid.
+
+Functions:
+    year_calendar: Cached ISO calendar layout (dates, month ticks) of a year.
+    calendar_grids: Counts (or sums weights of) events per day for all years.
+    calendar_figure: Plots grids as one figure with a year selector.
+
+Example usage:
+    >>> from between_bytes.core.calendar_heatmap import calendar_grids, year_calendar
+    >>> years, grids = calendar_grids(pd.to_datetime(df['timestamp'], unit='s'))
+    >>> cal = year_calendar(years[0])
+    >>> grids[0][:, :cal.weeks]  # 7 x 52/53 counts for the first year
+
+Author:
+    between_bytes contributors
+
+Version:
+    1.0
+'''
+from datetime import date
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+MAX_WEEKS = 53
+WEEKDAYS = ['M', 'T', 'W', 'R', 'F', 'S', 'U']
+GITHUB_DARK = {'colorscale': [[0, '#161b22'], [0.25, '#0e4429'], [0.5, '#006d32'],
+                              [0.75, '#26a641'], [1, '#39d353']],
+               'paper_bgcolor': '#0d1117',
+               'font_color': '#c9d1d9'}
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+class YearCalendar(NamedTuple):
+    """ ISO calendar layout of one year.
+
+    Attributes:
+        year (int): The ISO year.
+        weeks (int): Number of ISO weeks (52 or 53).
+        dates (np.ndarray): 7 x weeks array of ISO-formatted date strings.
+        tickvals (list): Week indices where a month starts.
+        ticktext (list): Month abbreviations for `tickvals`.
+    """
+    year: int
+    weeks: int
+    dates: np.ndarray
+    tickvals: list
+    ticktext: list
+
+
+@lru_cache(maxsize=None)
+def year_calendar(year:int) -> YearCalendar:
+    """Returns the (cached) ISO calendar layout of `year`.
+
+    A week is labelled with the month its Thursday falls in, which is the
+    same rule ISO 8601 uses to assign weeks to years.
+    """
+    year = int(year)
+    weeks = date(year, 12, 28).isocalendar().week
+    monday = np.datetime64(date.fromisocalendar(year, 1, 1), 'D')
+    days = monday + (np.arange(weeks)[None, :] * 7 + np.arange(7)[:, None]).astype('timedelta64[D]')
+    months = days[3].astype('datetime64[M]').astype(int) % 12
+    starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    return YearCalendar(year=year,
+                        weeks=weeks,
+                        dates=np.datetime_as_string(days, unit='D'),
+                        tickvals=starts.tolist(),
+                        ticktext=[MONTHS[m] for m in months[starts]])
+
+
+def calendar_grids(when, weights=None, groups=None, n_groups:int=None) -> tuple:
+    """Builds day-by-day activity grids for every year in one pass.
+
+    Args:
+        when (array-like of datetime): Event times (pd.Series, DatetimeIndex
+            or anything pd.to_datetime accepts). NaT values are dropped.
+        weights (array-like, optional): Per-event weights to sum instead
+            of counting events (e.g. pre-aggregated daily counts).
+        groups (array-like of int, optional): Per-event group codes in
+            [0, n_groups) (e.g. from pd.factorize) to build one set of
+            grids per group in the same pass.
+        n_groups (int, optional): Number of groups. Defaults to
+            max(groups) + 1.
+
+    Returns:
+        tuple: (years, grids) where `years` holds every ISO year from the
+            first to the last event (empty years included) and `grids` is
+            a float array of shape (len(years), 7, 53), or
+            (n_groups, len(years), 7, 53) if `groups` is given.
+            Columns past year_calendar(year).weeks are always zero.
+    """
+    when = pd.DatetimeIndex(pd.to_datetime(when))
+    valid = np.asarray(~when.isna())
+    iso = when[valid].isocalendar()
+    y = iso['year'].to_numpy(dtype=np.int64)
+    w = iso['week'].to_numpy(dtype=np.int64) - 1
+    d = iso['day'].to_numpy(dtype=np.int64) - 1
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[valid]
+    shape = ()
+    if groups is not None:
+        groups = np.asarray(groups, dtype=np.int64)[valid]
+        shape = (n_groups if n_groups is not None else int(groups.max(initial=-1)) + 1,)
+
+    if len(y) == 0:
+        return np.array([], dtype=np.int64), np.zeros(shape + (0, 7, MAX_WEEKS))
+    years = np.arange(y.min(), y.max() + 1)
+    flat = ((y - years[0]) * 7 + d) * MAX_WEEKS + w
+    if groups is not None:
+        flat += groups * (len(years) * 7 * MAX_WEEKS)
+    grids = np.bincount(flat, weights=weights, minlength=int(np.prod(shape)) * len(years) * 7 * MAX_WEEKS)
+    return years, grids.astype(float).reshape(shape + (len(years), 7, MAX_WEEKS))
+
+
+def calendar_figure(years, grids, title:str, unit:str='events', theme:dict=None) -> go.Figure:
+    """Plots calendar grids as a single figure with a year selector.
+
+    Each year is one go.Heatmap trace coloured relative to that year's
+    busiest day; only the latest year is visible at first and a dropdown
+    switches between them. Cell gaps come from the heatmap's own
+    xgap/ygap, so no layout shapes are needed.
+
+    Args:
+        years (array-like): Years, as returned by calendar_grids.
+        grids (np.ndarray): Grids, as returned by calendar_grids.
+        title (str): Figure title; the selected year is prepended.
+        unit (str): What is being counted, for the hover text.
+        theme (dict, optional): 'colorscale', 'paper_bgcolor' and
+            'font_color'. Defaults to GITHUB_DARK.
+
+    Returns:
+        go.Figure: The figure. Write it with include_plotlyjs='directory'
+            to share one local copy of plotly.js between pages.
+    """
+    theme = theme or GITHUB_DARK
+    cals = [year_calendar(y) for y in years]
+    fig = go.Figure([go.Heatmap(z=grid[:, :cal.weeks],
+                                text=cal.dates,
+                                zmin=0,
+                                zmax=max(grid.max(), 1),
+                                colorscale=theme['colorscale'],
+                                showscale=False,
+                                xgap=4,
+                                ygap=4,
+                                hovertemplate=f'%{{z:.0f}} {unit} on %{{text}}<extra></extra>',
+                                name=str(cal.year),
+                                visible=i == len(cals) - 1)
+                     for i, (cal, grid) in enumerate(zip(cals, grids))])
+
+    def layout_for(cal:YearCalendar) -> dict:
+        return {'title.text': f'{cal.year} {title}',
+                'xaxis.tickvals': cal.tickvals,
+                'xaxis.ticktext': cal.ticktext,
+                'xaxis.range': [-0.5, cal.weeks - 0.5]}
+
+    buttons = [{'label': str(cal.year),
+                'method': 'update',
+                'args': [{'visible': [j == i for j in range(len(cals))]}, layout_for(cal)]}
+               for i, cal in enumerate(cals)]
+    fig.update_layout(paper_bgcolor=theme['paper_bgcolor'],
+                      plot_bgcolor=theme['paper_bgcolor'],
+                      font_color=theme['font_color'],
+                      updatemenus=[{'buttons': buttons[::-1],
+                                    'active': 0,
+                                    'x': 1, 'xanchor': 'right',
+                                    'y': 1.15, 'yanchor': 'bottom'}])
+    fig.update_xaxes(tickmode='array', title='Month', showgrid=False, zeroline=False)
+    fig.update_yaxes(tickvals=np.arange(7), ticktext=WEEKDAYS, tickmode='array',
+                     title='Day of Week', autorange='reversed', showgrid=False,
+                     zeroline=False, scaleanchor='x')
+    if cals:
+        fig.update_layout(layout_for(cals[-1]))
+    return fig
@@ -0,0 +1,265 @@
+''' Company-name canonicalization.
+
+The same advertiser shows up under several names in the exports, e.g.
+"Amazon", "amazon.com" and "Amazon Shopping". canonicalize maps every
+name to one canonical display name in three steps:
+
+    1. normalize: case fold, strip accents, URL schemes, domain suffixes,
+       punctuation, a leading "The" and legal suffixes ("Inc", "LLC",
+       ...). Names with the same normalized key are the same company.
+    2. Near-duplicate keys are found with a blocked character-trigram
+       index: keys are blocked by their first BLOCK characters, and only
+       keys sharing a trigram within a block are compared, so the cost
+       grows with the number of similar names rather than quadratically.
+       Two keys match if their trigram Jaccard similarity is at least
+       `threshold` (and they contain the same numbers), or if one is a
+       whole-word prefix of the other ("amazon" / "amazon shopping") and
+       the only one among all keys that extends it. A short key extended
+       by several ("american" by "american airlines" and "american
+       express") names no single company, so it is matched with none of
+       them and cannot join them.
+    3. Matches are merged transitively and each group is named after its
+       most frequent member.
+
+Mappings are cached as JSON (CACHE_PATH by default) so names keep the
+same canonical name across runs, and names already in the cache are not
+re-clustered. Caches written by an older version of the matching rules
+(CACHE_VERSION) are ignored.
+
+Functions:
+    normalize: Normalized matching keys of company names.
+    similar_pairs: Near-duplicate key pairs from the blocked trigram index.
+    canonicalize: Maps names to canonical names, with caching.
+
+Example usage:
+    >>> from between_bytes.core.company_names import canonicalize
+    >>> canonicalize(['Amazon', 'amazon.com', 'Amazon Shopping', 'Etsy'], weights=[5, 3, 1, 2])
+    Amazon             Amazon
+    amazon.com         Amazon
+    Amazon Shopping    Amazon
+    Etsy                 Etsy
+    dtype: object
+
+    $ python3 company_names.py --check
+    All CHECKS passed
+
+Author:
+    between_bytes contributors
+
+Version:
+    1.1
+'''
+import argparse
+import json
+import os
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CACHE_PATH = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'between_bytes' / 'company_names.json'
+BLOCK = 3
+MAX_POSTING = 256
+MIN_PREFIX = 4
+CACHE_VERSION = 2
+
+# (names, expected groups) run by --check
+CHECKS = [
+    (['Amazon', 'amazon.com', 'Amazon Shopping', 'AMAZON INC.'],
+     [{'Amazon', 'amazon.com', 'Amazon Shopping', 'AMAZON INC.'}]),
+    (['American', 'American Airlines', 'American Express', 'American Eagle Outfitters'],
+     [{'American'}, {'American Airlines'}, {'American Express'}, {'American Eagle Outfitters'}]),
+    (['Home', 'Home Depot', 'Home Chef'], [{'Home'}, {'Home Depot'}, {'Home Chef'}]),
+    (['Spotify', 'Spotify Music', 'Spotify Premium'], [{'Spotify'}, {'Spotify Music'}, {'Spotify Premium'}]),
+]
+
+_SCHEME = r'^[a-z]+://|^www\.'
+_DOMAIN = r'\.(?:com|net|org|io|co|app|ai|tv|me|us|uk|de|fr|ca|au|info|biz|shop|store)(?:\.[a-z]{2})?\b'
+_LEGAL = r'(?:\s(?:inc|llc|ltd|limited|corp|corporation|co|gmbh|plc|sa|ag|bv|pty))+$'
+
+
+def normalize(names) -> np.ndarray:
+    """Returns the normalized matching key of every name.
+
+    Args:
+        names (array-like of str): Company names; missing values become ''.
+
+    Returns:
+        np.ndarray: Keys (object dtype); only distinct names are processed.
+    """
+    codes, uniq = pd.factorize(pd.Series(names, dtype=object).fillna('').astype(str))
+    s = pd.Series([unicodedata.normalize('NFKD', u).encode('ascii', 'ignore').decode('ascii') for u in uniq],
+                  dtype=object).str.casefold()
+    s = (s.str.replace(_SCHEME, '', regex=True)
+          .str.replace(_DOMAIN, ' ', regex=True)
+          .str.replace('&', ' and ', regex=False)
+          .str.replace(r"['’]", '', regex=True)
+          .str.replace(r'[^a-z0-9]+', ' ', regex=True)
+          .str.strip()
+          .str.replace(r'^the\s', '', regex=True)
+          .str.replace(_LEGAL, '', regex=True))
+    return s.to_numpy(dtype=object)[codes] if len(codes) else np.array([], dtype=object)
+
+def _trigrams(keys:np.ndarray) -> pd.DataFrame:
+    ids, grams = [], []
+    for i, k in enumerate(keys):
+        padded = f' {k} '
+        g = {padded[j:j+3] for j in range(len(padded) - 2)}
+        ids.extend([i] * len(g))
+        grams.extend(g)
+    return pd.DataFrame({'id': np.asarray(ids, dtype=np.int64), 'gram': pd.Series(grams, dtype=object)})
+
+def similar_pairs(keys, threshold:float=0.8) -> np.ndarray:
+    """Finds near-duplicate pairs among distinct normalized keys.
+
+    Args:
+        keys (array-like of str): Distinct normalized keys.
+        threshold (float): Minimum trigram Jaccard similarity.
+
+    Returns:
+        np.ndarray: (n, 2) int array of matching key indices, i < j.
+    """
+    keys = np.asarray(keys, dtype=object)
+    grams = _trigrams(keys)
+    if grams.empty:
+        return np.empty((0, 2), dtype=np.int64)
+    n_grams = np.bincount(grams['id'], minlength=len(keys))
+
+    # postings: (block, trigram) -> keys; very common ones carry no signal
+    blocks = pd.Series(keys, dtype=object).str[:BLOCK].to_numpy(dtype=object)
+    posting, _ = pd.factorize(pd.Series(blocks[grams['id']], dtype=object) + '\0' + grams['gram'])
+    grams['posting'] = posting
+    sizes = np.bincount(posting)
+    grams = grams[(sizes[posting] > 1) & (sizes[posting] <= MAX_POSTING)]
+
+    cand = grams.merge(grams, on='posting', suffixes=('_a', '_b'))
+    cand = cand[cand['id_a'] < cand['id_b']]
+    inter = cand.groupby(['id_a', 'id_b']).size()
+    a = inter.index.get_level_values(0).to_numpy()
+    b = inter.index.get_level_values(1).to_numpy()
+    inter = inter.to_numpy()
+    jaccard = inter / (n_grams[a] + n_grams[b] - inter)
+
+    ka, kb = keys[a].astype(str), keys[b].astype(str)
+    digits = pd.Series(keys, dtype=object).str.replace(r'\D+', ' ', regex=True).str.strip().to_numpy(dtype=object)
+    same_digits = digits[a] == digits[b]
+    short = np.where(np.char.str_len(ka) <= np.char.str_len(kb), ka, kb)
+    long = np.where(np.char.str_len(ka) <= np.char.str_len(kb), kb, ka)
+    prefix = (np.char.str_len(short) >= MIN_PREFIX) & np.char.startswith(long, np.char.add(short, ' '))
+    prefix &= _extensions(keys, short) == 1
+
+    keep = ((jaccard >= threshold) & same_digits) | prefix
+    return np.column_stack([a[keep], b[keep]])
+
+def _extensions(keys:np.ndarray, short:np.ndarray) -> np.ndarray:
+    # number of keys starting with each `short` key plus a space, counted
+    # over all keys, since the candidate pairs may miss some; keys hold only
+    # [a-z0-9 ], so they lie between short + ' ' and short + '!'
+    ordered = np.sort(keys.astype(str))
+    return (np.searchsorted(ordered, np.char.add(short, '!'))
+            - np.searchsorted(ordered, np.char.add(short, ' ')))
+
+def _components(n:int, pairs:np.ndarray) -> np.ndarray:
+    """Connected-component labels of n nodes (min-label propagation)."""
+    labels = np.arange(n)
+    if len(pairs) == 0:
+        return labels
+    a, b = pairs[:, 0], pairs[:, 1]
+    while True:
+        m = np.minimum(labels[a], labels[b])
+        new = labels.copy()
+        np.minimum.at(new, a, m)
+        np.minimum.at(new, b, m)
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+def _load_cache(path:Path) -> dict:
+    try:
+        with open(path, encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # older caches may hold merges the current rules would not make
+    if not isinstance(cached, dict) or cached.get('version') != CACHE_VERSION:
+        return {}
+    return cached.get('names', {})
+
+def _save_cache(path:Path, mapping:dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'names': mapping}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def canonicalize(names, weights=None, cache:Path=None, threshold:float=0.8) -> pd.Series:
+    """Maps company names to canonical names.
+
+    Args:
+        names (array-like of str): Names; duplicates are allowed.
+        weights (array-like, optional): Per-name weights (e.g. event
+            counts); a group is named after its heaviest member.
+        cache (Path, optional): JSON cache of earlier mappings; it is read
+            and updated. None disables caching.
+        threshold (float): Minimum trigram Jaccard similarity.
+
+    Returns:
+        pd.Series: Canonical name, indexed by each distinct input name.
+    """
+    names = pd.Series(names, dtype=object).fillna('').astype(str)
+    w = pd.Series(np.ones(len(names)) if weights is None else np.asarray(weights, dtype=float))
+    w = w.groupby(names.to_numpy()).sum()
+    known = _load_cache(cache) if cache is not None else {}
+
+    new = [n for n in w.index if n not in known]
+    out = pd.Series({n: known[n] for n in w.index if n in known}, dtype=object)
+    if new:
+        # cluster new names together with the canonical names seen before,
+        # so new spellings join existing groups
+        anchors = sorted(set(known.values()) - set(new))
+        pool = np.asarray(new + anchors, dtype=object)
+        pool_w = np.concatenate([w[new].to_numpy(), np.full(len(anchors), np.inf)])
+        key_codes, keys = pd.factorize(pd.Series(normalize(pool), dtype=object))
+        labels = _components(len(keys), similar_pairs(keys, threshold))[key_codes]
+
+        # heaviest member names the group; ties go to the shorter name
+        order = np.lexsort((np.char.str_len(pool.astype(str)), -pool_w, labels))
+        first = np.r_[True, labels[order][1:] != labels[order][:-1]]
+        canon = pd.Series(pool[order][first], index=labels[order][first])
+        out = pd.concat([out, pd.Series(canon[labels[:len(new)]].to_numpy(), index=new, dtype=object)])
+        if cache is not None:
+            known.update(out.to_dict())
+            _save_cache(cache, known)
+    return out[w.index]
+
+def check() -> bool:
+    """Runs CHECKS without a cache; prints and returns whether all passed."""
+    ok = True
+    for names, expected in CHECKS:
+        canon = canonicalize(names)
+        groups = [set(g) for _, g in canon.groupby(canon.to_numpy()).groups.items()]
+        if sorted(map(sorted, groups)) != sorted(map(sorted, expected)):
+            print(f'FAILED: {names} grouped as {groups}, expected {expected}')
+            ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='company_names',
+                                     description='Group company-name variants under one canonical name')
+    parser.add_argument('names', nargs='*', help='company names')
+    parser.add_argument('-t', '--threshold', type=float, default=0.8, help='trigram Jaccard threshold')
+    parser.add_argument('-c', '--cache', type=Path, default=None, help='mapping cache (JSON)')
+    parser.add_argument('--check', action='store_true', help='run the built-in grouping checks instead')
+    args = parser.parse_args()
+
+    if args.check:
+        if not check():
+            raise SystemExit(1)
+        print('All CHECKS passed')
+        raise SystemExit(0)
+    if not args.names:
+        parser.error('give company names, or --check')
+    print(canonicalize(args.names, cache=args.cache, threshold=args.threshold).to_string())
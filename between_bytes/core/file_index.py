@@ -0,0 +1,453 @@
+''' Fast enumeration of a directory tree.
+
+scan walks a tree once with os.scandir, reusing the stat information the
+directory listing already carries, and appends every entry to
+preallocated NumPy columns (grown by doubling) instead of building a
+Path object per file. Each entry records the index of its parent row, so
+the tree structure is available as a plain integer array for later
+vectorized passes (e.g. subtree size rollups), and any view of the tree
+(all files, JSON only, ...) is a boolean filter over the same table.
+Because a parent is always scanned before its children, its row index is
+smaller, which lets depths and subtree sizes be computed level by level
+with bincount instead of recursion.
+
+Symbolic links are listed but not followed.
+
+FileIndex keeps such a table on disk (INDEX_DIR, one file per tree) and
+refreshes it incrementally: every directory is re-stat()ed, but only
+directories whose mtime changed are listed again; the entries of the
+others are taken from the stored index. A directory's mtime changes when
+entries are added, removed or renamed in it, not when a file is rewritten
+in place, which is fine for exports (they are unpacked, never edited).
+Callers that must notice in-place edits re-stat the files they care
+about with stat_files.
+Listings and stat() calls are fanned out over a thread pool one tree
+level at a time, which matters on slow or network filesystems. Callers
+can store extra string columns (e.g. a file type) in the index; they are
+kept for entries whose size and mtime did not change.
+
+The index file lists every file name in the export (message thread
+names included) and stays in INDEX_DIR between runs. This module does
+not log; `loaded` and `saved` tell callers whether it was read or
+written, so they can audit it with use_file/wrote_file(index.path).
+
+Classes:
+    FileIndex: Persistent, incrementally refreshed scan of a tree.
+
+Functions:
+    scan: Enumerates a directory tree into a DataFrame.
+    split_names: Vectorized stem/suffix split of file names.
+    depths: Depth of every row below the root.
+    subtree_sizes: Bottom-up total size of every subtree.
+    stat_files: Current size and mtime of many files, on a thread pool.
+
+Example usage:
+    >>> from between_bytes.core.file_index import scan
+    >>> files = scan(Path('~/fb-export').expanduser())
+    >>> files[files['suffix'] == '.json']['size'].sum()
+    >>> files['total'] = subtree_sizes(files['parent'], files['size'].where(~files['is_dir'], 0))
+
+    >>> index = FileIndex(export_root)
+    >>> inbox = index.find('your_facebook_activity/messages/inbox', suffix='.json')
+
+Author:
+    between_bytes contributors
+
+Version:
+    1.4
+'''
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+INITIAL_ROWS = 1 << 12
+INDEX_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'between_bytes' / 'file_index'
+INDEX_VERSION = 1
+STAT_WORKERS = 16
+STAT_CHUNK = 512
+_BASE_COLUMNS = ['path', 'name', 'parent', 'size', 'mtime', 'is_dir']
+
+
+class _Columns:
+    """Preallocated, growable columns for scan()."""
+    def __init__(self, capacity:int=INITIAL_ROWS):
+        self.n = 0
+        self.path = np.empty(capacity, dtype=object)
+        self.name = np.empty(capacity, dtype=object)
+        self.parent = np.empty(capacity, dtype=np.int64)
+        self.size = np.empty(capacity, dtype=np.int64)
+        self.is_dir = np.empty(capacity, dtype=bool)
+
+    def _grow(self):
+        for col in ('path', 'name', 'parent', 'size', 'is_dir'):
+            old = getattr(self, col)
+            new = np.empty(2 * len(old), dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, col, new)
+
+    def add(self, path:str, name:str, parent:int, size:int, is_dir:bool) -> int:
+        if self.n == len(self.path):
+            self._grow()
+        i = self.n
+        self.path[i] = path
+        self.name[i] = name
+        self.parent[i] = parent
+        self.size[i] = size
+        self.is_dir[i] = is_dir
+        self.n += 1
+        return i
+
+    def frame(self) -> pd.DataFrame:
+        n = self.n
+        return pd.DataFrame({'path': self.path[:n], 'name': self.name[:n], 'parent': self.parent[:n],
+                             'size': self.size[:n], 'is_dir': self.is_dir[:n]})
+
+
+def split_names(names) -> tuple:
+    """Splits file names into (stem, suffix) like Path.stem / Path.suffix.
+
+    Args:
+        names (array-like of str): File names (no directories).
+
+    Returns:
+        tuple: (stems, suffixes) as object arrays; suffixes include the
+            dot and are '' for names without one (or dotfiles).
+    """
+    # the rule pathlib uses: the last dot, unless it is first or last
+    names = np.asarray(names, dtype=object).tolist()
+    dots = [n.rfind('.') for n in names]
+    stems = [n[:i] if 0 < i < len(n) - 1 else n for n, i in zip(names, dots)]
+    suffixes = [n[i:] if 0 < i < len(n) - 1 else '' for n, i in zip(names, dots)]
+    return np.array(stems, dtype=object), np.array(suffixes, dtype=object)
+
+def scan(root:Path, errors:list=None) -> pd.DataFrame:
+    """Enumerates `root` and everything below it in a single pass.
+
+    Args:
+        root (Path): The directory to scan.
+        errors (list, optional): Receives (path, OSError) for directories
+            or entries that could not be read; they are skipped.
+
+    Returns:
+        pd.DataFrame: One row per entry, the root first, with 'path',
+            'name', 'parent' (row index of the parent directory, -1 for
+            the root), 'size' (bytes, from lstat), 'is_dir', 'stem' and
+            'suffix'.
+    """
+    root = Path(root)
+    cols = _Columns()
+    cols.add(str(root), root.name, -1, root.lstat().st_size, True)
+    stack = [0]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(cols.path[d])
+        except OSError as e:
+            if errors is not None:
+                errors.append((cols.path[d], e))
+            continue
+        with it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    size = entry.stat(follow_symlinks=False).st_size
+                except OSError as e:
+                    if errors is not None:
+                        errors.append((entry.path, e))
+                    continue
+                i = cols.add(entry.path, entry.name, d, size, is_dir)
+                if is_dir:
+                    stack.append(i)
+
+    df = cols.frame()
+    stems, suffixes = split_names(df['name'])
+    df['stem'] = np.where(df['is_dir'], df['name'], stems)
+    df['suffix'] = np.where(df['is_dir'], '', suffixes)
+    return df
+
+def depths(parent) -> np.ndarray:
+    """Returns the depth of every row (0 for roots, parent == -1).
+
+    Args:
+        parent (array-like of int): Parent row of every row, as in scan().
+
+    Returns:
+        np.ndarray: int64 depths.
+    """
+    parent = np.asarray(parent, dtype=np.int64)
+    depth = np.zeros(len(parent), dtype=np.int64)
+    has_parent = parent >= 0
+    # one vectorized step per level of the tree
+    while True:
+        new = np.where(has_parent, depth[np.maximum(parent, 0)] + 1, 0)
+        if np.array_equal(new, depth):
+            return depth
+        depth = new
+
+def subtree_sizes(parent, size, depth=None) -> np.ndarray:
+    """Sums `size` over every subtree, bottom-up.
+
+    Args:
+        parent (array-like of int): Parent row of every row, as in scan().
+        size (array-like of int): Own size of every row; pass 0 for
+            directories to get the total of the files below them.
+        depth (array-like of int, optional): Output of depths(parent).
+
+    Returns:
+        np.ndarray: int64 subtree totals (a file's total is its size).
+    """
+    parent = np.asarray(parent, dtype=np.int64)
+    total = np.asarray(size, dtype=np.float64).copy()
+    depth = depths(parent) if depth is None else np.asarray(depth)
+    order = np.argsort(depth, kind='stable')
+    bounds = np.searchsorted(depth[order], np.arange(depth.max(initial=0) + 2))
+    # deepest level first; each level adds its totals to its parents
+    for d in range(len(bounds) - 2, 0, -1):
+        rows = order[bounds[d]:bounds[d + 1]]
+        total += np.bincount(parent[rows], weights=total[rows], minlength=len(total))
+    return total.astype(np.int64)
+
+def stat_files(paths, workers:int=STAT_WORKERS) -> tuple:
+    """Stats many files on a thread pool (symlinks are not followed).
+
+    Args:
+        paths (iterable of str): The files.
+        workers (int): Concurrent stat() calls.
+
+    Returns:
+        tuple: int64 arrays of the size and the mtime (ns) of every file,
+            -1 for files that cannot be stat()ed.
+    """
+    paths = list(paths)
+    chunks = [paths[i:i + STAT_CHUNK] for i in range(0, len(paths), STAT_CHUNK)]
+    with ThreadPoolExecutor(workers) as pool:
+        stats = [s for chunk in pool.map(_lstat, chunks) for s in chunk]
+    ok = [not isinstance(s, OSError) for s in stats]
+    size = np.array([s.st_size if k else -1 for s, k in zip(stats, ok)], dtype=np.int64)
+    mtime = np.array([s.st_mtime_ns if k else -1 for s, k in zip(stats, ok)], dtype=np.int64)
+    return size, mtime
+
+
+def _lstat(paths:list) -> list:
+    out = []
+    for path in paths:
+        try:
+            out.append(os.stat(path, follow_symlinks=False))
+        except OSError as e:
+            out.append(e)
+    return out
+
+def _listdir(path:str):
+    try:
+        with os.scandir(path) as it:
+            return [(e.name, e.path, e.is_dir(follow_symlinks=False)) for e in it]
+    except OSError as e:
+        return e
+
+def _pack(strings) -> np.ndarray:
+    # strings as one NUL-separated byte buffer, so no pickling is needed
+    strings = np.asarray(strings, dtype=object).tolist()
+    return np.frombuffer('\0'.join(strings).encode('utf-8', 'surrogateescape'), dtype=np.uint8)
+
+def _unpack(buf:np.ndarray) -> np.ndarray:
+    return np.array(buf.tobytes().decode('utf-8', 'surrogateescape').split('\0'), dtype=object)
+
+
+class FileIndex:
+    """ A persistent, incrementally refreshed scan of a directory tree.
+
+    Attributes:
+        root (Path): The indexed directory.
+        path (Path): The index file.
+        workers (int): Threads used for listings and stat() calls.
+        loaded (bool): Whether refresh() read a stored index.
+        saved (bool): Whether save() has written the index file.
+
+    Methods:
+        refresh(errors): Rescans changed directories; returns the table.
+        save(df, columns): Stores the table, with extra string columns.
+        find(under, suffix): Paths of files below a subdirectory.
+    """
+    def __init__(self, root:Path, index_dir:Path=INDEX_DIR, workers:int=STAT_WORKERS):
+        self.root = Path(root).absolute()
+        digest = hashlib.sha1(str(self.root).encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+        self.path = Path(index_dir) / f'{digest}.npz'
+        self.workers = workers
+        self.frame = None
+        self.changed = False
+        self.loaded = self.saved = False
+
+    def _load(self) -> pd.DataFrame:
+        try:
+            with np.load(self.path, allow_pickle=False) as z:
+                if int(z['version']) != INDEX_VERSION or _unpack(z['root'])[0] != str(self.root):
+                    return None
+                df = pd.DataFrame({'path': _unpack(z['path']), 'name': _unpack(z['name']),
+                                   'parent': z['parent'], 'size': z['size'],
+                                   'mtime': z['mtime'], 'is_dir': z['is_dir']})
+                for key in z.files:
+                    if key.startswith('x_'):
+                        col = _unpack(z[key])
+                        df[key[2:]] = np.where(col == '', None, col)
+                return df
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, df:pd.DataFrame=None, columns=None):
+        """Writes the table to the index file.
+
+        Args:
+            df (pd.DataFrame, optional): The table from refresh(), possibly
+                with extra columns; defaults to the last refresh().
+            columns (iterable of str, optional): Extra string columns to
+                store; missing values are stored as ''. Defaults to every
+                column beyond those of refresh(), so columns stored by
+                other callers are kept.
+        """
+        df = self.frame if df is None else df
+        if columns is None:
+            columns = df.columns.difference(_BASE_COLUMNS + ['stem', 'suffix'])
+        arrays = {'version': np.array(INDEX_VERSION), 'root': _pack([str(self.root)]),
+                  'path': _pack(df['path']), 'name': _pack(df['name']),
+                  'parent': df['parent'].to_numpy(np.int64), 'size': df['size'].to_numpy(np.int64),
+                  'mtime': df['mtime'].to_numpy(np.int64), 'is_dir': df['is_dir'].to_numpy(bool)}
+        for col in columns:
+            arrays[f'x_{col}'] = _pack(df[col].fillna('').astype(str))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp.npz')
+        np.savez(tmp, **arrays)
+        os.replace(tmp, self.path)
+        self.frame = df
+        self.changed = False
+        self.saved = True
+
+    def refresh(self, errors:list=None) -> pd.DataFrame:
+        """Brings the index up to date with the tree.
+
+        Args:
+            errors (list, optional): Receives (path, OSError) for entries
+                that could not be read; they are skipped.
+
+        Returns:
+            pd.DataFrame: The same columns as scan(), plus 'mtime' (ns) and
+                any extra columns stored with save() (None for new or
+                changed entries). `changed` tells whether anything had to
+                be rescanned.
+        """
+        old = self._load()
+        self.loaded = old is not None
+        if old is not None:
+            o_parent = old['parent'].to_numpy()
+            # children of a directory are stored contiguously
+            counts = np.bincount(o_parent[1:], minlength=len(old))
+            first = np.full(len(old), len(old))
+            np.minimum.at(first, o_parent[1:], np.arange(1, len(old)))
+            o_mtime, o_is_dir = old['mtime'].to_numpy(), old['is_dir'].to_numpy()
+            o_cols = {c: old[c].to_numpy() for c in ('path', 'name', 'size', 'mtime', 'is_dir')}
+        old_pos = None
+        self.changed = old is None
+
+        st = os.stat(self.root, follow_symlinks=False)
+        blocks = [{'path': [str(self.root)], 'name': [self.root.name], 'parent': [-1],
+                   'size': [st.st_size], 'mtime': [st.st_mtime_ns], 'is_dir': [True], 'src': [0 if old is not None else -1]}]
+        n = 1
+        # (row, path, mtime, row in the old index)
+        frontier = [(0, str(self.root), st.st_mtime_ns, 0 if old is not None and old['path'].iat[0] == str(self.root) else -1)]
+        with ThreadPoolExecutor(self.workers) as pool:
+            while frontier:
+                reuse = [d for d in frontier if d[3] >= 0 and o_is_dir[d[3]] and o_mtime[d[3]] == d[2]]
+                rescan = [d for d in frontier if not (d[3] >= 0 and o_is_dir[d[3]] and o_mtime[d[3]] == d[2])]
+                if rescan:
+                    self.changed = True
+                    if old is not None and old_pos is None:
+                        old_pos = pd.Series(np.arange(len(old)), index=old['path'].to_numpy())
+                listings = list(pool.map(_listdir, [d[1] for d in rescan]))
+
+                level = []
+                for d in reuse:
+                    o = d[3]
+                    src = np.arange(first[o], first[o] + counts[o]) if counts[o] else np.empty(0, dtype=np.int64)
+                    level.append((d[0], {c: v[src] for c, v in o_cols.items()} | {'src': src}))
+                for d, listing in zip(rescan, listings):
+                    if isinstance(listing, OSError):
+                        if errors is not None:
+                            errors.append((d[1], listing))
+                        listing = []
+                    names, paths, dirs = zip(*listing) if listing else ((), (), ())
+                    src = (old_pos.reindex(paths).fillna(-1).to_numpy(np.int64) if old_pos is not None
+                           else np.full(len(paths), -1))
+                    level.append((d[0], {'path': np.array(paths, dtype=object), 'name': np.array(names, dtype=object),
+                                         'size': None, 'mtime': None, 'is_dir': np.array(dirs, dtype=bool), 'src': src}))
+
+                # fresh stats: every entry of a rescanned directory, and the
+                # subdirectories of reused ones
+                todo = [(b, b['is_dir'] if b['size'] is not None else np.ones(len(b['path']), dtype=bool))
+                        for _, b in level]
+                paths = [p for b, m in todo for p in b['path'][m]]
+                chunks = [paths[i:i + STAT_CHUNK] for i in range(0, len(paths), STAT_CHUNK)]
+                stats = (s for chunk in pool.map(_lstat, chunks) for s in chunk)
+                next_frontier = []
+                for (parent, b), (_, m) in zip(level, todo):
+                    if b['size'] is None:
+                        b['size'] = np.zeros(len(b['path']), dtype=np.int64)
+                        b['mtime'] = np.zeros(len(b['path']), dtype=np.int64)
+                    else:
+                        b['size'], b['mtime'] = b['size'].copy(), b['mtime'].copy()
+                    ok = np.ones(len(b['path']), dtype=bool)
+                    for i in np.flatnonzero(m):
+                        s = next(stats)
+                        if isinstance(s, OSError):
+                            if errors is not None:
+                                errors.append((b['path'][i], s))
+                            ok[i] = False
+                        else:
+                            b['size'][i], b['mtime'][i] = s.st_size, s.st_mtime_ns
+                    if not ok.all():
+                        b = {c: v[ok] for c, v in b.items()}
+                    b['parent'] = np.full(len(b['path']), parent)
+                    for i in np.flatnonzero(b['is_dir']):
+                        next_frontier.append((n + i, b['path'][i], b['mtime'][i], b['src'][i]))
+                    n += len(b['path'])
+                    blocks.append(b)
+                frontier = next_frontier
+
+        df = pd.DataFrame({c: np.concatenate([np.asarray(b[c]) for b in blocks])
+                           for c in _BASE_COLUMNS})
+        if old is not None:
+            src = np.concatenate([np.asarray(b['src'], dtype=np.int64) for b in blocks])
+            same = src >= 0
+            same[same] = ((o_cols['size'][src[same]] == df['size'].to_numpy()[same])
+                          & (o_cols['mtime'][src[same]] == df['mtime'].to_numpy()[same]))
+            self.changed |= len(df) != len(old) or not same[~df['is_dir'].to_numpy()].all()
+            for col in old.columns.difference(_BASE_COLUMNS):
+                df[col] = np.where(same, old[col].to_numpy()[np.maximum(src, 0)], None)
+        stems, suffixes = split_names(df['name'])
+        df['stem'] = np.where(df['is_dir'], df['name'], stems)
+        df['suffix'] = np.where(df['is_dir'], '', suffixes)
+        self.frame = df
+        return df
+
+    def find(self, under=None, suffix:str=None) -> list:
+        """Returns the paths of files below `under`, optionally by suffix.
+
+        Args:
+            under (str or Path, optional): Directory, absolute or relative
+                to the root; defaults to the whole tree.
+            suffix (str, optional): Only files with this suffix ('.json').
+
+        Returns:
+            list of str: Matching file paths, refreshing the index first if
+                it has not been refreshed yet.
+        """
+        df = self.refresh() if self.frame is None else self.frame
+        keep = ~df['is_dir']
+        if suffix is not None:
+            keep &= df['suffix'] == suffix
+        if under is not None:
+            prefix = str(self.root / under).rstrip(os.sep) + os.sep
+            keep &= df['path'].str.startswith(prefix)
+        return df.loc[keep, 'path'].tolist()
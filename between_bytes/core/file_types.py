@@ -0,0 +1,194 @@
+''' File type detection by content.
+
+Exports contain media without an extension (e.g. message attachments
+saved under their numeric id), which a suffix-based lookup cannot place.
+sniff reads a bounded header (HEADER_BYTES) of each file and matches it
+against the magic numbers of common image, video and audio containers,
+returning a MIME type such as 'image/jpeg'. Reads are fanned out over a
+thread pool, so classifying many files costs about one small read each.
+
+classify puts whole file tables into MIME type classes ('image', 'text',
+...): every distinct suffix is looked up in the mimetypes table once and
+the result broadcast back as a categorical, and files without a suffix
+are sniffed. with_types does this for the rows of a core.file_index table
+that have no stored 'type' yet, and stores the result in the index.
+Given a logger, both report the sniffed files as one 'headers' access
+(BtbLogger.use_files), since sniffing opens and reads each of them.
+
+Functions:
+    sniff_one: MIME type of one file from its header, or None.
+    sniff: MIME types of many files, read on a thread pool.
+    classify: MIME type classes of files, as a categorical (logs the sniffed files).
+    with_types: Fills in the 'type' column of a file table (logs the sniffed files).
+
+Example usage:
+    >>> from between_bytes.core.file_types import sniff
+    >>> sniff(['messages/inbox/a_1/photos/1234567'])
+    ['image/jpeg']
+    >>> classify(pd.Series(['.jpg', '.json', '']), pd.Series(['a.jpg', 'b.json', None]))
+    0    image
+    1     data
+    2      dir
+    dtype: category
+
+    $ python3 file_types.py file1 file2
+    file1    image/jpeg
+    file2    None
+
+Author:
+    between_bytes contributors
+
+Version:
+    1.2
+'''
+import argparse
+import mimetypes
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+HEADER_BYTES = 64
+SNIFF_WORKERS = 16
+SNIFF_CHUNK = 64
+
+# (offset, magic, MIME type); checked in order
+MAGIC = [
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'\x00\x00\x01\x00', 'image/vnd.microsoft.icon'),
+    (0, b'\x1aE\xdf\xa3', 'video/webm'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'#!AMR', 'audio/amr'),
+]
+# RIFF containers: the form type at offset 8
+RIFF = {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}
+# ISO base media (MP4 family): the major brand at offset 8
+FTYP = {b'heic': 'image/heic', b'heix': 'image/heic', b'mif1': 'image/heif', b'msf1': 'image/heif',
+        b'avif': 'image/avif', b'M4A ': 'audio/mp4', b'M4B ': 'audio/mp4', b'qt  ': 'video/quicktime',
+        b'3gp4': 'video/3gpp', b'3gp5': 'video/3gpp', b'3g2a': 'video/3gpp2'}
+
+
+def _match(head:bytes) -> str:
+    for offset, magic, mime in MAGIC:
+        if head.startswith(magic, offset):
+            return mime
+    if head[:4] == b'RIFF':
+        return RIFF.get(head[8:12])
+    if head[4:8] == b'ftyp':
+        return FTYP.get(head[8:12], 'video/mp4')
+    if len(head) >= 2 and head[0] == 0xff and head[1] & 0xe0 == 0xe0:
+        # MPEG audio frame sync (MP3 without an ID3 tag)
+        return 'audio/mpeg'
+    return None
+
+def sniff_one(path) -> str:
+    """Returns the MIME type of `path` from its first HEADER_BYTES bytes.
+
+    Returns:
+        str: The MIME type, or None if it is not recognized or the file
+            cannot be read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return _match(f.read(HEADER_BYTES))
+    except OSError:
+        return None
+
+def sniff(paths, workers:int=SNIFF_WORKERS) -> list:
+    """Sniffs the MIME types of many files on a thread pool.
+
+    Args:
+        paths (iterable of str or Path): The files.
+        workers (int): Concurrent reads.
+
+    Returns:
+        list: MIME type (or None) of every file, in input order.
+    """
+    paths = list(paths)
+    if len(paths) <= SNIFF_CHUNK:
+        return [sniff_one(p) for p in paths]
+    chunks = [paths[i:i + SNIFF_CHUNK] for i in range(0, len(paths), SNIFF_CHUNK)]
+    with ThreadPoolExecutor(workers) as pool:
+        return [m for chunk in pool.map(lambda c: [sniff_one(p) for p in c], chunks) for m in chunk]
+
+def classify(suffixes:pd.Series, paths:pd.Series=None, workers:int=SNIFF_WORKERS, logger=None) -> pd.Series:
+    """Returns the MIME type class of every file.
+
+    Args:
+        suffixes (pd.Series): File suffixes ('.jpg'; '' for none).
+        paths (pd.Series, optional): Paths aligned with `suffixes`, NaN
+            for directories; files without a suffix are then sniffed.
+        workers (int): Concurrent reads for sniffing.
+        logger (BtbLogger, optional): Audits the sniffed files as read
+            ('headers').
+
+    Returns:
+        pd.Series: Categorical classes ('image', 'data' for JSON, 'dir'
+            for directories and unknown files), indexed like `suffixes`.
+    """
+    if not mimetypes.inited:
+        mimetypes.init()
+    types = defaultdict((lambda : 'dir/dir'), mimetypes.types_map)
+    types['.json'] = 'data/json'
+    # look every distinct suffix up once, then broadcast by code
+    codes, uniq = pd.factorize(np.asarray(suffixes, dtype=object))
+    classes = pd.Series([types[u.lower()] for u in uniq], dtype=object).str.split('/', n=1).str[0]
+    class_codes, categories = pd.factorize(classes)
+    codes = class_codes[codes] if len(uniq) else codes
+    categories = list(categories)
+
+    if paths is not None:
+        todo = np.flatnonzero(paths.notna().to_numpy() & (np.asarray(suffixes, dtype=object) == ''))
+        if logger is not None and len(todo):
+            logger.use_files(paths.to_numpy()[todo], 'headers')
+        for i, mime in zip(todo, sniff(paths.to_numpy()[todo], workers)):
+            if mime is not None:
+                major = mime.split('/', 1)[0]
+                if major not in categories:
+                    categories.append(major)
+                codes[i] = categories.index(major)
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=suffixes.index)
+
+def with_types(files:pd.DataFrame, index=None, workers:int=SNIFF_WORKERS, logger=None) -> pd.DataFrame:
+    """Classifies the rows of a file table that have no 'type' yet.
+
+    Args:
+        files (pd.DataFrame): A core.file_index scan() or FileIndex table.
+        index (FileIndex, optional): The index `files` came from; new
+            types (and any rescan) are saved to it.
+        workers (int): Concurrent reads for sniffing.
+        logger (BtbLogger, optional): Audits the sniffed files as read
+            ('headers').
+
+    Returns:
+        pd.DataFrame: `files`, with a categorical 'type' column.
+    """
+    if 'type' not in files:
+        files['type'] = None
+    missing = files['type'].isna()
+    if missing.any():
+        todo = files[missing]
+        files.loc[missing, 'type'] = classify(todo['suffix'], todo['path'].where(~todo['is_dir']),
+                                              workers, logger).astype(object)
+    if index is not None and (index.changed or missing.any()):
+        index.save(files)
+    files['type'] = files['type'].astype('category')
+    return files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='file_types', description='Identify files by their content')
+    parser.add_argument('files', nargs='+', help='files to identify')
+    args = parser.parse_args()
+
+    for file, mime in zip(args.files, sniff(args.files)):
+        print(f'{file}\t{mime}')
@@ -0,0 +1,256 @@
+''' Offline (city, region, country) to coordinates lookup.
+
+The gazetteer is a single NumPy structured array of fixed-size records
+(key, latitude, longitude, country code), sorted by key and memory-mapped
+from disk, so loading it costs nothing and lookups are a vectorized
+binary search (np.searchsorted) over 64-bit keys. Keys are BLAKE2b hashes
+of normalized place names at four levels:
+
+    1. city|region|country
+    2. city||country       (the most populous city of that name)
+    3. |region|country     (population-weighted region centroid)
+    4. ||country           (population-weighted country centroid,
+                            keyed by both ISO code and country name)
+
+A query falls through the levels until one matches.
+
+The bundled index (gazetteer.npy) was built from the GeoNames
+cities15000 dump and is licensed CC BY 4.0 (https://www.geonames.org).
+It can be rebuilt from any GeoNames cities dump with:
+
+    $ python3 gazetteer.py build cities15000.txt admin1CodesASCII.txt countryInfo.txt
+
+Functions:
+    normalize: Normalizes place-name strings for hashing.
+    place_keys: Hashes normalized place names into index keys.
+    build: Builds an index file from GeoNames dumps.
+    get_gazetteer: Returns the shared default Gazetteer.
+
+Classes:
+    Gazetteer: A loaded index that resolves place names in bulk.
+
+Author:
+    between_bytes contributors
+
+Version:
+    1.0
+'''
+import argparse
+import unicodedata
+from functools import lru_cache
+from hashlib import blake2b
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+INDEX_PATH = Path(__file__).parent / 'gazetteer.npy'
+RECORD = np.dtype([('key', '<u8'), ('lat', '<f4'), ('lon', '<f4'), ('cc', 'S2')])
+LEVELS = ['city', 'city_any_region', 'region', 'country']
+
+GEONAMES_COLS = {1: 'name', 2: 'asciiname', 4: 'lat', 5: 'lon',
+                 8: 'cc', 10: 'admin1', 14: 'population'}
+
+
+def normalize(values) -> np.ndarray:
+    """Case-folds, strips accents and punctuation from place names.
+
+    Args:
+        values (array-like): Place names; missing values become ''.
+
+    Returns:
+        np.ndarray: Normalized names (object dtype).
+    """
+    s = pd.Series(values, dtype=object).fillna('').astype(str)
+    codes, uniques = pd.factorize(s)
+    clean = [' '.join(''.join(ch for ch in unicodedata.normalize('NFKD', u)
+                              if ch.isalnum() or ch.isspace()).casefold().split())
+             for u in uniques]
+    return np.asarray(clean, dtype=object)[codes] if len(codes) else np.array([], dtype=object)
+
+
+def place_keys(city, region, country) -> np.ndarray:
+    """Hashes (already normalized) place names into 64-bit index keys.
+
+    Only the unique combinations are hashed, so the cost is per distinct
+    place rather than per row.
+
+    Args:
+        city, region, country (array-like): Normalized names of equal length.
+
+    Returns:
+        np.ndarray: uint64 keys.
+    """
+    joined = pd.Series(city, dtype=object) + '|' + pd.Series(region, dtype=object).values \
+        + '|' + pd.Series(country, dtype=object).values
+    codes, uniques = pd.factorize(joined)
+    hashed = np.fromiter((int.from_bytes(blake2b(u.encode('utf-8'), digest_size=8).digest(), 'little')
+                          for u in uniques), dtype=np.uint64, count=len(uniques))
+    return hashed[codes]
+
+
+class Gazetteer:
+    """ A memory-mapped gazetteer index.
+
+    Attributes:
+        index (np.ndarray): Sorted records of dtype RECORD.
+
+    Methods:
+        lookup(city, region, country): Resolve places in bulk.
+    """
+    def __init__(self, path:Path=INDEX_PATH):
+        self.index = np.load(path, mmap_mode='r')
+        self._keys = self.index['key']
+
+    def _find(self, keys:np.ndarray) -> np.ndarray:
+        """Returns the index row of every key, or -1 where it is absent."""
+        pos = np.searchsorted(self._keys, keys)
+        pos[pos == len(self._keys)] = 0
+        return np.where(self._keys[pos] == keys, pos, -1)
+
+    def lookup(self, city, region, country) -> pd.DataFrame:
+        """Resolves places to coordinates in bulk.
+
+        Args:
+            city, region, country (array-like): Raw place names of equal
+                length, as found in the export. `country` may be an ISO
+                3166 alpha-2 code or a country name.
+
+        Returns:
+            pd.DataFrame: 'latitude', 'longitude' (NaN if unresolved) and
+                'level' (the LEVELS entry that matched, or None) per input.
+
+        Note:
+            Only distinct places are normalized, hashed and searched; the
+            results are broadcast back to every input row.
+        """
+        places = pd.MultiIndex.from_arrays([pd.Series(v, dtype=object).fillna('').astype(str).to_numpy()
+                                            for v in (city, region, country)])
+        codes, uniques = places.factorize()
+        out = self._lookup_unique(*(normalize(uniques.get_level_values(i)) for i in range(3)))
+        return out.take(codes).reset_index(drop=True)
+
+    def _lookup_unique(self, city, region, country) -> pd.DataFrame:
+        blank = np.full(len(city), '', dtype=object)
+
+        # country names and codes both resolve to the ISO code
+        crow = self._find(place_keys(blank, blank, country))
+        cc = np.where(crow >= 0,
+                      np.char.lower(self.index['cc'][np.maximum(crow, 0)].astype(str)).astype(object),
+                      country)
+
+        row = np.full(len(city), -1, dtype=np.int64)
+        level = np.full(len(city), -1, dtype=np.int8)
+        for i, keys in enumerate((place_keys(city, region, cc),
+                                  place_keys(city, blank, cc),
+                                  place_keys(blank, region, cc))):
+            todo = row < 0
+            if not todo.any():
+                break
+            found = self._find(keys[todo])
+            row[todo] = found
+            level[np.flatnonzero(todo)[found >= 0]] = i
+        todo = row < 0
+        row[todo] = crow[todo]
+        level[todo & (crow >= 0)] = 3
+
+        hit = row >= 0
+        recs = self.index[np.maximum(row, 0)]
+        return pd.DataFrame({'latitude': np.where(hit, recs['lat'], np.nan),
+                             'longitude': np.where(hit, recs['lon'], np.nan),
+                             'level': np.asarray(LEVELS + [None], dtype=object)[level]})
+
+
+@lru_cache(maxsize=1)
+def get_gazetteer() -> Gazetteer:
+    """Returns the shared Gazetteer over the bundled index."""
+    return Gazetteer()
+
+
+def _weighted_centroids(df:pd.DataFrame, by:list) -> pd.DataFrame:
+    w = df['population'].clip(lower=1)
+    g = df.assign(wlat=df['lat'] * w, wlon=df['lon'] * w, w=w).groupby(by)
+    out = g[['wlat', 'wlon', 'w']].sum()
+    return pd.DataFrame({'lat': out['wlat'] / out['w'],
+                         'lon': out['wlon'] / out['w']}).reset_index()
+
+
+def build(cities:Path, admin1:Path, countries:Path, out:Path=INDEX_PATH) -> int:
+    """Builds a gazetteer index from GeoNames dump files.
+
+    Args:
+        cities (Path): A GeoNames cities dump (e.g. cities15000.txt).
+        admin1 (Path): admin1CodesASCII.txt, for region names.
+        countries (Path): countryInfo.txt, for country names.
+        out (Path): Where to write the index.
+
+    Returns:
+        int: Number of records written.
+    """
+    df = pd.read_csv(cities, sep='\t', header=None, usecols=list(GEONAMES_COLS),
+                     dtype={8: str, 10: str}, keep_default_na=False, quoting=3)
+    df = df.rename(columns=GEONAMES_COLS)
+    df['population'] = pd.to_numeric(df['population'], errors='coerce').fillna(0)
+    a1 = pd.read_csv(admin1, sep='\t', header=None, usecols=[0, 1, 2], names=['code', 'name', 'ascii'],
+                     dtype=str, keep_default_na=False, quoting=3)
+    a1 = a1.set_index('code')
+    co = pd.read_csv(countries, sep='\t', header=None, comment='#', usecols=[0, 4], names=['cc', 'name'],
+                     dtype=str, keep_default_na=False, quoting=3)
+
+    df['region'] = (df['cc'] + '.' + df['admin1']).map(a1['ascii']).fillna('')
+    df = df.sort_values('population', ascending=False, kind='stable')
+    ncc = normalize(df['cc'])
+    nreg = normalize(df['region'])
+    blank = np.full(len(df), '', dtype=object)
+
+    parts = []
+    for name_col in ('name', 'asciiname'):
+        ncity = normalize(df[name_col])
+        parts.append((place_keys(ncity, nreg, ncc), df))
+        parts.append((place_keys(ncity, blank, ncc), df))
+    regions = _weighted_centroids(df[df['region'] != ''], ['cc', 'region'])
+    rblank = np.full(len(regions), '', dtype=object)
+    parts.append((place_keys(rblank, normalize(regions['region']), normalize(regions['cc'])), regions))
+    nations = _weighted_centroids(df, ['cc']).merge(co, on='cc', how='left').fillna({'name': ''})
+    nblank = np.full(len(nations), '', dtype=object)
+    parts.append((place_keys(nblank, nblank, normalize(nations['cc'])), nations))
+    named = nations[nations['name'] != '']
+    parts.append((place_keys(np.full(len(named), '', dtype=object), np.full(len(named), '', dtype=object),
+                             normalize(named['name'])), named))
+
+    recs = np.empty(sum(len(k) for k, _ in parts), dtype=RECORD)
+    i = 0
+    for keys, src in parts:
+        n = len(keys)
+        recs['key'][i:i+n] = keys
+        recs['lat'][i:i+n] = src['lat'].to_numpy()
+        recs['lon'][i:i+n] = src['lon'].to_numpy()
+        recs['cc'][i:i+n] = src['cc'].str.encode('ascii').to_numpy()
+        i += n
+    # earlier parts (more specific, more populous) win on duplicate keys
+    _, first = np.unique(recs['key'], return_index=True)
+    recs = recs[np.sort(first)]
+    recs.sort(order='key', kind='stable')
+    np.save(out, recs)
+    return len(recs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='gazetteer',
+                                     description='Build or query the offline gazetteer index')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    b = sub.add_parser('build', help='build the index from GeoNames dumps')
+    b.add_argument('cities', type=Path, help='GeoNames cities dump (e.g. cities15000.txt)')
+    b.add_argument('admin1', type=Path, help='admin1CodesASCII.txt')
+    b.add_argument('countries', type=Path, help='countryInfo.txt')
+    b.add_argument('-o', '--out', type=Path, default=INDEX_PATH, help='index path')
+    q = sub.add_parser('lookup', help='resolve one place')
+    q.add_argument('city')
+    q.add_argument('region')
+    q.add_argument('country')
+    args = parser.parse_args()
+
+    if args.cmd == 'build':
+        print(f'Wrote {build(args.cities, args.admin1, args.countries, args.out)} records to {args.out}')
+    else:
+        print(get_gazetteer().lookup([args.city], [args.region], [args.country]).iloc[0].to_dict())
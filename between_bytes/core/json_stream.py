@@ -0,0 +1,163 @@
+''' Incremental reader for large JSON exports.
+
+Most Facebook export files are a single object holding one big array of
+records, e.g. {"off_facebook_activity_v2": [{...}, {...}, ...]}. Loading
+such a file with json.load or pd.read_json materializes every record at
+once. iter_array instead reads the file in fixed-size chunks and decodes
+one array element at a time with json.JSONDecoder.raw_decode, so memory
+is bounded by the chunk size plus the largest single record.
+
+An element is only yielded once the next non-whitespace character after
+it (a ',' or ']') is in the buffer, so a number cut by a chunk boundary
+("4444" of "4444.5") is decoded again after reading more.
+
+Only the standard library is used.
+
+Functions:
+    iter_array: Yields the elements of a top-level array one at a time.
+    check: Compares iter_array with json.loads on CHECKS at every chunk size.
+
+Example usage:
+    >>> from between_bytes.core.json_stream import iter_array
+    >>> for site in iter_array(path, 'off_facebook_activity_v2'):
+    ...     print(site['name'], len(site['events']))
+
+    $ python3 json_stream.py --check
+    All CHECKS passed
+
+Author:
+    between_bytes contributors
+
+Version:
+    1.1
+'''
+import argparse
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Iterator
+
+CHUNK_SIZE = 1 << 20
+# an element is re-read if it ends this close to the end of the buffer
+# (longest cut-off number tail: "1e+" decodes as 1 followed by "e+")
+LOOKAHEAD = 8
+_WS = re.compile(r'[\s,]*')
+_SPACE = re.compile(r'\s*')
+
+# documents run by --check: (JSON text, array key, or None for a malformed document)
+CHECKS = [
+    ('{"a": [{"x":1}, 4444.5, 1e5, 77]}', 'a'),
+    ('{"meta": {"b": [0]}, "a": [-1.25E-3, true, false, null, "q\\"]\\u00e9", [1, [2.5e+10]], {}, []]}', 'a'),
+    ('{"a" :\n  [ 12345678901234567890 ,\n 0.000001 ]\n}', 'a'),
+    ('{"a": []}', 'a'),
+    ('{"a": [1 2]}', None),
+    ('{"a": [1.5, 2', None),
+]
+
+
+def iter_array(path:Path, key:str, chunk_size:int=CHUNK_SIZE) -> Iterator:
+    """Yields the elements of the array stored under `key`, one at a time.
+
+    The array is located by the first occurrence of `"key": [` in the
+    file, which is unambiguous for the export's top-level keys.
+
+    Args:
+        path (Path): The JSON file.
+        key (str): Name of the array to stream.
+        chunk_size (int): Characters read per chunk.
+
+    Yields:
+        The decoded array elements (usually dicts).
+
+    Raises:
+        KeyError: If `key` does not name an array in the file.
+        json.JSONDecodeError: If an element is malformed or truncated.
+    """
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    with open(path, encoding='utf-8') as f:
+        buf = ''
+        eof = False
+        # find the opening bracket, keeping a short tail in case the key
+        # straddles two chunks
+        while True:
+            m = start.search(buf)
+            if m:
+                pos = m.end()
+                break
+            if eof:
+                raise KeyError(key)
+            buf = buf[-(len(key) + 64):]
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf += chunk
+
+        while True:
+            pos = _WS.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            try:
+                if pos >= len(buf):
+                    raise json.JSONDecodeError('Unterminated array', buf, pos)
+                item, end = decoder.raw_decode(buf, pos)
+                after = _SPACE.match(buf, end).end()
+                # the element may have been cut short by the end of the
+                # buffer (a number stops early at a missing "." or "e")
+                complete = eof or len(buf) - after >= LOOKAHEAD
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                # element spans past the buffer: drop what is consumed and
+                # read more (doubling the request keeps huge records linear)
+                buf = buf[pos:]
+                pos = 0
+                chunk = f.read(max(chunk_size, len(buf)))
+                eof = not chunk
+                buf += chunk
+                continue
+            if after < len(buf) and buf[after] not in ',]':
+                raise json.JSONDecodeError("Expecting ',' delimiter", buf, after)
+            yield item
+            pos = end
+
+def check() -> bool:
+    """Runs CHECKS at every chunk size; prints and returns whether all passed."""
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'check.json'
+        for text, key in CHECKS:
+            path.write_text(text, encoding='utf-8')
+            expected = json.loads(text)[key] if key else json.JSONDecodeError
+            for chunk_size in range(1, len(text) + 2):
+                try:
+                    got = list(iter_array(path, key or 'a', chunk_size))
+                except json.JSONDecodeError:
+                    got = json.JSONDecodeError
+                if got != expected:
+                    print(f'FAILED: {text} at chunk_size {chunk_size}: got {got}, expected {expected}')
+                    ok = False
+                    break
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='json_stream',
+                                     description='Stream the elements of a top-level array of a JSON file')
+    parser.add_argument('path', nargs='?', type=Path, help='JSON file')
+    parser.add_argument('key', nargs='?', help='name of the array')
+    parser.add_argument('-c', '--chunk_size', type=int, default=CHUNK_SIZE, help='characters read per chunk')
+    parser.add_argument('--check', action='store_true', help='run the built-in decoding checks instead')
+    args = parser.parse_args()
+
+    if args.check:
+        if not check():
+            raise SystemExit(1)
+        print('All CHECKS passed')
+        raise SystemExit(0)
+    if args.key is None:
+        parser.error('give a JSON file and an array key, or --check')
+    print(f'{sum(1 for _ in iter_array(args.path, args.key, args.chunk_size))} elements in {args.key}')
@@ -13,17 +13,185 @@ allowing for more descriptive naming.
 One base class, BtbLogger, is provided for type hinting.
 It should not be used directly.
 
+Once set up, logging is queue-based: logging calls only put the record
+on an in-memory queue, and a single listener thread formats and writes
+it, so callers never wait on the output. Worker processes started with
+BtbLogger.pool() send their records to the parent over a pipe, where
+they join the same queue; a worker writes each record before returning
+its result, so nothing is lost when the pool is torn down.
+
+Messages may take %-style arguments (`logger.debug('Got %i rows', n)`),
+which are only formatted, by the listener, if the level is enabled; a
+disabled call costs a level check. use_files() reports access to many
+files as one audit record with a count and total size. With
+setup(audit_detail=...), every file access is also written, one line
+per file, to a separate gzip-compressed audit stream. With
+set_output(audit=...) (or setup(audit=...)), the audit records go to a
+structured, compressed and rotating NDJSON or Arrow file instead of the
+text output; see core.audit_log, which also reads such files back.
+
+BtbLogger.span() times a region of code, as a context manager or a
+decorator. When tracing is on (setup(trace=...)), finished spans of the
+main process and of pool workers are collected and written as a Chrome
+trace (chrome://tracing, ui.perfetto.dev) at exit; nesting follows from
+the timestamps per process and thread. When tracing is off, a span only
+checks a flag.
+
+BtbLogger.count(), gauge() and observe() feed an in-process metrics
+registry: counters add up, gauges keep their latest value and
+histograms count observations into fixed buckets. Every metric is
+labelled with the logger's name. Pool workers send their registry to
+the parent when they exit, where counters and histograms are added and
+gauges keep the highest value. With setup(metrics=...), the registry is
+written at exit in the Prometheus text format (.prom) and as JSON.
+
 When run as a script, this module runs the series of tests
-that were used to develop the module.
+that were used to develop the module, or with --bench, a benchmark
+of the logging overhead that fails if it exceeds BENCH_BOUNDS_NS.
 """
+import atexit
+import bisect
+import contextlib
+import gzip
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.util
+import os
+import queue
 import sys
+import threading
+import time
 from pathlib import Path
 import argparse
 from time import sleep
 
+from between_bytes.core.audit_log import AUDIT_MAX_BYTES, AuditHandler
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
 ABS_MSG = 'Don\'t call me directly. Use RootLogger or ChildLogger instead.'
 
+# finished spans of this process (Chrome trace events), None if not tracing
+_trace = None
+
+# latency buckets (seconds) of histograms, as in the Prometheus clients
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = 'btb_'
+_metrics = {}  # (kind, name, labels) -> value; [buckets, counts, sum] for histograms
+_metrics_lock = threading.Lock()
+
+
+def _metric(kind: str, name: str, labels: dict, value: float, buckets: tuple = BUCKETS) -> None:
+    key = (kind, name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        if kind == 'counter':
+            _metrics[key] = _metrics.get(key, 0) + value
+        elif kind == 'gauge':
+            _metrics[key] = value
+        else:
+            if key not in _metrics:
+                _metrics[key] = [buckets, [0] * (len(buckets) + 1), 0.0]
+            hist = _metrics[key]
+            hist[1][bisect.bisect_left(hist[0], value)] += 1
+            hist[2] += value
+
+
+def _merge_metrics(snapshot: dict) -> None:
+    """ Add the registry of a finished pool worker to this process's."""
+    with _metrics_lock:
+        for key, value in snapshot.items():
+            if key not in _metrics:
+                _metrics[key] = value
+            elif key[0] == 'counter':
+                _metrics[key] += value
+            elif key[0] == 'gauge':
+                _metrics[key] = max(_metrics[key], value)
+            elif _metrics[key][0] == value[0]:
+                ours = _metrics[key]
+                ours[1] = [a + b for a, b in zip(ours[1], value[1])]
+                ours[2] += value[2]
+
+
+def _fmt_num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = [f'{k}="{v}"' for k, v in labels + extra]
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def metrics_prometheus() -> str:
+    """ The metrics registry in the Prometheus text exposition format."""
+    lines, typed = [], set()
+    with _metrics_lock:
+        items = sorted(_metrics.items(), key=lambda kv: (kv[0][1], str(kv[0][2])))
+    for (kind, name, labels), value in items:
+        name = METRIC_PREFIX + name
+        if name not in typed:
+            lines.append(f'# TYPE {name} {kind}')
+            typed.add(name)
+        if kind != 'histogram':
+            lines.append(f'{name}{_fmt_labels(labels)} {_fmt_num(value)}')
+            continue
+        buckets, counts, total = value
+        cumulative = 0
+        for le, n in zip(list(buckets) + ['+Inf'], counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{_fmt_labels(labels, (("le", le),))} {cumulative}')
+        lines.append(f'{name}_sum{_fmt_labels(labels)} {_fmt_num(total)}')
+        lines.append(f'{name}_count{_fmt_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_json() -> dict:
+    """ The metrics registry as a JSON-serializable dict."""
+    out = {'counters': [], 'gauges': [], 'histograms': []}
+    with _metrics_lock:
+        items = sorted(_metrics.items(), key=lambda kv: (kv[0][1], str(kv[0][2])))
+    for (kind, name, labels), value in items:
+        entry = {'name': METRIC_PREFIX + name, 'labels': dict(labels)}
+        if kind == 'histogram':
+            entry.update(buckets=list(value[0]), counts=list(value[1]),
+                         sum=value[2], count=sum(value[1]))
+        else:
+            entry['value'] = value
+        out[kind + 's'].append(entry)
+    return out
+
+
+class _Span(contextlib.ContextDecorator):
+    """ A timed region; see BtbLogger.span()."""
+    def __init__(self, name: str, cat: str, attrs: dict):
+        self.name = name
+        self.cat = cat
+        self.attrs = attrs
+        self.start = None
+
+    def _recreate_cm(self):
+        # a fresh span per call of a decorated function
+        return _Span(self.name, self.cat, self.attrs)
+
+    def __enter__(self):
+        if _trace is not None:
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if _trace is not None and self.start is not None:
+            end = time.perf_counter_ns()
+            args = self.attrs if exc_type is None else {**self.attrs, 'error': exc_type.__name__}
+            _trace.append({'name': self.name, 'cat': self.cat, 'ph': 'X',
+                           'ts': self.start / 1000, 'dur': (end - self.start) / 1000,
+                           'pid': os.getpid(), 'tid': threading.get_native_id(), 'args': args})
+        return False
+
 
 class BtbLogger:
     """ Base class for logging wrapper.
@@ -51,7 +219,7 @@ class BtbLogger:
         """
         raise NotImplementedError(ABS_MSG)
 
-    def err(self, message: str) -> None:
+    def err(self, message: str, *args) -> None:
         """ Log an error message.
 
         This should be used for recoverable errors that will not
@@ -62,7 +230,7 @@ class BtbLogger:
         """
         raise NotImplementedError(ABS_MSG)
 
-    def warn(self, message: str) -> None:
+    def warn(self, message: str, *args) -> None:
         """ Log a warning message.
 
         This should be used for non-critical issues that may
@@ -73,7 +241,7 @@ class BtbLogger:
         """
         raise NotImplementedError(ABS_MSG)
 
-    def info(self, message: str) -> None:
+    def info(self, message: str, *args) -> None:
         """ Log an informational message.
 
         This should be used for general runtime information
@@ -84,7 +252,7 @@ class BtbLogger:
         """
         raise NotImplementedError(ABS_MSG)
 
-    def debug(self, message: str) -> None:
+    def debug(self, message: str, *args) -> None:
         """ Log a debug message.
 
         This should be used for detailed information
@@ -92,6 +260,8 @@ class BtbLogger:
 
         Args:
             message (str): The message to log.
+            *args: Values for %-style placeholders in `message`;
+                formatting only happens if the message is logged.
         """
         raise NotImplementedError(ABS_MSG)
 
@@ -117,6 +287,22 @@ class BtbLogger:
         """
         raise NotImplementedError(ABS_MSG)
 
+    def use_files(self, paths, message: str = 'contents', sizes=None) -> None:
+        """ Log access to many files as one audit record.
+
+        This should be used instead of use_file() in loops over files.
+        The record gives the number of files, their total size and
+        their common directory; the files themselves only go to the
+        audit detail stream, if enabled.
+
+        Args:
+            paths (iterable of str or Path): The files accessed.
+            message (str): The type of access (e.g. 'contents', 'metadata').
+            sizes (iterable of int, optional): The file sizes, if known;
+                else they are looked up, only when the record is logged.
+        """
+        raise NotImplementedError(ABS_MSG)
+
     def wrote_file(self, path: Path) -> None:
         """ Log file writing.
 
@@ -145,6 +331,180 @@ class BtbLogger:
         """
         raise NotImplementedError(ABS_MSG)
 
+    def count(self, name: str, n: float = 1, **labels) -> None:
+        """ Add to a counter metric.
+
+        Args:
+            name (str): The metric, e.g. 'messages_parsed_total'.
+            n (float): The amount to add. Defaults to 1.
+            **labels: Extra labels of the series.
+        """
+        raise NotImplementedError(ABS_MSG)
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        """ Set a gauge metric to the current value of something.
+
+        Args:
+            name (str): The metric, e.g. 'queue_depth'.
+            value (float): The value.
+            **labels: Extra labels of the series.
+        """
+        raise NotImplementedError(ABS_MSG)
+
+    def observe(self, name: str, value: float, buckets: tuple = BUCKETS, **labels) -> None:
+        """ Count a value into a histogram metric.
+
+        Args:
+            name (str): The metric, e.g. 'download_seconds'.
+            value (float): The value, e.g. a latency in seconds.
+            buckets (tuple): Sorted upper bounds of the buckets; fixed
+                per series. Defaults to BUCKETS.
+            **labels: Extra labels of the series.
+        """
+        raise NotImplementedError(ABS_MSG)
+
+    def span(self, name: str, **attrs) -> contextlib.ContextDecorator:
+        """ Time a region of code for the trace.
+
+        Use as `with logger.span('load'):` or as a decorator. Spans may
+        nest, and work in threads and in pool() workers.
+
+        Args:
+            name (str): The name of the region.
+            **attrs: Extra details shown with the span (e.g. sizes).
+
+        Returns:
+            contextlib.ContextDecorator: The span.
+        """
+        raise NotImplementedError(ABS_MSG)
+
+    def pool(self, processes: int = None) -> multiprocessing.pool.Pool:
+        """ Create a process pool whose workers log through this logger.
+
+        Loggers passed to (or created in) the workers send their records
+        back to the parent's output. Use instead of multiprocessing.Pool.
+
+        Args:
+            processes (int, optional): The number of worker processes.
+                Defaults to os.cpu_count().
+
+        Returns:
+            multiprocessing.pool.Pool: The pool.
+        """
+        raise NotImplementedError(ABS_MSG)
+
+
+class _PipeHandler(logging.handlers.QueueHandler):
+    """ Writes records straight to a multiprocessing.SimpleQueue."""
+    def enqueue(self, record):
+        self.queue.put(record)
+
+
+class _Pool(multiprocessing.pool.Pool):
+    """ A Pool that lets its workers exit normally when leaving `with`,
+    so they can send their metrics. On an exception, it terminates."""
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            self.join()
+        else:
+            self.terminate()
+
+
+def _send_metrics(pipe) -> None:
+    if _metrics:
+        pipe.put(('metrics', dict(_metrics)))
+
+
+class _SpanPipe:
+    """ Stands in for the span list in pool workers."""
+    def __init__(self, pipe):
+        self.append = pipe.put
+
+
+DETAIL_OFF = logging.CRITICAL + 1
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """ Queues records as they are; the listener formats them."""
+    def prepare(self, record):
+        return record
+
+
+class _GzipHandler(logging.FileHandler):
+    """ Appends records to a gzip-compressed text file."""
+    def _open(self):
+        return gzip.open(self.baseFilename, 'at', encoding='utf-8')
+
+    def flush(self):
+        # a flush per record would end a compressed block each time;
+        # the stream is flushed when the handler is closed at exit
+        pass
+
+
+def _file_size(path) -> int:
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return None
+
+
+def _use_files(auditor: logging.Logger, detail: logging.Logger, paths, message: str, sizes) -> None:
+    """ Shared body of use_files()."""
+    summary, detailed = auditor.isEnabledFor(logging.INFO), detail.isEnabledFor(logging.INFO)
+    if not (summary or detailed):
+        return
+    paths = [os.fspath(p) for p in paths]
+    if not paths:
+        return
+    sizes = [_file_size(p) for p in paths] if sizes is None else list(sizes)
+    if summary:
+        # the common prefix of all paths is that of the first and last in order
+        where = os.path.abspath(os.path.dirname(os.path.commonprefix([min(paths), max(paths)])))
+        total = int(sum(s for s in sizes if s))
+        auditor.info('[FILE I/O] - Accessed %s of %i files (%.1f MB) in %s', message, len(paths),
+                     total / 2**20, os.path.basename(where) or where,
+                     extra={'audit': {'event': 'files_read', 'access': message, 'path': where,
+                                      'count': len(paths), 'size': total}})
+        auditor.debug('[FILE I/O] - Full path: %s', where, extra={'audit': None})
+    if detailed:
+        _detail(detail, message, [os.path.abspath(p) for p in paths], sizes)
+
+
+def _detail(detail: logging.Logger, message: str, paths, sizes) -> None:
+    """ One tab-separated line per file for the audit detail stream."""
+    now = time.time()
+    module = detail.name.partition('.')[2] or 'main'
+    detail.info('\n'.join(f'{now:.3f}\t{module}\t{message}\t{p}\t{"" if s is None else s}'
+                          for p, s in zip(paths, sizes)))
+
+
+def _init_worker(pipe, log_level: int, aud_level: int, trace: bool, detail_level: int = DETAIL_OFF) -> None:
+    """ Pool initializer: send this process's records and spans to the parent."""
+    global _trace, _metrics_lock  # pylint: disable=global-statement
+    _trace = _SpanPipe(pipe) if trace else None
+    # a forked worker starts with a copy of the parent's registry
+    _metrics.clear()
+    _metrics_lock = threading.Lock()
+    multiprocessing.util.Finalize(None, _send_metrics, args=(pipe,), exitpriority=10)
+    for name, level in (('root_debug', log_level), ('root_audit', aud_level), ('root_detail', detail_level)):
+        logger = logging.getLogger(name)
+        logger.handlers = [_PipeHandler(pipe)]
+        logger.setLevel(level)
+        logger.propagate = False
+
+
+def _relay(pipe) -> None:
+    """ Pass records, spans and metrics from pool workers on to the parent."""
+    while (record := pipe.get()) is not None:
+        if isinstance(record, tuple):
+            _merge_metrics(record[1])
+        elif isinstance(record, dict):
+            if _trace is not None:
+                _trace.append(record)
+        else:
+            logging.getLogger(record.name).handle(record)
+
 
 class RootLogger(BtbLogger):
     """ Singleton class for logging. Use this class to access
@@ -157,25 +517,46 @@ class RootLogger(BtbLogger):
     Attributes:
         logger (logging.Logger): The logger object for debug messages.
         auditor (logging.Logger): The logger object for audit messages.
+        detail (logging.Logger): The logger object for the audit detail stream.
         children (dict): A dictionary of child loggers, indexed by name.
         log_fmt (str): The format string for debug messages.
         aud_fmt (str): The format string for audit messages.
+        queue (queue.SimpleQueue): Records waiting to be written.
+        listener (QueueListener): The thread writing queued records.
+        handlers (list): The output handlers, fed by the listener.
+        pipe (multiprocessing.SimpleQueue): Records from pool workers.
+        trace_path (Path): Where the trace is written at exit, if tracing.
+        metrics_path (Path): Where the metrics are written at exit, if set.
 
     Methods:
         crit(message:str, throw:Exception=None): Log a critical message.
             If an exception is provided, raise it with the message.
-        err(message:str): Log an error message.
-        warn(message:str): Log a warning message.
-        info(message:str): Log an informational message.
-        debug(message:str): Log a debug message.
+        err(message:str, *args): Log an error message.
+        warn(message:str, *args): Log a warning message.
+        info(message:str, *args): Log an informational message.
+        debug(message:str, *args): Log a debug message.
         use_inet(url:str): Log internet access.
         use_file(path:Path, message:str='contents'): Log file access.
+        use_files(paths, message:str='contents', sizes=None): Log access
+            to many files as one record.
         wrote_file(path:Path): Log file write.
         get_child(name:str): Get a child logger with the given name.
-        setup(verb:int, output:str): Set up the logger with
-            the given verbosity level and output.
         set_verb(verb:int): Set the verbosity level of the logger.
-        set_output(file:str=None, stream:str=None): Set the output for logging.
+        set_output(file:str=None, stream:str=None, audit:str=None, audit_format:str='ndjson',
+            audit_max_bytes:int=AUDIT_MAX_BYTES): Set the output for logging.
+        count(name:str, n:float=1, **labels): Add to a counter metric.
+        gauge(name:str, value:float, **labels): Set a gauge metric.
+        observe(name:str, value:float, buckets:tuple, **labels): Count a
+            value into a histogram metric.
+        span(name:str, **attrs): Time a region of code for the trace.
+        pool(processes:int=None): Create a process pool that logs here.
+        setup(verb:int, output:str, trace:str, metrics:str, audit_detail:str,
+            audit:str, audit_format:str): Set up the logger with the given
+            verbosity level, output, trace file, metrics file, audit
+            detail file and structured audit file.
+        write_trace(path:Path): Write the spans so far as a Chrome trace.
+        write_metrics(path:Path): Write the metrics as .prom and .json.
+        stop(): Write all queued records and stop the listener.
 
     WARNING:
         Do not modify any attributes directly.
@@ -187,9 +568,19 @@ class RootLogger(BtbLogger):
             cls.instance = super(RootLogger, cls).__new__(cls)
             cls.instance.logger  = logging.getLogger('root_debug')
             cls.instance.auditor = logging.getLogger('root_audit')
+            cls.instance.detail = logging.getLogger('root_detail')
+            cls.instance.detail.setLevel(DETAIL_OFF)
+            cls.instance.detail.propagate = False
             cls.instance.children = {}
             cls.instance.log_fmt = 'T+ {relativeCreated:03.0f}ms - {name} - PID:{process} - {levelname} - {message}'  # pylint: disable=line-too-long
             cls.instance.aud_fmt = 'T+ {relativeCreated:03.0f}ms - {name} - PID:{process} - {message}'  # pylint: disable=line-too-long
+            cls.instance.queue = queue.SimpleQueue()
+            cls.instance.listener = None
+            cls.instance.handlers = []
+            cls.instance.pipe = None
+            cls.instance.relay = None
+            cls.instance.trace_path = None
+            cls.instance.metrics_path = None
         return cls.instance
 
     def crit(self, message: str, throw: Exception = None) -> None:
@@ -197,46 +588,189 @@ class RootLogger(BtbLogger):
         if throw:
             raise throw(message)
 
-    def err(self, message: str) -> None:
-        self.logger.error(message)
+    def err(self, message: str, *args) -> None:
+        self.logger.error(message, *args)
 
-    def warn(self, message: str) -> None:
-        self.logger.warning(message)
+    def warn(self, message: str, *args) -> None:
+        self.logger.warning(message, *args)
 
-    def info(self, message: str) -> None:
-        self.logger.info(message)
+    def info(self, message: str, *args) -> None:
+        # level checked here first: a disabled call then costs one call less
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(message, *args)
 
-    def debug(self, message: str) -> None:
-        self.logger.debug(message)
+    def debug(self, message: str, *args) -> None:
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(message, *args)
 
     def use_inet(self, url: str) -> None:
-        self.auditor.warning('[INET] - Accessed URL: %s', url)
+        self.auditor.warning('[INET] - Accessed URL: %s', url,
+                             extra={'audit': {'event': 'inet', 'url': url}})
 
     def use_file(self, path:Path, message: str = 'contents') -> None:
-        self.auditor.info('[FILE I/O] - Accessed %s of file: %s',
-                          message, path.name)
-        self.auditor.debug('[FILE I/O] - Full path: %s', path.absolute())
+        # checked first, so a disabled call does not build the audit fields
+        if self.auditor.isEnabledFor(logging.INFO):
+            self.auditor.info('[FILE I/O] - Accessed %s of file: %s', message, path.name,
+                              extra={'audit': {'event': 'file_read', 'access': message, 'path': path}})
+        if self.auditor.isEnabledFor(logging.DEBUG):
+            self.auditor.debug('[FILE I/O] - Full path: %s', path.absolute(), extra={'audit': None})
+        if self.detail.isEnabledFor(logging.INFO):
+            _detail(self.detail, message, [path.absolute()], [None])
+
+    def use_files(self, paths, message: str = 'contents', sizes=None) -> None:
+        _use_files(self.auditor, self.detail, paths, message, sizes)
 
     def wrote_file(self, path: Path) -> None:
-        self.auditor.info('[FILE I/O] - Wrote file: %s', path.name)
-        self.auditor.debug('[FILE I/O] - Full path: %s', path.absolute())
+        if self.auditor.isEnabledFor(logging.INFO):
+            self.auditor.info('[FILE I/O] - Wrote file: %s', path.name,
+                              extra={'audit': {'event': 'file_write', 'path': path}})
+        if self.auditor.isEnabledFor(logging.DEBUG):
+            self.auditor.debug('[FILE I/O] - Full path: %s', path.absolute(), extra={'audit': None})
+        if self.detail.isEnabledFor(logging.INFO):
+            _detail(self.detail, 'wrote', [path.absolute()], [None])
 
     def get_child(self, name) -> 'ChildLogger':
         if name not in self.children:
             self.children[name] = ChildLogger(name)
         return self.children[name]
 
-    def setup(self, verb: int, output: Path = None):
+    def count(self, name: str, n: float = 1, **labels) -> None:
+        _metric('counter', name, {'module': 'main', **labels}, n)
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        _metric('gauge', name, {'module': 'main', **labels}, value)
+
+    def observe(self, name: str, value: float, buckets: tuple = BUCKETS, **labels) -> None:
+        _metric('histogram', name, {'module': 'main', **labels}, value, buckets)
+
+    def span(self, name: str, **attrs) -> _Span:
+        return _Span(name, 'main', attrs)
+
+    def pool(self, processes: int = None) -> multiprocessing.pool.Pool:
+        if self.pipe is None:
+            self.pipe = multiprocessing.SimpleQueue()
+            self.relay = threading.Thread(target=_relay, args=(self.pipe,),
+                                          name='btb-log-relay', daemon=True)
+            self.relay.start()
+        return _Pool(processes, initializer=_init_worker,
+                     initargs=(self.pipe, self.logger.level, self.auditor.level, _trace is not None,
+                               self.detail.level),
+                     context=multiprocessing.get_context())
+
+    def setup(self, verb: int, output: Path = None, trace: Path = None, metrics: Path = None,
+              audit_detail: Path = None, audit: Path = None, audit_format: str = 'ndjson'):
         """ Set up the logger with the given verbosity level and output.
 
+        Starts the listener thread; from then on, logging calls
+        only queue their records.
+
         Args:
             verb (int): The verbosity level.
                 0 is PROD, 1 is DEV, 2 is DEBUG, 3 is SUPER.
             output (str): The output file path. If None,
                 output will be sent to stdout.
+            trace (str, optional): If given, spans are recorded and
+                written to this file as a Chrome trace at exit.
+            metrics (str, optional): If given, the metrics are written
+                at exit to this path with suffixes .prom and .json.
+            audit_detail (str, optional): If given, every file access is
+                also appended to this gzip-compressed file, one
+                tab-separated line (time, logger, access, path, size)
+                per file.
+            audit (str, optional): If given, audit records are written
+                to this structured file instead of `output`; see
+                set_output().
+            audit_format (str): 'ndjson' or 'arrow'. Defaults to 'ndjson'.
         """
+        global _trace  # pylint: disable=global-statement
         self.set_verb(verb)
-        self.set_output(output)
+        self.set_output(output, audit=audit, audit_format=audit_format)
+        if trace is not None:
+            self.trace_path = Path(trace)
+            if _trace is None:
+                _trace = []
+        if metrics is not None:
+            self.metrics_path = Path(metrics)
+        if audit_detail is not None:
+            det_hand = _GzipHandler(audit_detail)
+            det_hand.setFormatter(logging.Formatter('{message}', style='{'))
+            det_hand.addFilter(logging.Filter(self.detail.name))
+            self.handlers.append(det_hand)
+            if self.listener is not None:
+                self.listener.handlers = tuple(self.handlers)
+            else:
+                self.detail.addHandler(det_hand)
+            self.detail.setLevel(logging.INFO)
+        if self.listener is None:
+            self.listener = logging.handlers.QueueListener(self.queue, *self.handlers)
+            self.listener.start()
+            for logger in (self.logger, self.auditor, self.detail):
+                logger.handlers = [_LocalQueueHandler(self.queue)]
+            atexit.register(self.stop)
+
+    def write_trace(self, path: Path):
+        """ Write the spans recorded so far as a Chrome trace.
+
+        Args:
+            path (Path): The JSON file to write.
+        """
+        events = list(_trace or [])
+        main_pid = os.getpid()
+        names = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                  'args': {'name': 'between_bytes' if pid == main_pid else f'worker {pid}'}}
+                 for pid in sorted({e['pid'] for e in events})]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': names + events, 'displayTimeUnit': 'ms'}, f, default=str)
+        self.wrote_file(Path(path))
+
+    def write_metrics(self, path: Path):
+        """ Write the metrics registry in Prometheus text format and JSON.
+
+        Adds the peak resident memory of this process and of its
+        finished children as the gauge 'max_rss_bytes', where the
+        platform reports it, and the records still waiting for the
+        listener thread as the gauge 'log_queue_depth'.
+
+        Args:
+            path (Path): The files written are path.prom and path.json.
+        """
+        path = Path(path)
+        _metric('gauge', 'log_queue_depth', {'process': 'main'}, self.queue.qsize())
+        if resource is not None:
+            # ru_maxrss is in KiB on Linux, bytes on macOS
+            unit = 1 if sys.platform == 'darwin' else 1024
+            for who, label in ((resource.RUSAGE_SELF, 'main'), (resource.RUSAGE_CHILDREN, 'children')):
+                _metric('gauge', 'max_rss_bytes', {'process': label},
+                        resource.getrusage(who).ru_maxrss * unit)
+        with open(path.with_suffix('.prom'), 'w', encoding='utf-8') as f:
+            f.write(metrics_prometheus())
+        self.wrote_file(path.with_suffix('.prom'))
+        with open(path.with_suffix('.json'), 'w', encoding='utf-8') as f:
+            json.dump(metrics_json(), f, indent=1)
+        self.wrote_file(path.with_suffix('.json'))
+
+    def stop(self):
+        """ Write all queued records and stop the listener.
+
+        Records, spans and metrics from pool workers are collected
+        first, then the trace and metrics (if set) are written. Logging afterwards writes
+        directly to the outputs. Called at exit.
+        """
+        if self.relay is not None:
+            self.pipe.put(None)
+            self.relay.join()
+            self.pipe = self.relay = None
+        if self.trace_path is not None:
+            self.write_trace(self.trace_path)
+            self.trace_path = None
+        if self.metrics_path is not None:
+            self.write_metrics(self.metrics_path)
+            self.metrics_path = None
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            for logger in (self.logger, self.auditor, self.detail):
+                logger.handlers = [h for h in self.handlers if h.filters[0].name == logger.name]
 
     def set_verb(self, verb: int):
         """ Set the verbosity level of the logger.
@@ -281,16 +815,25 @@ class RootLogger(BtbLogger):
             case _:
                 raise ValueError('Invalid logging level!')
 
-    def set_output(self, file: str = None, stream: str = None):
+    def set_output(self, file: str = None, stream: str = None, audit: str = None,
+                   audit_format: str = 'ndjson', audit_max_bytes: int = AUDIT_MAX_BYTES):
         """
         Sets the output for logging.
 
         Args:
             file (str, optional): The file path to log to. Defaults to None.
             stream (str, optional): The stream to log to. Defaults to None.
+            audit (str, optional): If given, audit records are written to
+                this file as structured events (core.audit_log.AuditHandler)
+                instead of as text to `file` or `stream`. A path ending in
+                .gz is gzip-compressed. Defaults to None.
+            audit_format (str): 'ndjson' or 'arrow'. Defaults to 'ndjson'.
+            audit_max_bytes (int): Size at which the audit file is rotated.
+                Defaults to AUDIT_MAX_BYTES.
 
         Raises:
             TypeError: If both `file` and `stream` are provided.
+            ValueError: If `audit_format` is unknown.
 
         """
         lf = logging.Formatter(self.log_fmt, style='{')
@@ -300,15 +843,24 @@ class RootLogger(BtbLogger):
         if file:
             # print('Logging to file: ', file)
             log_hand = logging.FileHandler(file)
-            aud_hand = logging.FileHandler(file)
+            aud_hand = None if audit else logging.FileHandler(file)
         else:
             # print('Logging to stream:', stream or 'stdout')
             log_hand = logging.StreamHandler(stream or sys.stderr)
-            aud_hand = logging.StreamHandler(stream or sys.stderr)
+            aud_hand = None if audit else logging.StreamHandler(stream or sys.stderr)
+        if audit:
+            aud_hand = AuditHandler(audit, audit_format, audit_max_bytes)
         log_hand.setFormatter(lf)
         aud_hand.setFormatter(af)
-        self.logger.addHandler(log_hand)
-        self.auditor.addHandler(aud_hand)
+        # both share the queue, so route by logger name
+        log_hand.addFilter(logging.Filter(self.logger.name))
+        aud_hand.addFilter(logging.Filter(self.auditor.name))
+        self.handlers += [log_hand, aud_hand]
+        if self.listener is not None:
+            self.listener.handlers = tuple(self.handlers)
+        else:
+            self.logger.addHandler(log_hand)
+            self.auditor.addHandler(aud_hand)
 
 
 class ChildLogger(BtbLogger):
@@ -320,20 +872,29 @@ class ChildLogger(BtbLogger):
     Attributes:
         logger (logging.Logger): The logger object for debug messages.
         auditor (logging.Logger): The logger object for audit messages.
+        detail (logging.Logger): The logger object for the audit detail stream.
         children (dict): A dictionary of child loggers, indexed by name.
         name (str): The name of the instance.
 
     Methods:
         crit(message:str, throw:Exception=None): Log a critical message.
             If an exception is provided, raise it with the message.
-        err(message:str): Log an error message.
-        warn(message:str): Log a warning message.
-        info(message:str): Log an informational message.
-        debug(message:str): Log a debug message.
+        err(message:str, *args): Log an error message.
+        warn(message:str, *args): Log a warning message.
+        info(message:str, *args): Log an informational message.
+        debug(message:str, *args): Log a debug message.
         use_inet(url:str): Log internet access.
         use_file(path:Path, message:str='contents'): Log file access.
+        use_files(paths, message:str='contents', sizes=None): Log access
+            to many files as one record.
         wrote_file(path:Path): Log file write.
         get_child(name:str): Get a child logger with the given name.
+        count(name:str, n:float=1, **labels): Add to a counter metric.
+        gauge(name:str, value:float, **labels): Set a gauge metric.
+        observe(name:str, value:float, buckets:tuple, **labels): Count a
+            value into a histogram metric.
+        span(name:str, **attrs): Time a region of code for the trace.
+        pool(processes:int=None): Create a process pool that logs here.
     """
 
     def __init__(self, name, parent=None):
@@ -342,6 +903,7 @@ class ChildLogger(BtbLogger):
             parent = RootLogger()
         self.logger = parent.logger.getChild(name)
         self.auditor = parent.auditor.getChild(name)
+        self.detail = parent.detail.getChild(name)
         self.children = {}
 
     def crit(self, message: str, throw: Exception = None):
@@ -349,38 +911,74 @@ class ChildLogger(BtbLogger):
         if throw:
             raise throw(message)
 
-    def err(self, message: str):
-        self.logger.error(message)
+    def err(self, message: str, *args):
+        self.logger.error(message, *args)
 
-    def warn(self, message: str):
-        self.logger.warning(message)
+    def warn(self, message: str, *args):
+        self.logger.warning(message, *args)
 
-    def info(self, message: str):
-        self.logger.info(message)
+    def info(self, message: str, *args):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(message, *args)
 
-    def debug(self, message: str):
-        self.logger.debug(message)
+    def debug(self, message: str, *args):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(message, *args)
 
     def use_inet(self, url: str):
-        self.auditor.warning('[INET] - Accessed URL %s', url)
+        self.auditor.warning('[INET] - Accessed URL %s', url,
+                             extra={'audit': {'event': 'inet', 'url': url}})
 
     def use_file(self, path: Path, message: str = 'contents'):
-        self.auditor.info('[FILE I/O] - Accessed %s of file %s',
-                          message, path.name)
-        self.auditor.debug('[FILE I/O] - Full path: %s', path.absolute())
+        # checked first, so a disabled call does not build the audit fields
+        if self.auditor.isEnabledFor(logging.INFO):
+            self.auditor.info('[FILE I/O] - Accessed %s of file %s', message, path.name,
+                              extra={'audit': {'event': 'file_read', 'access': message, 'path': path}})
+        if self.auditor.isEnabledFor(logging.DEBUG):
+            self.auditor.debug('[FILE I/O] - Full path: %s', path.absolute(), extra={'audit': None})
+        if self.detail.isEnabledFor(logging.INFO):
+            _detail(self.detail, message, [path.absolute()], [None])
+
+    def use_files(self, paths, message: str = 'contents', sizes=None):
+        _use_files(self.auditor, self.detail, paths, message, sizes)
 
     def wrote_file(self, path: Path):
-        self.auditor.info('[FILE I/O] - Wrote file %s', path.name)
-        self.auditor.debug('[FILE I/O] - Full path: %s', path.absolute())
+        if self.auditor.isEnabledFor(logging.INFO):
+            self.auditor.info('[FILE I/O] - Wrote file %s', path.name,
+                              extra={'audit': {'event': 'file_write', 'path': path}})
+        if self.auditor.isEnabledFor(logging.DEBUG):
+            self.auditor.debug('[FILE I/O] - Full path: %s', path.absolute(), extra={'audit': None})
+        if self.detail.isEnabledFor(logging.INFO):
+            _detail(self.detail, 'wrote', [path.absolute()], [None])
 
     def get_child(self, name):
         if name not in self.children:
             self.children[name] = ChildLogger(name, self)
         return self.children[name]
 
+    def count(self, name: str, n: float = 1, **labels):
+        _metric('counter', name, {'module': self.name, **labels}, n)
+
+    def gauge(self, name: str, value: float, **labels):
+        _metric('gauge', name, {'module': self.name, **labels}, value)
+
+    def observe(self, name: str, value: float, buckets: tuple = BUCKETS, **labels):
+        _metric('histogram', name, {'module': self.name, **labels}, value, buckets)
+
+    def span(self, name: str, **attrs):
+        return _Span(name, self.name, attrs)
+
+    def pool(self, processes: int = None):
+        return RootLogger().pool(processes)
+
 
 def demo_function(log: BtbLogger):
     """ A simple function for testing the logger."""
+    with log.span('demo', level='outer'), log.span('demo', level='inner'):
+        sleep(0.01)
+    log.count('demo_calls_total')
+    log.gauge('demo_depth', 3)
+    log.observe('demo_seconds', 0.01)
     log.debug('This is a debug message on demo')
     log.info('This is an info message on demo')
     log.warn('This is a warn message on demo')
@@ -391,14 +989,57 @@ def demo_function(log: BtbLogger):
     log.wrote_file(Path('path/to/demo.txt'))
 
 
+# upper bounds (ns per call, on the caller's thread) checked by --bench
+BENCH_BOUNDS_NS = {'disabled debug': 1000, 'disabled use_file': 1500,
+                   'info': 25000, 'use_file': 50000, 'use_files, per file': 2000}
+
+
+def benchmark(log: BtbLogger, n: int = 20000) -> dict:
+    """ Measure the logging overhead of the caller, in ns per call.
+
+    Disabled calls run at PROD verbosity, the others at DEV; set up
+    the RootLogger with a file output first.
+    """
+    def per_call(fn, reps):
+        start = time.perf_counter_ns()
+        for i in range(reps):
+            fn(i)
+        return (time.perf_counter_ns() - start) / reps
+
+    root, path = RootLogger(), Path('inbox/thread_1/message_1.json')
+    files = [f'inbox/thread_{i}/message_1.json' for i in range(5000)]
+    root.set_verb(0)
+    out = {'disabled debug': per_call(lambda i: log.debug('Parsed %i rows of %s', i, path), n),
+           'disabled use_file': per_call(lambda i: log.use_file(path), n)}
+    root.set_verb(1)
+    out['info'] = per_call(lambda i: log.info('Parsed %i rows of %s', i, path), n)
+    out['use_file'] = per_call(lambda i: log.use_file(path), n)
+    out['use_files, per file'] = per_call(lambda i: log.use_files(files, sizes=[0] * len(files)), 20) / len(files)
+    root.set_verb(0)
+    return out
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='SsiLogger tests')
     parser.add_argument('-v', '--verb', action='count',
                         default=0, help='Verbosity level (-v, -vv, -vvv)')
     parser.add_argument('-l', '--log', help='Log file path (default: stdout)')
+    parser.add_argument('-t', '--trace', help='Chrome trace file path')
+    parser.add_argument('-m', '--metrics', help='Metrics file path (.prom and .json)')
+    parser.add_argument('-d', '--audit_detail', help='Audit detail file path (gzip)')
+    parser.add_argument('-a', '--audit', help='Structured audit file path (.ndjson, .ndjson.gz or .arrow)')
+    parser.add_argument('--audit_format', choices=['ndjson', 'arrow'], default='ndjson',
+                        help='Format of the structured audit file')
+    parser.add_argument('--bench', action='store_true', help='Benchmark the logging overhead instead (ignores -v/-t/-m/-d)')
     args = parser.parse_args()
     r_log = RootLogger()
-    r_log.setup(args.verb, args.log)
+    if args.bench:
+        r_log.setup(0, args.log or os.devnull)
+        results = benchmark(r_log.get_child('bench'))
+        for case, ns in results.items():
+            print(f'{case:>20}: {ns:8.0f} ns/call (bound {BENCH_BOUNDS_NS[case]} ns)')
+        sys.exit(int(any(ns > BENCH_BOUNDS_NS[case] for case, ns in results.items())))
+    r_log.setup(args.verb, args.log, args.trace, args.metrics, args.audit_detail, args.audit, args.audit_format)
 
     print('====== TEST 1: RootLogger singleton ======')
     r_log_2 = RootLogger()
@@ -456,3 +1097,14 @@ if __name__ == '__main__':
     c_log.use_file(Path('path/to/test.txt'))
     sleep(0.002)
     c_log.wrote_file(Path('path/to/test.txt'))
+
+    print('====== TEST 8: Pool workers ======')
+    with r_log.pool(2) as p:
+        p.map(demo_function, [r_log.get_child(f'worker{i}') for i in range(4)])
+    print('Worker messages are logged above!')
+
+    print('====== TEST 9: Many files, one record ======')
+    c_log = r_log.get_child('batch')
+    c_log.use_files([Path(f'path/to/inbox/thread_{i}/message_1.json') for i in range(5000)],
+                    sizes=[1024] * 5000)
+    print('One record for 5000 files (the audit detail stream, if set, has them all)!')
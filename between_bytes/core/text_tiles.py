@@ -0,0 +1,232 @@
+''' Offline "text tile" mosaics.
+
+Renders labelled, coloured tiles without any images: every label gets a
+deterministic colour from a hash of its text, a small geometric glyph for
+its category and its text fitted into the tile. Tiles are laid out either
+as a two-level squarified treemap (categories, then labels, sized by
+weight) or as a plain word grid sorted by category, and drawn in one pass
+onto a single canvas with a glyph legend underneath. Text lines are
+rasterized once per (font size, line) and reused, since topics share
+many words.
+
+Glyphs are drawn as shapes rather than font symbols, so any font works.
+
+Functions:
+    squarify: Squarified treemap layout of weights in a rectangle.
+    grid: Equal-cell grid layout.
+    tile_color: Deterministic RGB colour of a label.
+    render_tiles: Draws labelled tiles onto an image.
+
+Example usage:
+    >>> from between_bytes.core.text_tiles import render_tiles
+    >>> img = render_tiles(['Cooking', 'Travel'], [2, 1], [0, 1], ['Food', 'Travel'], font_path)
+    >>> img.save('tiles.png')
+
+Author:
+    between_bytes contributors
+
+Version:
+    1.0
+'''
+import colorsys
+import textwrap
+from functools import lru_cache
+from hashlib import blake2b
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+BACKGROUND = (18, 18, 18)
+GLYPHS = ['circle', 'triangle', 'square', 'diamond', 'pentagon', 'hexagon',
+          'star', 'plus', 'ring', 'down', 'octagon', 'bar']
+MIN_FONT = 7
+LEGEND_H = 48
+
+
+def squarify(weights, x:float, y:float, width:float, height:float) -> np.ndarray:
+    """Squarified treemap layout (Bruls, Huizing & van Wijk, 2000).
+
+    Args:
+        weights (array-like): Positive tile weights.
+        x, y, width, height (float): The rectangle to fill.
+
+    Returns:
+        np.ndarray: (n, 4) float array of (x, y, w, h), in input order.
+    """
+    weights = np.asarray(weights, dtype=float)
+    n = len(weights)
+    rects = np.zeros((n, 4))
+    if n == 0 or weights.sum() <= 0 or width <= 0 or height <= 0:
+        return rects
+    order = np.argsort(-weights, kind='stable')
+    areas = weights[order] * (width * height / weights.sum())
+    i = 0
+    while i < n:
+        side = min(width, height)
+        # grow the row while its worst aspect ratio improves
+        j, total, big, small, best = i, 0.0, 0.0, np.inf, np.inf
+        while j < n:
+            a = areas[j]
+            t, b, s = total + a, max(big, a), min(small, a)
+            worst = max(side * side * b / (t * t), t * t / (side * side * s))
+            if worst > best:
+                break
+            best, total, big, small = worst, t, b, s
+            j += 1
+        thick = total / side
+        offset = 0.0
+        for k in range(i, j):
+            length = areas[k] / thick
+            if width >= height:
+                rects[order[k]] = (x, y + offset, thick, length)
+            else:
+                rects[order[k]] = (x + offset, y, length, thick)
+            offset += length
+        if width >= height:
+            x, width = x + thick, width - thick
+        else:
+            y, height = y + thick, height - thick
+        i = j
+    return rects
+
+def grid(n:int, width:float, height:float) -> np.ndarray:
+    """Lays n equal cells out row by row, as close to square as possible.
+
+    Returns:
+        np.ndarray: (n, 4) float array of (x, y, w, h).
+    """
+    if n == 0:
+        return np.zeros((0, 4))
+    cols = max(int(np.ceil(np.sqrt(n * width / height))), 1)
+    rows = -(-n // cols)
+    i = np.arange(n)
+    cw, ch = width / cols, height / rows
+    return np.column_stack([(i % cols) * cw, (i // cols) * ch, np.full(n, cw), np.full(n, ch)])
+
+def tile_color(label:str) -> tuple:
+    """Returns the deterministic RGB colour of a label."""
+    h = blake2b(label.casefold().encode('utf-8'), digest_size=4).digest()
+    r, g, b = colorsys.hsv_to_rgb(h[0] / 255 + h[1] / 65280, 0.45 + h[2] / 850, 0.55 + h[3] / 850)
+    return int(r * 255), int(g * 255), int(b * 255)
+
+def _draw_glyph(draw:ImageDraw.ImageDraw, kind:str, cx:float, cy:float, r:float, fill:tuple):
+    if r < 2:
+        return
+    if kind == 'circle':
+        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=fill)
+    elif kind == 'ring':
+        draw.ellipse((cx - r, cy - r, cx + r, cy + r), outline=fill, width=max(int(r / 3), 1))
+    elif kind == 'plus':
+        t = r / 3
+        draw.rectangle((cx - r, cy - t, cx + r, cy + t), fill=fill)
+        draw.rectangle((cx - t, cy - r, cx + t, cy + r), fill=fill)
+    elif kind == 'bar':
+        draw.rectangle((cx - r, cy - r / 3, cx + r, cy + r / 3), fill=fill)
+    elif kind == 'star':
+        ang = np.pi / 2 + np.arange(10) * np.pi / 5
+        rad = np.where(np.arange(10) % 2, r * 0.45, r)
+        draw.polygon(list(zip(cx + rad * np.cos(ang), cy - rad * np.sin(ang))), fill=fill)
+    else:
+        sides, rotation = {'triangle': (3, 0), 'down': (3, 180), 'square': (4, 45), 'diamond': (4, 0),
+                           'pentagon': (5, 0), 'hexagon': (6, 0), 'octagon': (8, 22.5)}[kind]
+        draw.regular_polygon((cx, cy, r), sides, rotation=rotation, fill=fill)
+
+def _fit_text(label:str, w:float, h:float, font_path:str, max_size:int):
+    # largest size whose wrapped lines really fit (measured on the cached
+    # masks); words are only split when nothing else fits
+    size = int(min(h * 0.4, max_size))
+    while size >= MIN_FONT:
+        per_line = max(int(w * 0.9 / (size * 0.5)), 1)
+        for split in ((False,) if size > MIN_FONT else (False, True)):
+            lines = textwrap.wrap(label, per_line, break_long_words=split) or [label]
+            if len(lines) * size * 1.2 <= h and all(_line_mask(font_path, size, l).width <= w * 0.92 for l in lines):
+                return size, lines
+        size = max(int(size * 0.85), MIN_FONT) if size > MIN_FONT else 0
+    return None, None
+
+@lru_cache(maxsize=64)
+def _font(font_path:str, size:int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, size)
+
+@lru_cache(maxsize=8192)
+def _line_mask(font_path:str, size:int, line:str) -> Image.Image:
+    # labels share many words and lines, so each (size, line) is only
+    # rasterized once and then stamped through as a mask
+    font = _font(font_path, size)
+    ascent, descent = font.getmetrics()
+    left, _, right, _ = font.getbbox(line)
+    mask = Image.new('L', (max(right - left, 1), ascent + descent))
+    ImageDraw.Draw(mask).text((-left, 0), line, font=font, fill=255)
+    return mask
+
+def render_tiles(labels, weights, categories, category_names, font_path:str,
+                 size:tuple=(4096, 2160), layout:str='treemap', max_font:int=96) -> Image.Image:
+    """Draws labelled, coloured tiles onto one image.
+
+    Args:
+        labels (list of str): Tile texts.
+        weights (array-like): Tile weights (treemap area).
+        categories (array-like of int): Category index of every label.
+        category_names (list of str): Names of the categories, for the
+            legend; category i is drawn with GLYPHS[i % len(GLYPHS)].
+        font_path (str): TrueType font for the text.
+        size (tuple): (width, height) of the tile area; the legend adds
+            LEGEND_H below it.
+        layout (str): 'treemap' or 'grid'.
+        max_font (int): Largest font size used for a label.
+
+    Returns:
+        Image.Image: The rendered RGB image.
+
+    Raises:
+        ValueError: If `layout` is unknown.
+    """
+    if layout not in ('treemap', 'grid'):
+        raise ValueError(f'Invalid layout {layout}')
+    weights = np.asarray(weights, dtype=float)
+    categories = np.asarray(categories, dtype=np.int64)
+    width, height = size
+    order = np.lexsort((np.asarray([l.casefold() for l in labels], dtype=object).astype(str), categories))
+    if layout == 'grid':
+        rects = np.empty((len(labels), 4))
+        rects[order] = grid(len(labels), width, height)
+    else:
+        # categories first, then the labels inside each category
+        totals = np.bincount(categories, weights=weights, minlength=len(category_names))
+        cat_rects = squarify(totals, 0, 0, width, height)
+        rects = np.zeros((len(labels), 4))
+        for c in np.flatnonzero(totals):
+            members = np.flatnonzero(categories == c)
+            rects[members] = squarify(weights[members], *cat_rects[c])
+
+    img = Image.new('RGB', (width, height + LEGEND_H), BACKGROUND)
+    draw = ImageDraw.Draw(img)
+    for label, cat, (x, y, w, h) in zip(labels, categories, rects):
+        x0, y0, x1, y1 = round(x), round(y), round(x + w) - 1, round(y + h) - 1
+        if x1 <= x0 or y1 <= y0:
+            continue
+        color = tile_color(label)
+        ink = (0, 0, 0) if sum(color) > 450 else (255, 255, 255)
+        draw.rectangle((x0, y0, x1, y1), fill=color, outline=BACKGROUND)
+        r = min(w, h) * 0.09
+        _draw_glyph(draw, GLYPHS[cat % len(GLYPHS)], x0 + 2.2 * r, y0 + 2.2 * r, r, ink)
+        # text goes below the glyph
+        text_top = y0 + 4.4 * r
+        font_size, lines = _fit_text(label, w, (y1 - text_top) * 0.9, font_path, max_font)
+        if font_size is not None:
+            step = font_size * 1.2
+            top = (text_top + y1) / 2 - step * len(lines) / 2
+            for i, line in enumerate(lines):
+                mask = _line_mask(font_path, font_size, line)
+                img.paste(ink, (round((x0 + x1 - mask.width) / 2), round(top + i * step)), mask)
+
+    # glyph legend
+    font = _font(font_path, LEGEND_H // 3)
+    x = LEGEND_H / 2
+    for c, name in enumerate(category_names):
+        if not np.any(categories == c):
+            continue
+        _draw_glyph(draw, GLYPHS[c % len(GLYPHS)], x, height + LEGEND_H / 2, LEGEND_H / 6, (230, 230, 230))
+        draw.text((x + LEGEND_H / 3, height + LEGEND_H / 2), name, font=font, fill=(230, 230, 230), anchor='lm')
+        x += LEGEND_H / 3 + draw.textlength(name, font=font) + LEGEND_H
+    return img
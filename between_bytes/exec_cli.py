@@ -60,15 +60,68 @@ def exec():
                             action=argparse.BooleanOptionalAction)
     mod_group.add_argument("--ntf", help="notifications module",
                             action=argparse.BooleanOptionalAction)
+    mod_group.add_argument("--dmd", help="dup_media module",
+                            action=argparse.BooleanOptionalAction)
+    mod_group.add_argument("--mmd", help="media_meta module (its geotagged photos also go on the ip_loc map)",
+                            action=argparse.BooleanOptionalAction)
     adv = parser.add_argument_group("Advanced", "Advanced options.")
     adv.add_argument("-l", "--log", help="Log file path, else stderr",
                         metavar="PATH/TO/LOG", default=None)
     adv.add_argument("-v", "--verbose", action="count", dest="v",
                         default=0, help="Logs verbosity (-v, -vv)")
+    adv.add_argument("--trace", help="Write a timeline of the run (Chrome trace / Perfetto JSON)",
+                        metavar="PATH/TO/TRACE.json", default=None)
+    adv.add_argument("--metrics", help="Write run metrics to PATH.prom (Prometheus text) and PATH.json",
+                        metavar="PATH/TO/METRICS", default=None)
+    adv.add_argument("--audit_detail", help="Also record every file access, one line each, in this gzip file",
+                        metavar="PATH/TO/AUDIT.tsv.gz", default=None)
+    adv.add_argument("--audit", help="Write the audit log as structured, rotating events (.gz to compress) instead of text",
+                        metavar="PATH/TO/AUDIT.ndjson.gz", default=None)
+    adv.add_argument("--audit_format", help="Format of the --audit file",
+                        choices=["ndjson", "arrow"], default="ndjson")
     adv.add_argument("--version", action="version",
                      version=f"%(prog)s {__version__}")
     mod_adv = parser.add_argument_group("Module Advanced Options")
     mod_adv.add_argument("--fsb_args", metavar="MODE", default=0, type=int)
+    mod_adv.add_argument("--fsb_min_share", metavar="FRAC", type=float, default=0.001,
+                         help="filesize_sunburst: smaller nodes are merged into 'other'")
+    mod_adv.add_argument("--fsb_max_depth", metavar="N", type=int, default=None,
+                         help="filesize_sunburst: deepest directory level drawn")
+    mod_adv.add_argument("--fsb_max_nodes", metavar="N", type=int, default=5000,
+                         help="filesize_sunburst: most nodes drawn")
+    mod_adv.add_argument("--fsb_no_index", action="store_true",
+                         help="filesize_sunburst/dup_media/media_meta: rescan the whole tree instead of using the file index")
+    mod_adv.add_argument("--fsb_dups", action="store_true",
+                         help="filesize_sunburst: colour extra copies of duplicated media")
+    mod_adv.add_argument("--dmd_all_files", action="store_true",
+                         help="dup_media: compare all files, not only media")
+    mod_adv.add_argument("--mmd_no_cache", action="store_true",
+                         help="media_meta: do not read or write the metadata cache in "
+                              "~/.cache/between_bytes/media_meta.sqlite (paths, capture times and GPS of every photo/video)")
+    mod_adv.add_argument("--ipl_popups", choices=["js", "svg", "png"], default="js",
+                         help="ip_loc map popup renderer")
+    mod_adv.add_argument("--ipl_geoip", metavar="PATH/TO/MMDB", default=None,
+                         help="MaxMind GeoIP2/GeoLite2 City database for ip_loc")
+    mod_adv.add_argument("--ipl_inet", action="store_true",
+                         help="let ip_loc look up IPs it cannot locate offline on ipinfo.io")
+    mod_adv.add_argument("--ipl_max_speed", metavar="KM/H", type=float, default=1000.0,
+                         help="ip_loc flags consecutive logins implying faster travel")
+    mod_adv.add_argument("--ntf_mode", choices=["report", "yearly"], default="report",
+                         help="notifications: one report page or one page per year")
+    mod_adv.add_argument("--ofa_top", metavar="N", type=int, default=10,
+                         help="off_fb_act: companies per timeline/ranking")
+    mod_adv.add_argument("--ofa_period", choices=["Y", "Q", "M"], default="Y",
+                         help="off_fb_act: ranking period (year, quarter, month)")
+    mod_adv.add_argument("--ofa_raw_names", action="store_true",
+                         help="off_fb_act: do not merge company name variants")
+    mod_adv.add_argument("--tps_no_cache", action="store_true",
+                         help="topics: do not use or fill the image cache")
+    mod_adv.add_argument("--tps_tile_px", metavar=("W", "H"), type=int, nargs=2, default=None,
+                         help="topics: fixed collage tile size (the collage grows to fit)")
+    mod_adv.add_argument("--tps_mode", choices=["images", "text"], default="images",
+                         help="topics: image collage (online) or text tiles (offline)")
+    mod_adv.add_argument("--tps_layout", choices=["treemap", "grid"], default="treemap",
+                         help="topics: text tile layout")
     args = parser.parse_args()
 
     run_mods = {"smp": args.smp,
@@ -77,12 +130,24 @@ def exec():
                 "tps": args.tps,
                 "fba": args.fba,
                 "fsb": args.fsb,
-                "ntf": args.ntf}
+                "ntf": args.ntf,
+                "dmd": args.dmd,
+                "mmd": args.mmd}
 
     in_path = Path(args.in_path)
     out_path = Path(args.out_path)
     out_path.mkdir(parents=True, exist_ok=True)
-    main(in_path=in_path, out_path=out_path, mods=run_mods, verbose=args.v, log=args.log, fsb_mode=args.fsb_args)
+    main(in_path=in_path, out_path=out_path, mods=run_mods, verbose=args.v, log=args.log, trace=args.trace, metrics=args.metrics,
+         audit_detail=args.audit_detail, audit=args.audit, audit_format=args.audit_format,
+         fsb_mode=args.fsb_args,
+         fsb_min_share=args.fsb_min_share, fsb_max_depth=args.fsb_max_depth, fsb_max_nodes=args.fsb_max_nodes,
+         fsb_no_index=args.fsb_no_index, fsb_dups=args.fsb_dups, dmd_all_files=args.dmd_all_files,
+         mmd_no_cache=args.mmd_no_cache,
+         ipl_popups=args.ipl_popups, ipl_geoip=args.ipl_geoip, ipl_inet=args.ipl_inet,
+         ipl_max_speed=args.ipl_max_speed, ntf_mode=args.ntf_mode,
+         ofa_top=args.ofa_top, ofa_period=args.ofa_period,
+         ofa_raw_names=args.ofa_raw_names, tps_no_cache=args.tps_no_cache,
+         tps_tile_px=args.tps_tile_px, tps_mode=args.tps_mode, tps_layout=args.tps_layout)
 
 
 if __name__ == "__main__":
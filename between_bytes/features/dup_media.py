@@ -0,0 +1,228 @@
+"""Duplicate media feature.
+
+Finds photos, videos and audio that are stored more than once in an
+export (the same picture in posts/media, in a message thread and in an
+album) and reports how much space the extra copies take, per directory.
+
+Files are narrowed down in three rounds, so most bytes are never read:
+
+    1. Only files whose size occurs more than once can be duplicates.
+    2. Of those, the first HEAD_BYTES of every file are hashed, and only
+       files sharing (size, head hash) stay candidates. Files no larger
+       than HEAD_BYTES are fully compared at this point.
+    3. The remaining candidates are hashed in full, memory-mapped and on
+       a thread pool (hashlib releases the GIL while hashing).
+
+Files sharing (size, full hash) form a duplicate group. The first copy
+of a group in path order is kept as the original; the others count as
+reclaimable. Files come from the export's core.file_index.FileIndex, so
+a rerun only rescans directories that changed.
+
+Outputs (in dup_media/):
+    duplicates.csv: Every file of every duplicate group.
+    dup_dirs.csv: Reclaimable bytes per directory, own and with subdirs.
+    dup_dirs.html: The directories with the most reclaimable bytes.
+
+Functions:
+    find_duplicates(paths, sizes, workers): Groups identical files.
+    reclaimable_by_dir(files, dups): Reclaimable bytes per directory.
+    run(in_path, out_path, logger, media_only, workers, use_index): Runs the feature.
+
+Example usage:
+    >>> from features import dup_media as dmd
+    >>> dmd.run(Path(export_root), Path(out_dir), logger)
+    'Found 812 duplicate files in 301 groups (1.4 GB reclaimable), wrote results to out_dir/dup_media'
+
+    $ python3 dup_media.py -i /path/to/export -o /path/to/output
+
+Dependencies:
+    numpy and pandas for data handling
+    plotly for datavis
+
+Note:
+    This sub-module is part of the 'between_bytes' package in the 'features' module.
+
+Version:
+    1.0
+
+Author:
+    between_bytes contributors
+"""
+__version__ = '1.0'
+
+import argparse
+import hashlib
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from between_bytes.core.log_aud import BtbLogger, RootLogger
+from between_bytes.core.file_index import FileIndex, scan, subtree_sizes
+from between_bytes.core.file_types import with_types
+
+MEDIA = ('image', 'video', 'audio')
+HEAD_BYTES = 64 * 1024
+HASH_WORKERS = 8
+HASH_SLICE = 8 * 2**20
+TOP_DIRS = 25
+
+
+def _hash_head(path:str) -> bytes:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.blake2b(f.read(HEAD_BYTES), digest_size=16).digest()
+    except OSError:
+        return None
+
+def _hash_full(path:str) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if hasattr(m, 'madvise'):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(m)
+            try:
+                for i in range(0, len(m), HASH_SLICE):
+                    h.update(view[i:i + HASH_SLICE])
+            finally:
+                view.release()
+    except (OSError, ValueError):
+        return None
+    return h.digest()
+
+def _groups(keys:pd.DataFrame) -> np.ndarray:
+    # rows whose key occurs more than once
+    return keys.duplicated(keep=False).to_numpy()
+
+def find_duplicates(paths, sizes, workers:int=HASH_WORKERS) -> pd.DataFrame:
+    """Groups byte-identical files.
+
+    Args:
+        paths (array-like of str): The files.
+        sizes (array-like of int): Their sizes; empty files are ignored.
+        workers (int): Concurrent reads.
+
+    Returns:
+        pd.DataFrame: One row per file that has a duplicate, with 'path',
+            'size', 'group' (0, 1, ... by decreasing reclaimable bytes)
+            and 'original' (True for the one copy that is kept).
+    """
+    cand = pd.DataFrame({'path': np.asarray(paths, dtype=object), 'size': np.asarray(sizes, dtype=np.int64)})
+    cand = cand[(cand['size'] > 0) & _groups(cand[['size']])].reset_index(drop=True)
+
+    with ThreadPoolExecutor(workers) as pool:
+        cand['head'] = list(pool.map(_hash_head, cand['path']))
+        cand = cand[cand['head'].notna()]
+        cand = cand[_groups(cand[['size', 'head']])].reset_index(drop=True)
+
+        # files no larger than the head were hashed whole already
+        big = cand['size'] > HEAD_BYTES
+        cand['hash'] = cand['head']
+        cand.loc[big, 'hash'] = list(pool.map(_hash_full, cand.loc[big, 'path']))
+    cand = cand[cand['hash'].notna()]
+    dups = cand[_groups(cand[['size', 'hash']])].sort_values('path', ignore_index=True)
+
+    key = dups.groupby(['size', 'hash'], sort=False).ngroup()
+    dups['original'] = ~key.duplicated()
+    saved = dups['size'].where(~dups['original'], 0).groupby(key).sum()
+    rank = pd.Series(np.arange(len(saved)), index=saved.sort_values(ascending=False, kind='stable').index)
+    dups['group'] = rank[key].to_numpy()
+    return dups.sort_values(['group', 'path'], ignore_index=True)[['group', 'path', 'size', 'original']]
+
+def reclaimable_by_dir(files:pd.DataFrame, dups:pd.DataFrame) -> pd.DataFrame:
+    """Sums the bytes of the extra copies per directory.
+
+    Args:
+        files (pd.DataFrame): A core.file_index table of the export.
+        dups (pd.DataFrame): Output of find_duplicates.
+
+    Returns:
+        pd.DataFrame: 'directory', 'copies', 'reclaimable' (bytes directly
+            in the directory) and 'subtree_reclaimable' (with subdirs),
+            for directories with any, by decreasing subtree_reclaimable.
+    """
+    extra = dups.loc[~dups['original'], 'path']
+    is_extra = files['path'].isin(extra).to_numpy()
+    parent = files['parent'].to_numpy()
+    own = np.where(is_extra, files['size'], 0)
+    direct = np.bincount(parent[is_extra], weights=own[is_extra], minlength=len(files)).astype(np.int64)
+    copies = np.bincount(parent[is_extra], minlength=len(files))
+    total = subtree_sizes(parent, own)
+    keep = files['is_dir'].to_numpy() & (total > 0)
+    return (pd.DataFrame({'directory': files['path'].to_numpy()[keep], 'copies': copies[keep],
+                          'reclaimable': direct[keep], 'subtree_reclaimable': total[keep]})
+              .sort_values('subtree_reclaimable', ascending=False, ignore_index=True))
+
+def run(in_path:Path, out_path:Path, logger:BtbLogger, media_only:bool=True,
+        workers:int=HASH_WORKERS, use_index:bool=True) -> str:
+    """Runs the feature.
+
+    Args:
+        in_path (Path): root of the export
+        out_path (Path): where to send output(s)
+        logger (BtbLogger): logger for the feature
+        media_only (bool): only compare images, videos and audio
+        workers (int): concurrent file reads
+        use_index (bool): use (and update) the export's file index
+
+    Returns:
+        str: This feature's contribution to the profile info dashboard datavis thing
+    """
+    logger.info("Starting duplicate media feature...")
+    out_path /= 'dup_media'
+    out_path.mkdir(parents=True, exist_ok=True)
+
+    index = FileIndex(in_path) if use_index else None
+    files = with_types(index.refresh() if index is not None else scan(in_path), index, logger=logger)
+    if index is not None and index.loaded:
+        logger.use_file(index.path, 'contents')
+    if index is not None and index.saved:
+        logger.wrote_file(index.path)
+    sel = ~files['is_dir']
+    if media_only:
+        sel &= files['type'].isin(MEDIA)
+    logger.info("Comparing %i files...", sel.sum())
+    logger.use_files(files.loc[sel, 'path'], 'contents', sizes=files.loc[sel, 'size'])
+    dups = find_duplicates(files.loc[sel, 'path'], files.loc[sel, 'size'], workers)
+    dups.to_csv(out_path/'duplicates.csv', index=False)
+    logger.wrote_file(out_path/'duplicates.csv')
+
+    dirs = reclaimable_by_dir(files, dups)
+    dirs.to_csv(out_path/'dup_dirs.csv', index=False)
+    logger.wrote_file(out_path/'dup_dirs.csv')
+    # ranked by own bytes, since a parent's subtree total repeats its children's
+    top = dirs[dirs['reclaimable'] > 0].sort_values('reclaimable', ascending=False).head(TOP_DIRS)
+    root = str(files['path'].iat[0])
+    labels = [d[len(root):].lstrip('/') or '.' for d in top['directory']]
+    fig = go.Figure(go.Bar(x=top['reclaimable'] / 2**20, y=labels, orientation='h',
+                           customdata=top['copies'],
+                           hovertemplate='%{y}<br>%{x:.1f} MB in %{customdata} extra copies<extra></extra>'))
+    fig.update_layout(title=f'Directories with the Most Duplicate Media (top {TOP_DIRS})',
+                      xaxis_title='Reclaimable (MB)', yaxis=dict(autorange='reversed'))
+    fig.write_html(out_path/'dup_dirs.html', include_plotlyjs='directory')
+    logger.wrote_file(out_path/'dup_dirs.html')
+
+    saved = dups.loc[~dups['original'], 'size'].sum()
+    return (f"Found {len(dups)} duplicate files in {dups['group'].nunique()} groups "
+            f"({saved / 2**30:.1f} GB reclaimable), wrote results to {out_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='dup_media',
+                                     description='Find photos, videos and audio stored more than once in an export')
+    parser.add_argument('-i', '--in_path', metavar='ROOT', help='path to root of download', required=True)
+    parser.add_argument('-o', '--out_path', metavar='OUTPUT_PATH', help='where to send output(s)', required=False, default='.')
+    parser.add_argument('-a', '--all_files', action='store_true', help='compare all files, not only media', required=False)
+    parser.add_argument('-w', '--workers', type=int, default=HASH_WORKERS, help='concurrent file reads', required=False)
+    parser.add_argument('--no_index', action='store_true', help='rescan the whole tree instead of using the file index', required=False)
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='increase verbosity', required=False)
+    args = parser.parse_args()
+
+    logger = RootLogger()
+    logger.setup(verb=args.verbose)
+
+    print(run(Path(args.in_path), Path(args.out_path), logger, media_only=not args.all_files,
+              workers=args.workers, use_index=not args.no_index))
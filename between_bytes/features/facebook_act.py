@@ -64,6 +64,7 @@ import seaborn as sns
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from core.log_aud import BtbLogger, RootLogger
+from core.file_index import FileIndex
 
 def get_colors(s: pd.Series):
     return s.apply(lambda x: (max(0, min(1, 1-x)), max(0, min(1, 1+x)), 0))
@@ -159,13 +160,13 @@ def naive_converted(main_path, out_path, logger:BtbLogger):
 
     # get all json files here except comments
     reactions_files = [file for file in os.listdir(reactions_path) if file.endswith('.json') and file !='comments.json']
+    logger.use_files([os.path.join(reactions_path, file) for file in reactions_files])
 
     # create df
     ldf = pd.DataFrame(columns=['timestamp', 'data', 'title'])
 
     # load each file
     for reactions_file in reactions_files:
-        logger.use_file(Path(reactions_file))
         with open(os.path.join(reactions_path, reactions_file)) as file:
             reactions_data = json.load(file)
             for i in reactions_data:
@@ -186,23 +187,23 @@ def naive_converted(main_path, out_path, logger:BtbLogger):
     # make index year
     yearlylikes.set_index('Year', inplace=True)
 
-    messages_path = main_path + '/your_facebook_activity/messages/inbox/'
-
-    # List to store file paths
-    message_files = []
-
-    # walk through subdirs (each message thread) in the inbox dir
-    for root, dirs, files in os.walk(messages_path):
-        for file in files:
-            if file.endswith(".json"):
-                file_path = os.path.join(root, file)
-                message_files.append(file_path)
+    # message threads (subdirs of the inbox dir), from the export's file
+    # index; only directories changed since the last run are rescanned
+    index = FileIndex(main_path)
+    with logger.span('refresh_index'):
+        index.refresh()
+    message_files = index.find('your_facebook_activity/messages/inbox', suffix='.json')
+    if index.loaded:
+        logger.use_file(index.path, 'contents')
+    if index.changed:
+        index.save()
+        logger.wrote_file(index.path)
 
     # create list of message dfs
     mdfs = []
 
     # load each file
-    logger.use_file(Path('MESSAGES'))
+    logger.use_files(message_files)
     for file_path in message_files:
         with open(file_path, 'r', encoding='utf-8') as json_file:
             data = json.load(json_file)
@@ -212,6 +213,7 @@ def naive_converted(main_path, out_path, logger:BtbLogger):
                 for message in messages if message.get('sender_name') == user_name]
 
             mdfs.append(pd.DataFrame(message_data, columns=['sender_name', 'timestamp_ms', 'content']))
+            logger.count('messages_parsed_total', len(messages))
 
 
     # concat once at the end, speeds up process immensely
@@ -326,12 +328,14 @@ def naive_converted(main_path, out_path, logger:BtbLogger):
     mdf['content'] = mdf['content'].fillna('')
 
     # Apply sentiment analysis using spaCy's pipe method
-    mdf['sentiment'] = [calc_sentiment(msg) for msg in nlp.pipe(mdf['content'])]
+    with logger.span('message_sentiment', messages=len(mdf)):
+        mdf['sentiment'] = [calc_sentiment(msg) for msg in nlp.pipe(mdf['content'])]
 
     # Sort the DataFrame by timestamp
     mdf.sort_values(by='timestamp_ms', inplace=True)
     # Process posts and add a "sentiment" column to postsdf
-    postsdf['sentiment'] = postsdf['data'].apply(lambda data_list: max([calc_sentiment(nlp(data_item['post'])) for data_item in data_list if 'post' in data_item], default=None))
+    with logger.span('post_sentiment', posts=len(postsdf)):
+        postsdf['sentiment'] = postsdf['data'].apply(lambda data_list: max([calc_sentiment(nlp(data_item['post'])) for data_item in data_list if 'post' in data_item], default=None))
 
     # Sort the DataFrame by timestamp
     postsdf = postsdf.sort_values(by='timestamp')
@@ -567,7 +571,8 @@ def naive_converted(main_path, out_path, logger:BtbLogger):
     grouped_color_func_result = lambda word, font_size, position, orientation, random_state, font_path: grouped_color_func(color_to_words, default_color, word)
 
     # create and display word cloud
-    wc = WordCloud(stopwords=stop_words, width=800, height=400, max_words=200, background_color='black', collocations=False).generate(wc_text)
+    with logger.span('word_cloud'):
+        wc = WordCloud(stopwords=stop_words, width=800, height=400, max_words=200, background_color='black', collocations=False).generate(wc_text)
     wc.recolor(color_func=grouped_color_func_result)
 
     plt.figure(figsize=(12, 6))
@@ -616,7 +621,8 @@ def naive_converted(main_path, out_path, logger:BtbLogger):
         grouped_color_func_result = lambda word, font_size, position, orientation, random_state, font_path: grouped_color_func(color_to_words, default_color, word)
 
         # create and display word cloud for the current year
-        wc = WordCloud(stopwords=stop_words, width=800, height=400, max_words=200, background_color='black', collocations=False).generate(wc_text)
+        with logger.span('word_cloud', year=year):
+            wc = WordCloud(stopwords=stop_words, width=800, height=400, max_words=200, background_color='black', collocations=False).generate(wc_text)
         wc.recolor(color_func=grouped_color_func_result)
 
         plt.figure(figsize=(12, 6))
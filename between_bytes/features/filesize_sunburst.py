@@ -11,12 +11,22 @@ Functions:
          to specify whether to include all files, only JSON files,
          or both.
 
-    enum_files: Enumerates all files in a directory tree and returns
-                a DataFrame with columns for the file, path, size,
-                parent directory, and label.
-
-    get_mimetypes: Uses the mimetypes module to get the MIME type of
-                     each file in a Series of Path objects.
+    enum_files: Enumerates all files in a directory tree in a single
+                pass (core.file_index.scan), or refreshes the tree's
+                persistent FileIndex, and returns a DataFrame with
+                columns for the path, size, parent directory, label,
+                suffix, type and whether the entry is a directory. Types
+                are stored in the index, so only new or changed files
+                are looked up again.
+
+    json_view: Filters an enum_files table down to JSON files and
+               directories.
+
+    get_mimetypes: Classifies files by MIME type class ('image',
+                     'text', ...) as a categorical (core.file_types.classify).
+                     Each distinct suffix is looked up in the mimetypes
+                     table once; files without a suffix can be identified
+                     by content.
 
     get_cmap: Creates a color map for the sunburst diagram based on
                 the unique MIME types in a Series of MIME types.
@@ -24,8 +34,15 @@ Functions:
     create_legend: Creates an HTML legend for the sunburst diagram
                     based on the color map.
 
+    aggregate: Rolls directory sizes up from their files and collapses
+               small or deep nodes into per-directory "other" nodes, so
+               large trees stay small enough for plotly.
+
     build_sunburst: Builds a sunburst diagram from a DataFrame of files.
 
+With dups=True, extra copies of duplicated media (features.dup_media)
+are coloured as their own 'duplicate' type.
+
 Example usage:
     >>> from features import filesize_sunburst as fsb
     >>> fsb.run(root_path, out_path, logger, [mode])
@@ -34,7 +51,7 @@ Example usage:
     $ python3 filesize_sunburst.py -i /path/to/jsons/ -o /path/to/output
 
 Dependencies:
-    pandas for data handling
+    numpy and pandas for data handling
     plotly for datavis
     seaborn for color palettes
 
@@ -46,50 +63,101 @@ Author:
     Noah Duggan Erickson
 
 Version:
-    1.1
+    1.4
 '''
 
-__version__ = '1.1'
+__version__ = '1.4'
 import argparse
 import sys
 from pathlib import Path
-import mimetypes
-from collections import defaultdict
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import seaborn as sns
 
 from between_bytes.core.log_aud import BtbLogger, RootLogger
+from between_bytes.core.file_index import FileIndex, scan, depths, subtree_sizes
+from between_bytes.core.file_types import classify, with_types, SNIFF_WORKERS
+from between_bytes.features.dup_media import find_duplicates, MEDIA
 
-def enum_files(in_path:Path, json_only:bool=False) -> pd.DataFrame:
-    if json_only:
-        all_the_files = list(in_path.rglob('*.json'))
-        all_the_files += list(in_path.rglob('*/'))
-    else:
-        all_the_files = list(in_path.rglob('*'))
-    all_the_files.append(in_path)
+MAX_NODES = 5000
 
-    df = pd.DataFrame({'file': all_the_files,
-                       'path': [str(f) for f in all_the_files],
-                       'size': [f.stat().st_size for f in all_the_files],
-                       'parent': [str(f.parent) for f in all_the_files],
-                       'label':
-                       [f.stem.replace('_', ' ') for f in all_the_files]})
+def enum_files(in_path:Path, index:FileIndex=None, logger:BtbLogger=None) -> pd.DataFrame:
+    df = with_types(index.refresh() if index is not None else scan(in_path), index, logger=logger)
+    df['type'] = df['type'].cat.add_categories(['root'])
+    df.at[0, 'type'] = 'root'
 
-    df.at[len(df)-1, 'parent'] = ''
+    paths = df['path'].to_numpy()
+    df['parent_idx'] = df['parent']
+    df['parent'] = np.where(df['parent_idx'] >= 0, paths[df['parent_idx'].clip(lower=0)], '')
+    df['label'] = df['stem'].str.replace('_', ' ', regex=False)
     return df
 
-def get_mimetypes(files:pd.Series) -> pd.Series:
-    if not mimetypes.inited:
-        mimetypes.init()
-    types = defaultdict((lambda : 'dir/dir'), mimetypes.types_map)
-    types['.json'] = 'data/json'
-    t = files.apply((lambda x: types[x.suffix]))
-    t.at[len(t)-1] = 'root/root'
-    t = t.apply((lambda x: x.split('/')[0]))
-    return t
+def json_view(df:pd.DataFrame) -> pd.DataFrame:
+    # JSON files plus every directory (so the tree stays connected)
+    keep = (df['is_dir'] | (df['suffix'] == '.json')).to_numpy()
+    new_idx = np.cumsum(keep) - 1
+    view = df[keep].reset_index(drop=True)
+    view['parent_idx'] = np.where(view['parent_idx'] >= 0, new_idx[view['parent_idx'].clip(lower=0)], -1)
+    return view
+
+def aggregate(df:pd.DataFrame, min_share:float=0.001, max_depth:int=None,
+              max_nodes:int=MAX_NODES) -> pd.DataFrame:
+    """Rolls sizes up the tree and collapses small nodes.
+
+    Every node gets its subtree total in 'size'. Nodes below `min_share`
+    of the root total or deeper than `max_depth` are hidden, and so are
+    the smallest nodes beyond `max_nodes`; the hidden children of each
+    shown directory are merged into one "other" node.
+
+    Args:
+        df (pd.DataFrame): An enum_files table (or view) with 'type'.
+        min_share (float): Smallest fraction of the total to show.
+        max_depth (int, optional): Deepest level shown (root = 0).
+        max_nodes (int): Most nodes handed to plotly, "other" included.
+
+    Returns:
+        pd.DataFrame: The nodes to draw, parents before children.
+    """
+    parent = df['parent_idx'].to_numpy()
+    depth = depths(parent)
+    total = subtree_sizes(parent, np.where(df['is_dir'], 0, df['size']), depth)
+
+    # totals never grow going down, so every cut below keeps the tree connected
+    shown = total >= min_share * total[0]
+    if max_depth is not None:
+        shown &= depth <= max_depth
+    rank = np.empty(len(df), dtype=np.int64)
+    rank[np.lexsort((np.arange(len(df)), -total))] = np.arange(len(df))
+    k = max_nodes
+    while True:
+        keep = shown & (rank < k)
+        hidden = ~keep & (parent >= 0)
+        hidden[hidden] = keep[parent[hidden]]
+        n_other = len(np.unique(parent[hidden]))
+        if keep.sum() + n_other <= max_nodes or k <= 1:
+            break
+        k -= keep.sum() + n_other - max_nodes
+
+    out = df[keep].assign(size=total[keep])
+    if hidden.any():
+        owner = parent[hidden]
+        sizes = np.bincount(owner, weights=total[hidden], minlength=len(df))
+        counts = np.bincount(owner, minlength=len(df))
+        owners = np.flatnonzero(counts)
+        paths = df['path'].to_numpy()[owners]
+        other = pd.DataFrame({'path': paths + '/<other>', 'parent': paths,
+                              'size': sizes[owners].astype(np.int64),
+                              'label': [f'other ({c} items)' for c in counts[owners]],
+                              'type': 'other', 'is_dir': False})
+        out = pd.concat([out, other], ignore_index=True)
+    return out.reset_index(drop=True)
+
+def get_mimetypes(suffixes:pd.Series, paths:pd.Series=None, workers:int=SNIFF_WORKERS,
+                  logger:BtbLogger=None) -> pd.Series:
+    return classify(suffixes, paths, workers, logger)
 
 def get_cmap(types:pd.Series) -> dict:
     cmap = sns.color_palette('rainbow', len(types.unique()))
@@ -122,6 +190,7 @@ def build_sunburst(df:pd.DataFrame) -> go.Sunburst:
     return go.Sunburst(parents=df['parent'],
                        ids=df['path'],
                        values=df['size'],
+                       branchvalues='total',
                        labels=df['label'],
                        hovertemplate='%{label}',
                        marker=dict(colors=df['colors'])
@@ -130,56 +199,75 @@ def build_sunburst(df:pd.DataFrame) -> go.Sunburst:
 # mode: 0 = all files, 1 = json only, 2 = both
 
 
-def run(in_path:Path, out_path:Path, logger:BtbLogger, fsb_mode:int=0):
+def run(in_path:Path, out_path:Path, logger:BtbLogger, fsb_mode:int=0,
+        min_share:float=0.001, max_depth:int=None, max_nodes:int=MAX_NODES, use_index:bool=True,
+        dups:bool=False):
+    if fsb_mode not in (0, 1, 2):
+        logger.crit(f'Invalid mode {fsb_mode}', ValueError)
+    logger.use_file(Path('ALL' if fsb_mode != 1 else 'JSON'), 'metadata')
+    index = FileIndex(in_path) if use_index else None
+    with logger.span('scan', index=use_index):
+        files = enum_files(in_path, index, logger)
+    logger.info('Scanned %i files and directories', len(files))
+    if index is not None and index.loaded:
+        logger.use_file(index.path, 'contents')
+    if index is not None and index.saved:
+        logger.wrote_file(index.path)
+    if dups:
+        # extra copies of duplicated media get their own colour
+        logger.info('Looking for duplicate media...')
+        media = files[~files['is_dir'] & files['type'].isin(MEDIA)]
+        logger.use_files(media['path'], 'contents', sizes=media['size'])
+        with logger.span('find_duplicates', files=len(media)):
+            found = find_duplicates(media['path'], media['size'])
+        extra = files['path'].isin(found.loc[~found['original'], 'path'])
+        files['type'] = files['type'].cat.add_categories(['duplicate'])
+        files.loc[extra, 'type'] = 'duplicate'
+        logger.info('%i duplicate copies (%.1f MB)', extra.sum(), files.loc[extra, 'size'].sum() / 2**20)
+    types = files['type'].unique()
+    logger.info('Found %i unique types: %s', len(types), list(types))
+
+    # every view is a filter over the one scan
     match fsb_mode:
         case 0:
-            logger.use_file(Path('ALL'), 'metadata')
-            df = enum_files(in_path)
+            df = files
         case 1:
-            logger.use_file(Path('JSON'), 'metadata')
-            df = enum_files(in_path, json_only=True)
+            df = json_view(files)
         case 2:
-            logger.use_file(Path('ALL'), 'metadata')
-            df = enum_files(in_path)
+            df = files
             logger.use_file(Path('JSON'), 'metadata')
-            df_json = enum_files(in_path, json_only=True)
-        case _:
-            logger.crit(f'Invalid mode {fsb_mode}', ValueError)
+            df_json = json_view(files)
 
-    logger.debug(df.head().to_string())
-    if fsb_mode == 2:
-        logger.debug(df_json.head().to_string())
-
-    logger.info('Getting mimetypes...')
-    df['type'] = get_mimetypes(df['file'])
-    logger.info('(1) Found %i unique types: %s' % # pylint: disable=consider-using-f-string
-                (len(df['type'].unique()),
-                 str(df['type'].unique())))
-    if fsb_mode == 2:
-        df_json['type'] = get_mimetypes(df_json['file'])
-        logger.info('(2) Found %i unique types: %s' % # pylint: disable=consider-using-f-string
-                    (len(df_json['type'].unique()),
-                     str(df_json['type'].unique())))
+    logger.info('Rolling up directory sizes')
+    with logger.span('aggregate', nodes=len(df)):
+        df = aggregate(df, min_share, max_depth, max_nodes)
+        if fsb_mode == 2:
+            df_json = aggregate(df_json, min_share, max_depth, max_nodes)
+    logger.info('Drawing %i of %i nodes', len(df), len(files))
 
     cmap = get_cmap(df['type'])
     df['colors'] = df['type'].map(cmap)
+    logger.debug('%s', df.head())
     if fsb_mode == 2:
         df_json['colors'] = df_json['type'].map(cmap)
+        logger.debug('%s', df_json.head())
 
     logger.info('Building Sunburst diagram')
-    if fsb_mode < 2:
-        fig = go.Figure(build_sunburst(df))
-    else:
-        fig = make_subplots(rows=1, cols=2,
-                            specs=[[{'type': 'domain'}, {'type': 'domain'}]],
-                            subplot_titles=['All Files', 'JSON Files'])
-        fig.add_trace(build_sunburst(df), 1, 1)
-        fig.add_trace(build_sunburst(df_json), 1, 2)
+    with logger.span('build_sunburst'):
+        if fsb_mode < 2:
+            fig = go.Figure(build_sunburst(df))
+        else:
+            fig = make_subplots(rows=1, cols=2,
+                                specs=[[{'type': 'domain'}, {'type': 'domain'}]],
+                                subplot_titles=['All Files', 'JSON Files'])
+            fig.add_trace(build_sunburst(df), 1, 1)
+            fig.add_trace(build_sunburst(df_json), 1, 2)
 
     op = out_path / 'filesize_sunburst'
     op.mkdir(exist_ok=True)
     logger.wrote_file(op / 'sunburst.html')
-    fig.write_html(op / 'sunburst.html')
+    with logger.span('write_html'):
+        fig.write_html(op / 'sunburst.html')
     with open(op / 'legend.html', 'w', encoding='utf-8') as f:
         f.write(create_legend(cmap))
     logger.wrote_file(op / 'legend.html')
@@ -197,6 +285,16 @@ if __name__ == '__main__':
                         help='where to send output HTML')
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='increase verbosity')
+    parser.add_argument('-s', '--min_share', type=float, default=0.001,
+                        help='smallest fraction of the total size drawn as its own node')
+    parser.add_argument('-d', '--max_depth', type=int, default=None,
+                        help='deepest directory level drawn')
+    parser.add_argument('-n', '--max_nodes', type=int, default=MAX_NODES,
+                        help='most nodes drawn')
+    parser.add_argument('--no_index', action='store_true',
+                        help='rescan the whole tree instead of using the file index')
+    parser.add_argument('--dups', action='store_true',
+                        help='colour extra copies of duplicated media (see dup_media)')
 
     mode_group = parser.add_mutually_exclusive_group()
     mode_group.add_argument('-j', '--json_only', action='store_true',
@@ -219,4 +317,6 @@ if __name__ == '__main__':
         prog_mode = 0
 
     print(run(Path(args.in_path), Path(args.out_path),
-              m_logger, fsb_mode=prog_mode))
+              m_logger, fsb_mode=prog_mode, min_share=args.min_share,
+              max_depth=args.max_depth, max_nodes=args.max_nodes,
+              use_index=not args.no_index, dups=args.dups))
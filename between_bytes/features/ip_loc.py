@@ -3,15 +3,28 @@
 The script takes in account activity data (in CSV format) containing IP addresses and timestamps. It processes this data to identify the density of activity, duration, and location associated with each IP address. The final output is an HTML page containing visualizations of IP location occurrences and their activity over time.
 
 Functions:
-    - convert_to_gps(ip_address): Converts IP addresses to GPS coordinates using MaxMind GeoLite2 database.
+    - convert_to_gps(ip_address): Converts IP addresses to GPS coordinates using ipinfo.io.
+    - locate_ips(df, logger, geoip_db, use_inet): Resolves IPs offline via a GeoIP database and the bundled gazetteer, optionally falling back to ipinfo.io.
     - convert_time(timestamp): Converts Unix timestamps to human-readable datetime objects.
     - time_def(time1, time2): Calculates the time difference between two timestamps.
     - density_report(time1, time2): Calculates the density of activity based on timestamps.
-    - create_df(df): Processes the input DataFrame to create a new DataFrame with relevant information.
+    - create_df(df, logger, ip_coords): Processes the input DataFrame to create a new DataFrame with relevant information.
     - generate_graph(df): Generates bar graphs showing the occurrences of IPs over time.
-    - on_map_click(event): Handles click events on the generated map.
-    - create_html(df): Creates an HTML map with markers for IP locations and popups showing activity graphs.
-    - run(df): Main function to run the IP location analysis feature.
+    - monthly_counts(df): Builds the per-IP monthly count table used by the popup charts.
+    - svg_popup(row): Renders one IP's monthly counts as a compact inline SVG chart.
+    - build_popups(df, logger, popup_mode): Builds marker popups in 'js', 'svg' or 'png' mode.
+    - cell_size(zoom): Width in degrees of the clustering radius at a zoom level.
+    - aggregate_locations(events): Bins login events into a zoom-dependent grid of map cells.
+    - cell_popup(cell, popups): Builds the popup of one aggregated map cell.
+    - haversine_km(lat1, lon1, lat2, lon2): Vectorized great-circle distances.
+    - impossible_travel(events, max_speed_kmh): Flags consecutive logins implying implausible travel speed.
+    - travel_layer(pairs): Draws flagged travel pairs as a map layer.
+    - parse_user_agent(user_agent): Classifies one user-agent string as (device, os, browser), memoized.
+    - classify_devices(user_agents): Labels every login by parsing only the distinct user agents.
+    - device_sessions(events): Summarizes logins and sessions per device/OS/browser.
+    - device_timeline(events): Plots monthly logins per device/OS/browser.
+    - create_html(df, logger, popup_mode, events, travel, layers): Creates an HTML map with clustered markers for login locations, a heat layer, popups showing activity graphs and any extra layers passed in (e.g. media_meta's geotagged photos).
+    - run(in_path, out_path, logger, popup_mode, geoip_db, use_inet, max_speed_kmh, layers): Main function to run the IP location analysis feature.
 
 Example usage:
     - From Python:
@@ -27,7 +40,9 @@ Dependencies:
     - geopandas: Geospatial data handling.
     - matplotlib.pyplot: Basic data visualization.
     - folium: Advanced data visualization on maps.
+    - plotly: Device timeline visualization.
     - maxminddb: IP to latitude/longitude conversion.
+    - core.gazetteer: Offline city/region/country to latitude/longitude conversion.
 
 Note:
     This sub-module is part of the 'between_bytes' package in the 'features' module.
@@ -45,22 +60,90 @@ from datetime import datetime
 from io import BytesIO
 import base64
 import json
+import re
+from functools import lru_cache
+from html import escape
 from pathlib import Path
 import sys
 # Add your other built-in imports here
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import geopandas as gpd
 import maxminddb
 import folium
+from branca.element import MacroElement
+from folium.plugins import HeatMap, MarkerCluster
+from jinja2 import Template
+import plotly.graph_objects as go
 import requests
 import time
-import multiprocessing
 from tqdm import tqdm
 
 from between_bytes.core.log_aud import BtbLogger, RootLogger
-
+from between_bytes.core.gazetteer import get_gazetteer
+
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+MONTH_COLORS = ['#1f77b4',  # blue
+                '#2ca02c',  # green
+                '#d62728',  # red
+                '#ff7f0e',  # orange
+                '#9467bd',  # purple
+                '#8c564b',  # brown
+                '#e377c2',  # pink
+                '#7f7f7f',  # gray
+                '#17becf',  # cyan
+                '#e31a1c',  # magenta
+                '#ff00ff',  # yellow
+                '#33a02c']  # lime
+SVG_W, SVG_H = 360, 160  # popup chart size (px)
+CLUSTER_ZOOM = 10    # finest zoom at which logins are still clustered
+CLUSTER_RADIUS = 40  # px, matches MarkerCluster's maxClusterRadius/2
+EARTH_RADIUS_KM = 6371.0088
+MAX_SPEED_KMH = 1000.0  # a little faster than an airliner
+MIN_TRAVEL_KM = 100.0   # below this, city-level geolocation is just noise
+SESSION_GAP = 30 * 60  # s between logins before a new session starts
+UA_DEVICES = [(re.compile(p, re.I), label) for p, label in [
+    (r'bot|crawl|spider|facebookexternalhit', 'Bot'),
+    (r'ipad|tablet|kindle|silk|android(?!.*mobile)', 'Tablet'),
+    (r'mobi|iphone|ipod|android|fban|fb4a|orca-android|windows phone', 'Mobile'),
+    (r'windows|macintosh|x11|cros|linux', 'Desktop')]]
+UA_OS = [(re.compile(p, re.I), label) for p, label in [
+    (r'iphone|ipad|ipod|fbios|ios', 'iOS'),
+    (r'android|fb4a', 'Android'),
+    (r'windows phone', 'Windows Phone'),
+    (r'windows', 'Windows'),
+    (r'cros', 'ChromeOS'),
+    (r'mac os x|macintosh', 'macOS'),
+    (r'linux|x11', 'Linux')]]
+UA_BROWSERS = [(re.compile(p, re.I), label) for p, label in [
+    (r'messenger|orca-android', 'Messenger'),
+    (r'instagram', 'Instagram'),
+    (r'fban|fbav|fb4a|fb_iab', 'Facebook app'),
+    (r'edg(e|a|ios)?/', 'Edge'),
+    (r'opr/|opera', 'Opera'),
+    (r'samsungbrowser', 'Samsung Internet'),
+    (r'firefox|fxios', 'Firefox'),
+    (r'chrome|crios|chromium', 'Chrome'),
+    (r'safari', 'Safari')]]
+CLUSTER_ICON_JS = """
+    function(cluster) {
+        var n = 0, first = Infinity, last = -Infinity;
+        cluster.getAllChildMarkers().forEach(function(m) {
+            n += m.options.events;
+            first = Math.min(first, m.options.first);
+            last = Math.max(last, m.options.last);
+        });
+        var fmt = function(t) { return new Date(t * 1000).toISOString().slice(0, 10); };
+        var size = n < 100 ? 'small' : (n < 1000 ? 'medium' : 'large');
+        return L.divIcon({html: '<div><span title="' + n + ' logins, ' + fmt(first) + ' to ' + fmt(last) + '">'
+                                + n + '</span></div>',
+                          className: 'marker-cluster marker-cluster-' + size,
+                          iconSize: new L.Point(40, 40)});
+    }
+"""
 
 def process_ip(ip, df):
     filtered_df = df[df['ip_address'] == ip].copy()
@@ -80,18 +163,21 @@ class RateLimiter:
 rate_limiter = RateLimiter(frequency=1)
 
 def convert_to_gps(ip_address, logger):
-    response = rate_limiter.get(f'https://ipinfo.io/{ip_address}/json')
+    start = time.perf_counter()
+    with logger.span('ipinfo', ip=ip_address):
+        response = rate_limiter.get(f'https://ipinfo.io/{ip_address}/json')
+    logger.observe('ipinfo_request_seconds', time.perf_counter() - start)
     logger.use_inet(response.url)
     data = response.json()  
-    logger.debug(f'Fetching GPS data for IP: {ip_address}')
+    logger.debug('Fetching GPS data for IP: %s', ip_address)
 
     loc = data.get('loc')
     if loc:
         latitude, longitude = loc.split(',')
-        logger.debug(f'Location for IP {ip_address}: ({latitude}, {longitude})')
+        logger.debug('Location for IP %s: (%s, %s)', ip_address, latitude, longitude)
         return float(latitude), float(longitude)
     else:
-        logger.info(f'No location data for IP: {ip_address}')
+        logger.info('No location data for IP: %s', ip_address)
         return None, None
 
 
@@ -120,20 +206,79 @@ def density_report(time1, time2):
     else:
         return (days/365)
 
-def create_df(df, logger):
+def locate_ips(df, logger, geoip_db:Path=None, use_inet:bool=False) -> pd.DataFrame:
+    """Resolves every IP address in `df` to coordinates.
+
+    Sources are tried in order, each only for the IPs still unresolved:
+        1. The MaxMind GeoIP2/GeoLite2 City database at `geoip_db`, if given.
+        2. The bundled offline gazetteer, using the city, region and
+           country the export already records for the IP.
+        3. ipinfo.io, only if `use_inet` is set.
+
+    Args:
+        df (pd.DataFrame): The account_activity_v2 records.
+        logger (BtbLogger): Logger for the feature.
+        geoip_db (Path, optional): Path to a MaxMind .mmdb City database.
+        use_inet (bool): Whether to query ipinfo.io for remaining misses.
+
+    Returns:
+        pd.DataFrame: 'latitude', 'longitude' and 'source' indexed by IP.
+    """
+    places = df.groupby('ip_address', sort=False)[['city', 'region']].first()
+    places['country'] = df.groupby('ip_address', sort=False)['country'].first() if 'country' in df else None
+    out = pd.DataFrame({'latitude': np.nan, 'longitude': np.nan, 'source': None}, index=places.index)
+
+    if geoip_db is not None:
+        logger.use_file(Path(geoip_db))
+        with maxminddb.open_database(str(geoip_db)) as reader:
+            found = {}
+            for ip in out.index:
+                try:
+                    loc = (reader.get(ip) or {}).get('location', {})
+                except ValueError:
+                    continue
+                if 'latitude' in loc:
+                    found[ip] = (loc['latitude'], loc['longitude'])
+        if found:
+            out.loc[list(found), ['latitude', 'longitude']] = list(found.values())
+            out.loc[list(found), 'source'] = 'geoip'
+        logger.debug('GeoIP database resolved %i of %i IPs', out['source'].notna().sum(), len(out))
+
+    todo = out['source'].isna()
+    if todo.any():
+        hits = get_gazetteer().lookup(places.loc[todo, 'city'], places.loc[todo, 'region'],
+                                      places.loc[todo, 'country'])
+        hits.index = out.index[todo]
+        found = hits['level'].notna()
+        out.loc[found[found].index, ['latitude', 'longitude']] = hits.loc[found, ['latitude', 'longitude']]
+        out.loc[found[found].index, 'source'] = 'gazetteer:' + hits.loc[found, 'level']
+        logger.debug('Gazetteer resolved %i of %i remaining IPs', found.sum(), len(found))
+
+    todo = out['source'].isna()
+    if use_inet and todo.any():
+        ips = out.index[todo]
+        with logger.pool() as pool:
+            gps_coords = pool.starmap(convert_to_gps, [(ip, logger) for ip in ips])
+        out.loc[ips, ['latitude', 'longitude']] = [(lat, lon) if lat is not None else (np.nan, np.nan)
+                                                   for lat, lon in gps_coords]
+        out.loc[ips[[lat is not None for lat, _ in gps_coords]], 'source'] = 'ipinfo'
+    elif todo.any():
+        logger.info('Could not locate %i IP(s) offline', todo.sum())
+    for source, n in out['source'].fillna('unresolved').str.split(':').str[0].value_counts().items():
+        logger.count('ip_lookups_total', n, source=source)
+    return out
+
+def create_df(df, logger, ip_coords=None):
     logger.info('Creating DataFrame from input data')
     mydict = []
 
     start = 0
     end = 0
     df_len = len(df)
-    
-    ip_addresses = df['ip_address'].unique()
-
-    with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-        gps_coords = pool.starmap(convert_to_gps, [(ip, logger) for ip in ip_addresses])
 
-    ip_to_coords = dict(zip(ip_addresses, gps_coords))
+    if ip_coords is None:
+        ip_coords = locate_ips(df, logger)
+    ip_to_coords = dict(zip(ip_coords.index, zip(ip_coords['latitude'], ip_coords['longitude'])))
 
     for index in range(df_len - 1):
         if df['ip_address'][index] == df['ip_address'][index + 1]:
@@ -176,22 +321,9 @@ def create_df(df, logger):
 def generate_graph(df):
     ip_maps = {}
     unique_ip = df['ip_address'].unique()
-    
-    month_colors = {
-    'January': '#1f77b4',   # blue
-    'February': '#2ca02c',  # green
-    'March': '#d62728',     # red
-    'April': '#ff7f0e',     # orange
-    'May': '#9467bd',       # purple
-    'June': '#8c564b',      # brown
-    'July': '#e377c2',      # pink
-    'August': '#7f7f7f',    # gray
-    'September': '#17becf', # cyan
-    'October': '#e31a1c',   # magenta
-    'November': '#ff00ff',  # yellow
-    'December': '#33a02c'   # lime
-    }
-    
+
+    month_colors = dict(zip(MONTH_NAMES, MONTH_COLORS))
+
     for ip in unique_ip:
         filtered_df = df[df['ip_address'] == ip].copy()
         
@@ -236,6 +368,146 @@ def generate_graph(df):
         
     return ip_maps
 
+def monthly_counts(df) -> dict:
+    """Counts the rows of `df` per IP and calendar month in one groupby.
+
+    Args:
+        df (pd.DataFrame): Output of create_df (needs 'ip_address',
+            'City' and 'timestamp' columns).
+
+    Returns:
+        dict: {ip: {'c': city, 'p': [periods], 'n': [counts]}} where each
+            period is ``year * 12 + month - 1``, sorted ascending. This is
+            the table that both popup renderers draw from.
+    """
+    ts = pd.to_datetime(df['timestamp'], unit='s')
+    period = ts.dt.year * 12 + ts.dt.month - 1
+    counts = (pd.DataFrame({'ip_address': df['ip_address'], 'period': period})
+              .dropna()
+              .astype({'period': 'int64'})
+              .groupby(['ip_address', 'period'], sort=True)
+              .size())
+    cities = df.groupby('ip_address')['City'].first()
+    table = {}
+    for ip, grp in counts.groupby(level=0, sort=False):
+        table[ip] = {'c': str(cities.get(ip, '')),
+                     'p': grp.index.get_level_values(1).tolist(),
+                     'n': grp.tolist()}
+    return table
+
+def svg_popup(row:dict) -> str:
+    """Renders one IP's monthly counts as a compact inline SVG bar chart.
+
+    Mirrors the ``btbIplChart`` JavaScript in LazyPopupCharts so that both
+    popup modes look the same.
+
+    Args:
+        row (dict): One value of the monthly_counts table.
+
+    Returns:
+        str: HTML snippet containing the title and an <svg> element.
+    """
+    periods, counts = row['p'], row['n']
+    bw = max(2, min(18, (SVG_W - 30) // max(len(periods), 1)))
+    top = max(counts, default=1)
+    parts = [f'<b>{escape(row["c"])}</b><br>'
+             f'<svg xmlns="http://www.w3.org/2000/svg" width="{SVG_W}" height="{SVG_H}" font-size="9">']
+    last_year = None
+    for i, (p, n) in enumerate(zip(periods, counts)):
+        year, month = divmod(p, 12)
+        h = round(n / top * (SVG_H - 24))
+        x = 24 + i * bw
+        parts.append(f'<rect x="{x}" y="{SVG_H - 14 - h}" width="{bw - 1}" height="{h}" '
+                     f'fill="{MONTH_COLORS[month]}"><title>{MONTH_NAMES[month]} {year}: {n}</title></rect>')
+        if year != last_year:
+            parts.append(f'<text x="{x}" y="{SVG_H - 3}">{year}</text>')
+            last_year = year
+    parts.append(f'<text x="0" y="10">{top}</text>'
+                 f'<line x1="22" y1="{SVG_H - 14}" x2="{SVG_W}" y2="{SVG_H - 14}" stroke="#333"/></svg>')
+    return ''.join(parts)
+
+class LazyPopupCharts(MacroElement):
+    """Embeds the monthly_counts table once and draws popup charts on click.
+
+    Markers only carry a ``<div class="btb-ipl" data-ip="...">`` placeholder;
+    the chart is built the first time its popup is opened.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var btb_ipl_counts = {{ this.table }};
+        var btb_ipl_colors = {{ this.colors }};
+        var btb_ipl_months = {{ this.months }};
+        function btbIplChart(row) {
+            var w = {{ this.width }}, h = {{ this.height }};
+            var bw = Math.max(2, Math.min(18, Math.floor((w - 30) / Math.max(row.p.length, 1))));
+            var top = Math.max.apply(null, row.n.concat([1]));
+            var esc = function(s) { var d = document.createElement('div'); d.textContent = s; return d.innerHTML; };
+            var out = ['<b>' + esc(row.c) + '</b><br><svg xmlns="http://www.w3.org/2000/svg" width="' + w + '" height="' + h + '" font-size="9">'];
+            var lastYear = null;
+            for (var i = 0; i < row.p.length; i++) {
+                var year = Math.floor(row.p[i] / 12), month = row.p[i] % 12;
+                var bh = Math.round(row.n[i] / top * (h - 24)), x = 24 + i * bw;
+                out.push('<rect x="' + x + '" y="' + (h - 14 - bh) + '" width="' + (bw - 1) + '" height="' + bh
+                         + '" fill="' + btb_ipl_colors[month] + '"><title>' + btb_ipl_months[month] + ' ' + year
+                         + ': ' + row.n[i] + '</title></rect>');
+                if (year !== lastYear) {
+                    out.push('<text x="' + x + '" y="' + (h - 3) + '">' + year + '</text>');
+                    lastYear = year;
+                }
+            }
+            out.push('<text x="0" y="10">' + top + '</text><line x1="22" y1="' + (h - 14) + '" x2="' + w
+                     + '" y2="' + (h - 14) + '" stroke="#333"/></svg>');
+            return out.join('');
+        }
+        {{ this._parent.get_name() }}.on('popupopen', function(e) {
+            var els = e.popup.getElement().querySelectorAll('.btb-ipl[data-ip]:not([data-drawn])');
+            if (!els.length) { return; }
+            els.forEach(function(el) {
+                var row = btb_ipl_counts[el.dataset.ip];
+                el.innerHTML = row ? btbIplChart(row) : 'No activity recorded';
+                el.dataset.drawn = '1';
+            });
+            e.popup.update();
+        });
+        {% endmacro %}
+    """)
+
+    def __init__(self, table:dict):
+        super().__init__()
+        self._name = 'LazyPopupCharts'
+        self.table = json.dumps(table, separators=(',', ':'))
+        self.colors = json.dumps(MONTH_COLORS)
+        self.months = json.dumps(MONTH_NAMES)
+        self.width = SVG_W
+        self.height = SVG_H
+
+def build_popups(df, logger, popup_mode:str='js') -> dict:
+    """Builds the popup HTML for every IP in `df`.
+
+    Args:
+        df (pd.DataFrame): Output of create_df.
+        logger (BtbLogger): Logger for the feature.
+        popup_mode (str): 'js' embeds one shared JSON table and draws the
+            chart on click, 'svg' inlines a small SVG chart per marker and
+            'png' renders a matplotlib figure per IP (slow, large output).
+
+    Returns:
+        dict: {ip: popup html}
+    """
+    match popup_mode:
+        case 'js':
+            return {ip: f'<div class="btb-ipl" data-ip="{escape(ip)}" style="min-width:{SVG_W}px"></div>'
+                    for ip in df['ip_address'].unique()}
+        case 'svg':
+            return {ip: svg_popup(row) for ip, row in monthly_counts(df).items()}
+        case 'png':
+            unique_ips = df['ip_address'].unique()
+            with logger.pool(4) as pool:
+                results = pool.starmap(process_ip, [(ip, df) for ip in unique_ips])
+            return {k: v for d in results for k, v in d.items()}
+        case _:
+            logger.crit(f'Invalid popup mode {popup_mode}', ValueError)
+
 def graph_over_all_time(ip_df, logger):
     logger.info('Creating graph_over_all_time from input data')
 
@@ -266,12 +538,82 @@ def graph_over_all_time(ip_df, logger):
 
     return html
 
-# Function to handle click events on markers
-def on_map_click(event):
-    lat, lon = event.latlng
-    
-# Iterate through waypoints and add markers
-def create_html(df, logger):
+def cell_size(zoom:int, radius_px:int=CLUSTER_RADIUS) -> float:
+    """Width in degrees of `radius_px` screen pixels at web-mercator `zoom`."""
+    return 360 / (256 * 2 ** zoom) * radius_px
+
+def aggregate_locations(events, zoom:int=CLUSTER_ZOOM, max_ips:int=10) -> pd.DataFrame:
+    """Bins geolocated login events into a zoom-dependent lat/lon grid.
+
+    Events falling into the same cell are collapsed into one row, so the
+    map only ever draws one marker per cell no matter how many logins
+    there are. Cells are sized so that two cells are never closer than
+    CLUSTER_RADIUS pixels at `zoom`; coarser zooms are clustered from these
+    cells client-side by MarkerCluster.
+
+    Args:
+        events (pd.DataFrame): One row per login with 'ip_address',
+            'timestamp', 'city', 'latitude' and 'longitude' columns.
+        zoom (int): Map zoom level the grid is sized for.
+        max_ips (int): How many of the busiest IPs to list per cell.
+
+    Returns:
+        pd.DataFrame: One row per occupied cell with the count-weighted
+            centroid ('latitude', 'longitude'), 'events', 'n_ips', 'first'
+            and 'last' timestamps, the first 'city' seen and the cell's
+            busiest 'ips'.
+    """
+    ev = events.dropna(subset=['latitude', 'longitude'])
+    cs = cell_size(zoom)
+    ev = ev.assign(cy=np.floor(ev['latitude'].to_numpy(dtype=float) / cs).astype(np.int64),
+                   cx=np.floor(ev['longitude'].to_numpy(dtype=float) / cs).astype(np.int64))
+    cells = ev.groupby(['cy', 'cx']).agg(latitude=('latitude', 'mean'),
+                                         longitude=('longitude', 'mean'),
+                                         events=('ip_address', 'size'),
+                                         n_ips=('ip_address', 'nunique'),
+                                         first=('timestamp', 'min'),
+                                         last=('timestamp', 'max'),
+                                         city=('city', 'first'))
+    top = (ev.groupby(['cy', 'cx', 'ip_address']).size()
+             .sort_values(ascending=False, kind='stable')
+             .groupby(level=['cy', 'cx']).head(max_ips)
+             .reset_index(level='ip_address')
+             .groupby(level=['cy', 'cx'])['ip_address'].agg(list))
+    cells['ips'] = top
+    return cells.reset_index(drop=True)
+
+def cell_popup(cell, popups:dict) -> str:
+    """Builds the popup for one aggregated cell from the per-IP popups."""
+    fmt = lambda t: datetime.fromtimestamp(t).date().isoformat()
+    head = (f'<b>{escape(str(cell.city))}</b>: {cell.events} logins from {cell.n_ips} IP(s), '
+            f'{fmt(cell.first)} to {fmt(cell.last)}<br>')
+    body = ''.join(f'<hr><i>{escape(ip)}</i><br>{popups.get(ip) or ""}' for ip in cell.ips)
+    if cell.n_ips > len(cell.ips):
+        body += f'<hr>...and {cell.n_ips - len(cell.ips)} more IP(s)'
+    return head + body
+
+def create_html(df, logger, popup_mode:str='js', events=None, travel=None, layers=()):
+    """Creates the login map.
+
+    Logins are aggregated into grid cells (see aggregate_locations), drawn
+    as clustered markers whose cluster icons sum the login counts and span
+    the date ranges of their children, plus a toggleable heat layer.
+
+    Args:
+        df (pd.DataFrame): Output of create_df, used for the popup charts.
+        logger (BtbLogger): Logger for the feature.
+        popup_mode (str): See build_popups.
+        events (pd.DataFrame, optional): One row per login (see
+            aggregate_locations). Defaults to the rows of `df`.
+        travel (pd.DataFrame, optional): Output of impossible_travel,
+            drawn as its own layer.
+        layers (iterable, optional): Extra folium layers built by the
+            caller (run.py passes media_meta.photo_layer), added to the map
+            and its layer control.
+
+    Returns:
+        folium.Map: The map.
+    """
     min_lon, max_lon = -45, -35
     min_lat, max_lat = -25, -15
     mymap = folium.Map(location=[0, 0],
@@ -285,47 +627,189 @@ def create_html(df, logger):
     
     
     logger.info('Creating interactive_occurance.html from input data')
-    # Define the number of processes to use
-    num_processes = 4
-    # Create a pool of worker processes
-    unique_ips = df['ip_address'].unique()
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        # Map the process_ip function to each IP address
-        results = pool.starmap(process_ip, [(ip, df) for ip in unique_ips])
-
-    ip_time = {k: v for d in results for k, v in d.items()}
-
-    
-    for index, row in df.groupby('ip_address')[['latitude', 'longitude']].first().iterrows():
-        folium.Marker(location=[row['latitude'], row['longitude']], popup=ip_time[index]).add_to(mymap)
-
-    mymap.add_child(folium.ClickForMarker(popup=None))
-    mymap.get_root().html.add_child(folium.Element("""
-    <script>
-        document.getElementsByClassName('folium-map')[0].onclick = function(event){
-            var lat = event.latlng.lat;
-            var lon = event.latlng.lng;
-            var kernel = IPython.notebook.kernel;
-            kernel.execute('generate_graph([' + lat + ', ' + lon + '], df)');
-        }
-    </script>
-    """))
+    if events is None:
+        events = df.rename(columns={'City': 'city'})
+    cells = aggregate_locations(events)
+    logger.debug('Aggregated %i logins into %i map cells', len(events), len(cells))
+
+    popups = build_popups(df, logger, popup_mode)
+    if popup_mode == 'js':
+        mymap.add_child(LazyPopupCharts(monthly_counts(df)))
+
+    cluster = MarkerCluster(name='Logins',
+                            icon_create_function=CLUSTER_ICON_JS,
+                            options={'disableClusteringAtZoom': CLUSTER_ZOOM + 1})
+    for cell in cells.itertuples(index=False):
+        folium.Marker(location=[cell.latitude, cell.longitude],
+                      popup=folium.Popup(cell_popup(cell, popups), lazy=True),
+                      tooltip=f'{cell.city}: {cell.events} logins',
+                      events=int(cell.events),
+                      first=int(cell.first),
+                      last=int(cell.last)).add_to(cluster)
+    cluster.add_to(mymap)
+    HeatMap(cells[['latitude', 'longitude', 'events']].to_numpy().tolist(),
+            name='Login density', show=False).add_to(mymap)
+    if travel is not None and len(travel):
+        travel_layer(travel).add_to(mymap)
+    for layer in layers:
+        layer.add_to(mymap)
+    folium.LayerControl().add_to(mymap)
 
     # Display the map
     logger.info('Finished interactive_occurance.html from input data')
     return mymap
 
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in km between arrays of points in degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def impossible_travel(events, max_speed_kmh:float=MAX_SPEED_KMH,
+                      min_distance_km:float=MIN_TRAVEL_KM) -> pd.DataFrame:
+    """Flags consecutive logins whose implied travel speed is implausible.
+
+    Events are ordered by time and every consecutive pair of geolocated
+    logins is compared in one vectorized pass. Pairs closer than
+    `min_distance_km` are ignored, since city- and region-level geolocation
+    is only that precise. Pairs at the same second but different places
+    have infinite speed.
+
+    Args:
+        events (pd.DataFrame): One row per login with 'ip_address',
+            'timestamp', 'city', 'latitude' and 'longitude' columns.
+        max_speed_kmh (float): Speeds above this are flagged.
+        min_distance_km (float): Jumps shorter than this are never flagged.
+
+    Returns:
+        pd.DataFrame: One row per flagged pair with 'from_'/'to_' prefixed
+            'time', 'ip', 'city', 'lat' and 'lon' columns plus
+            'distance_km', 'hours' and 'speed_kmh', fastest first.
+    """
+    lat = events['latitude'].to_numpy(dtype=float)
+    lon = events['longitude'].to_numpy(dtype=float)
+    ts = events['timestamp'].to_numpy(dtype=np.int64)
+    keep = ~(np.isnan(lat) | np.isnan(lon))
+    order = np.flatnonzero(keep)[np.argsort(ts[keep], kind='stable')]
+    lat, lon, ts = lat[order], lon[order], ts[order]
+
+    dist = haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    hours = np.diff(ts) / 3600
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(hours > 0, dist / hours, np.where(dist > 0, np.inf, 0.0))
+    flag = np.flatnonzero((speed > max_speed_kmh) & (dist >= min_distance_km))
+
+    src, dst = order[flag], order[flag + 1]
+    pairs = pd.DataFrame({'from_time': pd.to_datetime(ts[flag], unit='s'),
+                          'to_time': pd.to_datetime(ts[flag + 1], unit='s'),
+                          'from_ip': events['ip_address'].to_numpy()[src],
+                          'to_ip': events['ip_address'].to_numpy()[dst],
+                          'from_city': events['city'].to_numpy()[src],
+                          'to_city': events['city'].to_numpy()[dst],
+                          'from_lat': lat[flag].round(5), 'from_lon': lon[flag].round(5),
+                          'to_lat': lat[flag + 1].round(5), 'to_lon': lon[flag + 1].round(5),
+                          'distance_km': dist[flag].round(1),
+                          'hours': hours[flag].round(3),
+                          'speed_kmh': speed[flag].round(1)})
+    return pairs.sort_values('speed_kmh', ascending=False, ignore_index=True)
+
+def travel_layer(pairs, max_lines:int=2000) -> folium.FeatureGroup:
+    """Draws flagged travel pairs as red lines (fastest `max_lines` only)."""
+    layer = folium.FeatureGroup(name='Impossible travel')
+    for p in pairs.head(max_lines).itertuples(index=False):
+        folium.PolyLine([[p.from_lat, p.from_lon], [p.to_lat, p.to_lon]],
+                        color='#d62728', weight=2, opacity=0.7,
+                        tooltip=(f'{p.from_city} to {p.to_city}: {p.distance_km:.0f} km in '
+                                 f'{p.hours:.2f} h ({p.to_time:%Y-%m-%d %H:%M})')).add_to(layer)
+    return layer
+
+@lru_cache(maxsize=4096)
+def parse_user_agent(user_agent:str) -> tuple:
+    """Classifies a user-agent string as (device, os, browser).
+
+    The first matching rule of each of UA_DEVICES, UA_OS and UA_BROWSERS
+    wins; results are memoized since exports repeat a handful of strings.
+    """
+    ua = user_agent or ''
+    return tuple(next((label for rx, label in rules if rx.search(ua)), 'Other')
+                 for rules in (UA_DEVICES, UA_OS, UA_BROWSERS))
+
+def classify_devices(user_agents) -> pd.DataFrame:
+    """Labels every login with its device, OS and browser.
+
+    Only the distinct user-agent strings are parsed; the labels are
+    broadcast back to all rows as categorical columns.
+
+    Args:
+        user_agents (pd.Series): The 'user_agent' column.
+
+    Returns:
+        pd.DataFrame: Categorical 'device', 'os' and 'browser' columns
+            aligned with `user_agents`.
+    """
+    codes, uniques = pd.factorize(user_agents.fillna(''))
+    parsed = pd.DataFrame([parse_user_agent(ua) for ua in uniques],
+                          columns=['device', 'os', 'browser'], dtype='category')
+    return parsed.take(codes).set_axis(user_agents.index)
+
+def device_sessions(events, gap:int=SESSION_GAP) -> pd.DataFrame:
+    """Summarizes logins and sessions per device/OS/browser combination.
+
+    A session is a run of logins from the same combination with no more
+    than `gap` seconds between consecutive logins.
+
+    Args:
+        events (pd.DataFrame): Logins with 'timestamp', 'device', 'os'
+            and 'browser' columns.
+        gap (int): Session timeout in seconds.
+
+    Returns:
+        pd.DataFrame: 'logins', 'sessions', 'first' and 'last' per
+            combination, busiest first.
+    """
+    keys = ['device', 'os', 'browser']
+    ev = events[keys + ['timestamp']].sort_values(keys + ['timestamp'], kind='stable')
+    same = np.ones(len(ev), dtype=bool)
+    for k in keys:
+        col = ev[k].cat.codes.to_numpy()
+        same[1:] &= col[1:] == col[:-1]
+    same[0] = False
+    ts = ev['timestamp'].to_numpy()
+    new = ~same
+    new[1:] |= np.diff(ts) > gap
+    out = ev.assign(session=new).groupby(keys, observed=True).agg(logins=('timestamp', 'size'),
+                                                                 sessions=('session', 'sum'),
+                                                                 first=('timestamp', 'min'),
+                                                                 last=('timestamp', 'max'))
+    out['first'] = pd.to_datetime(out['first'], unit='s')
+    out['last'] = pd.to_datetime(out['last'], unit='s')
+    return out.sort_values('logins', ascending=False).reset_index()
+
+def device_timeline(events, top:int=10) -> go.Figure:
+    """Monthly logins per device/OS/browser, the `top` busiest drawn separately."""
+    label = (events['device'].astype(str) + ' / ' + events['os'].astype(str) + ' / '
+             + events['browser'].astype(str))
+    busiest = label.value_counts().index[:top]
+    label = label.where(label.isin(busiest), 'Other')
+    month = pd.to_datetime(events['timestamp'], unit='s').dt.to_period('M').dt.to_timestamp()
+    counts = pd.crosstab(month, label)
+    fig = go.Figure([go.Scatter(x=counts.index, y=counts[c], name=c, mode='lines', stackgroup='one')
+                     for c in counts.columns])
+    fig.update_layout(title='Logins per Month by Device', xaxis_title='Month', yaxis_title='Logins')
+    return fig
+
 def save_timeline_graph(html_content, file_path):
     with open(file_path, 'w') as f:
         f.write(html_content)
 
 #account_activity_v2
-def run(in_path:Path, out_path:Path, logger:BtbLogger):
+def run(in_path:Path, out_path:Path, logger:BtbLogger, popup_mode:str='js',
+        geoip_db:Path=None, use_inet:bool=False, max_speed_kmh:float=MAX_SPEED_KMH, layers=()):
 
     out_path = out_path / "ip_loc"
     out_path.mkdir(parents=True, exist_ok=True)
 
-    with open(in_path, 'r') as file:
+    with logger.span('load'), open(in_path, 'r') as file:
         data = json.load(file)
     
     account_activity_v2_value = data.get("account_activity_v2")
@@ -336,26 +820,56 @@ def run(in_path:Path, out_path:Path, logger:BtbLogger):
     
     # Assuming df is your DataFrame
 
-    edited_df = create_df(df, logger)
-    folium_html = create_html(edited_df, logger)
-    folium_html.save(out_path / "interactive_occurance.html")
+    with logger.span('locate_ips', logins=len(df)):
+        ip_coords = locate_ips(df, logger, geoip_db, use_inet)
+    with logger.span('create_df'):
+        edited_df = create_df(df, logger, ip_coords)
+    events = df[['ip_address', 'timestamp', 'city']].join(ip_coords, on='ip_address')
+
+    logger.info('Classifying login devices...')
+    with logger.span('devices'):
+        events = events.join(classify_devices(df['user_agent'] if 'user_agent' in df else pd.Series('', index=df.index)))
+        logger.debug('Parsed %i distinct user agents', parse_user_agent.cache_info().currsize)
+        device_sessions(events).to_csv(out_path / 'devices.csv', index=False)
+        logger.wrote_file(out_path / 'devices.csv')
+        device_timeline(events).write_html(out_path / 'device_timeline.html', include_plotlyjs='directory')
+        logger.wrote_file(out_path / 'device_timeline.html')
+
+    with logger.span('impossible_travel'):
+        travel = impossible_travel(events, max_speed_kmh)
+    logger.info('Flagged %i implausible login transitions', len(travel))
+    travel.to_csv(out_path / 'impossible_travel.csv', index=False)
+    logger.wrote_file(out_path / 'impossible_travel.csv')
+    travel.to_json(out_path / 'impossible_travel.json', orient='records', date_format='iso', indent=1)
+    logger.wrote_file(out_path / 'impossible_travel.json')
+
+    with logger.span('map', popups=popup_mode):
+        folium_html = create_html(edited_df, logger, popup_mode, events, travel, layers)
+        folium_html.save(out_path / "interactive_occurance.html")
     logger.wrote_file(out_path / "interactive_occurance.html")
     
-    ip_timeline = graph_over_all_time(edited_df, logger)
-    save_timeline_graph(ip_timeline, out_path / 'graph_over_all_time.html')
+    with logger.span('graph_over_all_time'):
+        ip_timeline = graph_over_all_time(edited_df, logger)
+        save_timeline_graph(ip_timeline, out_path / 'graph_over_all_time.html')
     logger.wrote_file(out_path / 'graph_over_all_time.html')
 
-    return "Wrote interactive_occurance.html and graph_over_all_time.html!"
+    return ("Wrote interactive_occurance.html, graph_over_all_time.html, devices.csv, "
+            f"device_timeline.html and impossible_travel.csv/.json ({len(travel)} flagged logins)!")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='ip_loc',
                                      description='A short description of what your code does')
     parser.add_argument('-i', '--in_file', metavar='(NAME)_JSON', help='path to account_activity json', required=True)
     parser.add_argument('-o', '--out_path', metavar='OUTPUT_PATH', help='where to send outputs', required=False, default='.')
+    parser.add_argument('-p', '--popups', choices=['js', 'svg', 'png'], default='js', help='marker popup renderer', required=False)
+    parser.add_argument('-g', '--geoip', metavar='MMDB', help='MaxMind GeoIP2/GeoLite2 City database', required=False, default=None)
+    parser.add_argument('--inet', action='store_true', help='look up IPs missing offline on ipinfo.io', required=False)
+    parser.add_argument('-s', '--max_speed', metavar='KM/H', type=float, default=MAX_SPEED_KMH, help='flag logins implying faster travel', required=False)
     parser.add_argument('-v', '--verbose', action='count', default=0, help='increase verbosity', required=False)
     args = parser.parse_args()
 
     logger = RootLogger()
     logger.setup(verb=args.verbose)
 
-    print(run(args.in_file, args.out_path, logger))
+    print(run(Path(args.in_file), Path(args.out_path), logger, popup_mode=args.popups,
+              geoip_db=args.geoip, use_inet=args.inet, max_speed_kmh=args.max_speed))
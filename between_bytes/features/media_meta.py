@@ -0,0 +1,384 @@
+"""Media metadata feature.
+
+Looks inside the photos and videos of an export: when they were taken,
+their dimensions, the camera and, where recorded, the GPS position.
+
+Only headers are read. Images are opened lazily with PIL, which parses
+the header and EXIF block without decoding any pixels. For MP4/MOV
+videos the 'moov' box is found by seeking from box header to box header,
+so the media data is skipped, and duration, capture time, frame size,
+camera and location are read from its 'mvhd', 'tkhd' and 'udta' boxes.
+Files are parsed on a process pool.
+
+Results are cached per file in an SQLite table (CACHE_PATH,
+$XDG_CACHE_HOME/between_bytes/media_meta.sqlite, by default
+~/.cache/between_bytes/media_meta.sqlite), keyed by path and checked
+against size and mtime, so a rerun only parses new or changed files.
+The cache lives outside the output directory and keeps the full path,
+capture time, camera and GPS position of every photo and video between
+runs; its read and write are audited, and cache=None (--no_cache, or
+--mmd_no_cache in exec_cli) neither reads nor writes it. The file list
+comes from the export's core.file_index.FileIndex; since the index does
+not notice files edited in place, the photos and videos themselves are
+re-stat()ed for the check.
+
+Outputs (in media_meta/):
+    media_meta.csv: One row per photo/video: capture time, dimensions,
+        duration, camera make/model and latitude/longitude.
+    timeline.html: Photos and videos taken per month, by camera.
+    locations.html: Map of the geotagged photos and videos.
+
+The same table can be drawn on the ip_loc login map (photo_layer).
+
+Functions:
+    read_meta(path, kind): Metadata of one file from its headers.
+    build_table(in_path, logger, workers, use_index, cache): The (cached) metadata table.
+    timeline(table): Monthly captures per camera.
+    photo_layer(table): Map layer of the geotagged files.
+    run(in_path, out_path, logger, workers, use_index, table, cache): Runs the feature.
+
+Example usage:
+    >>> from features import media_meta as mmd
+    >>> mmd.run(Path(export_root), Path(out_dir), logger)
+    'Indexed 5123 photos and videos (812 geotagged), wrote results to out_dir/media_meta'
+
+    $ python3 media_meta.py -i /path/to/export -o /path/to/output
+    $ python3 media_meta.py -i /path/to/export -o /path/to/output --no_cache
+
+Dependencies:
+    pandas for data handling
+    PIL for image headers
+    plotly and folium for datavis
+
+Note:
+    This sub-module is part of the 'between_bytes' package in the 'features' module.
+
+Version:
+    1.1
+
+Author:
+    between_bytes contributors
+"""
+__version__ = '1.1'
+
+import argparse
+import os
+import re
+import sqlite3
+import struct
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import folium
+from folium.plugins import HeatMap, MarkerCluster
+from PIL import Image
+
+from between_bytes.core.log_aud import BtbLogger, RootLogger
+from between_bytes.core.file_index import FileIndex, scan, stat_files
+from between_bytes.core.file_types import with_types
+
+CACHE_PATH = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'between_bytes' / 'media_meta.sqlite'
+KINDS = ('image', 'video')
+COLUMNS = ['kind', 'width', 'height', 'duration', 'taken', 'make', 'model', 'lat', 'lon']
+CHUNK = 64
+TOP_CAMERAS = 8
+MAX_MARKERS = 5000
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL,
+                                  kind TEXT, width INTEGER, height INTEGER, duration REAL, taken TEXT,
+                                  make TEXT, model TEXT, lat REAL, lon REAL);
+'''
+# EXIF tags
+_EXIF_IFD, _GPS_IFD = 0x8769, 0x8825
+_MAKE, _MODEL, _DATETIME, _DATETIME_ORIGINAL = 0x010f, 0x0110, 0x0132, 0x9003
+# seconds between the MP4 epoch (1904) and the Unix epoch
+_MP4_EPOCH = 2082844800
+_ISO6709 = re.compile(r'([+-]\d+(?:\.\d+)?)([+-]\d+(?:\.\d+)?)')
+
+
+def _gps_degrees(dms, ref) -> float:
+    try:
+        deg = float(dms[0]) + float(dms[1]) / 60 + float(dms[2]) / 3600
+    except (TypeError, ValueError, ZeroDivisionError, IndexError):
+        return None
+    return -deg if ref in ('S', 'W', b'S', b'W') else deg
+
+def _image_meta(path:str) -> dict:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with Image.open(path) as img:
+            meta = {'width': img.width, 'height': img.height}
+            exif = img.getexif()
+    if exif:
+        sub = exif.get_ifd(_EXIF_IFD)
+        meta['taken'] = sub.get(_DATETIME_ORIGINAL) or exif.get(_DATETIME)
+        meta['make'], meta['model'] = exif.get(_MAKE), exif.get(_MODEL)
+        gps = exif.get_ifd(_GPS_IFD)
+        if 2 in gps and 4 in gps:
+            meta['lat'], meta['lon'] = _gps_degrees(gps[2], gps.get(1)), _gps_degrees(gps[4], gps.get(3))
+    return meta
+
+def _boxes(f, end:int):
+    # (type, payload offset, payload size) of the boxes up to `end`
+    pos = f.tell()
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size, header = struct.unpack('>Q', f.read(8))[0], 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, size - header
+        pos += size
+
+def _udta_text(f, offset:int, size:int) -> str:
+    # QuickTime user data string: 2 byte length, 2 byte language, text
+    f.seek(offset)
+    n, _ = struct.unpack('>HH', f.read(4))
+    return f.read(min(n, size - 4)).decode('utf-8', 'replace').strip('\0 ')
+
+def _video_meta(path:str) -> dict:
+    meta = {}
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        moov = next(((o, s) for k, o, s in _boxes(f, end) if k == b'moov'), None)
+        if moov is None:
+            return meta
+        f.seek(moov[0])
+        for kind, offset, size in list(_boxes(f, moov[0] + moov[1])):
+            f.seek(offset)
+            if kind == b'mvhd':
+                version = f.read(4)[0]
+                if version == 1:
+                    created, _, scale, duration = struct.unpack('>QQIQ', f.read(28))
+                else:
+                    created, _, scale, duration = struct.unpack('>IIII', f.read(16))
+                if scale:
+                    meta['duration'] = duration / scale
+                if created > _MP4_EPOCH:
+                    meta['taken'] = datetime.fromtimestamp(created - _MP4_EPOCH, timezone.utc).strftime('%Y:%m:%d %H:%M:%S')
+            elif kind == b'trak' and 'width' not in meta:
+                tkhd = next(((o, s) for k, o, s in _boxes(f, offset + size) if k == b'tkhd'), None)
+                if tkhd is not None:
+                    f.seek(tkhd[0])
+                    version = f.read(4)[0]
+                    f.seek(tkhd[0] + (88 if version == 1 else 76))
+                    w, h = struct.unpack('>II', f.read(8))
+                    if w and h:
+                        meta['width'], meta['height'] = w >> 16, h >> 16
+            elif kind == b'udta':
+                for k, o, s in list(_boxes(f, offset + size)):
+                    if k == b'\xa9xyz':
+                        m = _ISO6709.match(_udta_text(f, o, s))
+                        if m:
+                            meta['lat'], meta['lon'] = float(m.group(1)), float(m.group(2))
+                    elif k == b'\xa9mak':
+                        meta['make'] = _udta_text(f, o, s)
+                    elif k == b'\xa9mod':
+                        meta['model'] = _udta_text(f, o, s)
+    return meta
+
+def read_meta(path:str, kind:str) -> dict:
+    """Reads the metadata of one photo or video from its headers.
+
+    Args:
+        path (str): The file.
+        kind (str): 'image' or 'video'.
+
+    Returns:
+        dict: Any of 'width', 'height', 'duration' (s), 'taken' (EXIF
+            "YYYY:MM:DD HH:MM:SS"), 'make', 'model', 'lat' and 'lon' that
+            the file records; empty if it cannot be parsed.
+    """
+    try:
+        meta = _image_meta(path) if kind == 'image' else _video_meta(path)
+    except Exception: # pylint: disable=broad-except
+        # truncated or odd files are common in exports; they just get no metadata
+        return {}
+    for key in ('make', 'model', 'taken'):
+        if isinstance(meta.get(key), bytes):
+            meta[key] = meta[key].decode('utf-8', 'replace')
+        if isinstance(meta.get(key), str):
+            meta[key] = meta[key].strip('\0 ') or None
+    return meta
+
+def _read_chunk(chunk:list) -> list:
+    return [read_meta(path, kind) for path, kind in chunk]
+
+def build_table(in_path:Path, logger:BtbLogger, workers:int=None, use_index:bool=True,
+                cache:Path=CACHE_PATH) -> pd.DataFrame:
+    """Returns the metadata of every photo and video in the export.
+
+    Args:
+        in_path (Path): root of the export
+        logger (BtbLogger): logger for the feature
+        workers (int, optional): parser processes (default: CPU count)
+        use_index (bool): use (and update) the export's file index
+        cache (Path): SQLite metadata cache (paths, capture times and GPS
+            positions, kept between runs); None parses every file and
+            neither reads nor writes it
+
+    Returns:
+        pd.DataFrame: 'path', 'size', 'mtime' and COLUMNS, with 'taken' as
+            datetime; one row per photo/video.
+    """
+    index = FileIndex(in_path) if use_index else None
+    files = with_types(index.refresh() if index is not None else scan(in_path), index, logger=logger)
+    if index is not None and index.loaded:
+        logger.use_file(index.path, 'contents')
+    if index is not None and index.saved:
+        logger.wrote_file(index.path)
+    media = files.loc[~files['is_dir'] & files['type'].isin(KINDS), ['path', 'type']]
+    media = media.rename(columns={'type': 'kind'}).astype({'kind': str}).reset_index(drop=True)
+    # fresh stats: the index only relists directories whose mtime changed,
+    # so a photo rewritten in place keeps its old size and mtime there
+    media['size'], media['mtime'] = stat_files(media['path'])
+    media = media[media['size'] >= 0].reset_index(drop=True)[['path', 'size', 'mtime', 'kind']]
+
+    db = None
+    known = pd.DataFrame(columns=['path', 'size', 'mtime'] + COLUMNS)
+    if cache is not None:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(cache)
+        db.executescript(_SCHEMA)
+        root = str(files['path'].iat[0]).rstrip(os.sep) + os.sep
+        known = pd.read_sql('SELECT * FROM media WHERE substr(path, 1, ?) = ?', db, params=(len(root), root))
+        logger.use_file(cache, 'contents')
+    known = known.astype({'size': 'int64', 'mtime': 'int64'})
+    merged = media.merge(known.drop(columns='kind'), on=['path', 'size', 'mtime'], how='left', indicator=True)
+    todo = merged['_merge'] == 'left_only'
+    logger.info('%i photos/videos, %i new or changed', len(media), todo.sum())
+
+    if todo.any():
+        logger.use_files(merged.loc[todo, 'path'], 'headers', sizes=merged.loc[todo, 'size'])
+        jobs = list(zip(merged.loc[todo, 'path'], merged.loc[todo, 'kind']))
+        chunks = [jobs[i:i + CHUNK] for i in range(0, len(jobs), CHUNK)]
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(chunks) > 1:
+            with logger.pool(min(workers, len(chunks))) as pool:
+                metas = [m for chunk in pool.imap(_read_chunk, chunks) for m in chunk]
+        else:
+            metas = [m for chunk in chunks for m in _read_chunk(chunk)]
+        # as objects: a chunk without any camera make is all None, which a
+        # string column (pandas with pyarrow) does not take as float NaN
+        merged[COLUMNS[1:]] = merged[COLUMNS[1:]].astype(object)
+        merged.loc[todo, COLUMNS[1:]] = pd.DataFrame(metas, columns=COLUMNS[1:], index=merged.index[todo],
+                                                     dtype=object)
+        if db is not None:
+            rows = merged.loc[todo, ['path', 'size', 'mtime'] + COLUMNS].astype(object)
+            db.executemany('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           rows.where(rows.notna(), None).itertuples(index=False, name=None))
+    if db is not None:
+        gone = set(known['path']) - set(media['path'])
+        db.executemany('DELETE FROM media WHERE path = ?', [(p,) for p in gone])
+        db.commit()
+        db.close()
+        if todo.any() or gone:
+            logger.wrote_file(cache)
+
+    table = merged.drop(columns='_merge')
+    table['taken'] = pd.to_datetime(table['taken'], format='%Y:%m:%d %H:%M:%S', errors='coerce')
+    for col in ('width', 'height', 'duration', 'lat', 'lon'):
+        table[col] = pd.to_numeric(table[col], errors='coerce')
+    bad = (table['lat'].abs() > 90) | (table['lon'].abs() > 180) | ((table['lat'] == 0) & (table['lon'] == 0))
+    table.loc[bad, ['lat', 'lon']] = np.nan
+    return table
+
+def timeline(table:pd.DataFrame, top:int=TOP_CAMERAS) -> go.Figure:
+    """Stacked monthly counts of photos/videos, by camera model."""
+    dated = table[table['taken'].notna()]
+    camera = (dated['make'].fillna('') + ' ' + dated['model'].fillna('')).str.strip().replace('', 'Unknown camera')
+    top_cams = camera.value_counts().index[:top]
+    camera = camera.where(camera.isin(top_cams), 'Other cameras')
+    monthly = (dated.groupby([dated['taken'].dt.to_period('M').dt.to_timestamp(), camera]).size()
+                    .unstack(fill_value=0))
+    fig = go.Figure([go.Bar(x=monthly.index, y=monthly[c], name=str(c)) for c in monthly.columns])
+    fig.update_layout(barmode='stack', title='Photos and Videos Taken per Month', xaxis_title='Month',
+                      yaxis_title='Files')
+    return fig
+
+def photo_layer(table:pd.DataFrame, max_markers:int=MAX_MARKERS) -> folium.FeatureGroup:
+    """Map layer of the geotagged photos/videos: clustered markers plus a heat map.
+
+    Args:
+        table (pd.DataFrame): Output of build_table.
+        max_markers (int): Most individual markers (the most recent);
+            the heat map always has every point.
+
+    Returns:
+        folium.FeatureGroup: The 'Photos' layer.
+    """
+    geo = table[table['lat'].notna() & table['lon'].notna()]
+    layer = folium.FeatureGroup(name='Photos')
+    HeatMap(geo[['lat', 'lon']].to_numpy().tolist(), radius=12).add_to(layer)
+    cluster = MarkerCluster().add_to(layer)
+    for row in geo.sort_values('taken', ascending=False).head(max_markers).itertuples(index=False):
+        when = row.taken.strftime('%Y-%m-%d %H:%M') if pd.notna(row.taken) else 'unknown date'
+        folium.CircleMarker([row.lat, row.lon], radius=4, color='#e6550d', fill=True,
+                            tooltip=f'{Path(row.path).name} ({when})').add_to(cluster)
+    return layer
+
+def run(in_path:Path, out_path:Path, logger:BtbLogger, workers:int=None, use_index:bool=True,
+        table:pd.DataFrame=None, cache:Path=CACHE_PATH) -> str:
+    """Runs the feature.
+
+    Args:
+        in_path (Path): root of the export
+        out_path (Path): where to send output(s)
+        logger (BtbLogger): logger for the feature
+        workers (int, optional): parser processes (default: CPU count)
+        use_index (bool): use (and update) the export's file index
+        table (pd.DataFrame, optional): output of build_table, if already built
+        cache (Path): SQLite metadata cache for build_table; None disables it
+
+    Returns:
+        str: This feature's contribution to the profile info dashboard datavis thing
+    """
+    logger.info("Starting media metadata feature...")
+    out_path /= 'media_meta'
+    out_path.mkdir(parents=True, exist_ok=True)
+
+    if table is None:
+        table = build_table(in_path, logger, workers, use_index, cache)
+    table.to_csv(out_path/'media_meta.csv', index=False, date_format='%Y-%m-%d %H:%M:%S')
+    logger.wrote_file(out_path/'media_meta.csv')
+
+    timeline(table).write_html(out_path/'timeline.html', include_plotlyjs='directory')
+    logger.wrote_file(out_path/'timeline.html')
+
+    geo = table['lat'].notna()
+    center = table.loc[geo, ['lat', 'lon']].mean().fillna(0).tolist()
+    m = folium.Map(location=center, zoom_start=3 if geo.any() else 2)
+    photo_layer(table).add_to(m)
+    folium.LayerControl().add_to(m)
+    m.save(out_path/'locations.html')
+    logger.wrote_file(out_path/'locations.html')
+
+    return f"Indexed {len(table)} photos and videos ({geo.sum()} geotagged), wrote results to {out_path}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='media_meta',
+                                     description='Capture times, cameras and locations of the photos and videos in an export')
+    parser.add_argument('-i', '--in_path', metavar='ROOT', help='path to root of download', required=True)
+    parser.add_argument('-o', '--out_path', metavar='OUTPUT_PATH', help='where to send output(s)', required=False, default='.')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='parser processes', required=False)
+    parser.add_argument('--no_index', action='store_true', help='rescan the whole tree instead of using the file index', required=False)
+    parser.add_argument('--no_cache', action='store_true', help=f'do not read or write the metadata cache ({CACHE_PATH}), '
+                        'which keeps the path, capture time and GPS position of every photo/video between runs', required=False)
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='increase verbosity', required=False)
+    args = parser.parse_args()
+
+    logger = RootLogger()
+    logger.setup(verb=args.verbose)
+
+    print(run(Path(args.in_path), Path(args.out_path), logger, workers=args.workers, use_index=not args.no_index,
+              cache=None if args.no_cache else CACHE_PATH))
@@ -1,10 +1,13 @@
 """Notifications History Feature
 
 This module provides a GitHub-style heatmap
-of Facebook push notifications
+of Facebook push notifications, overall and
+broken down by category (tags, groups, etc.)
 
 Functions:
-    run(bcts): Runs the feature.
+    classify(df): Assigns each notification a category from CATEGORY_RULES.
+    category_report(df, out_path, logger): Writes per-category trend lines and heatmaps.
+    run(in_path, out_path, logger, mode): Runs the feature.
 
 Example usage:
     >>> import sample_feature as sf
@@ -17,7 +20,7 @@ Example usage:
     Go do more interesting things...
 
 Dependencies:
-    No external dependencies.
+    core.calendar_heatmap (pandas, plotly) for the per-day grids and heatmaps.
 
 Note:
     This sub-module is part of the 'between_bytes' package in the 'feature' module.
@@ -30,47 +33,123 @@ Author:
 """
 
 import json
+import re
 import sys
 from pathlib import Path
-from datetime import date
 import argparse
 
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
+import pandas as pd
 import plotly.graph_objects as go
 
 from between_bytes.core.log_aud import BtbLogger, RootLogger # pylint disable=wrong-import-position
+from between_bytes.core.calendar_heatmap import calendar_grids, calendar_figure
+
+# (category, href path pattern, text pattern); the first matching rule wins.
+# Paths are normalized by classify(): no host, digits -> '#', no query values.
+CATEGORY_RULES = [(name, re.compile(path, re.I) if path else None, re.compile(text, re.I) if text else None)
+                  for name, path, text in [
+    ('Security', r'^/(?:security|login|checkpoint|settings/security)', r'\b(?:log(?:ged)? ?in|password|security|two-factor|code)\b'),
+    ('Tags', None, r'\btagged you\b|\bmentioned you\b'),
+    ('Comments', r'[?&](?:comment_id|reply_comment_id)=', r'\b(?:commented|replied)\b'),
+    ('Reactions', None, r'\b(?:reacted|likes?|liked|loves?)\b.*\byour\b'),
+    ('Friend activity', r'^/(?:friends|find-friends|people)', r'\bfriend request\b|\bbirthday\b|\baccepted your\b|\bsuggested friend'),
+    ('Groups', r'^/groups/', r'\bgroup\b'),
+    ('Events', r'^/events/', r'\bevent\b'),
+    ('Marketplace', r'^/marketplace/', r'\bmarketplace\b|\blisting\b'),
+    ('Memories', r'^/(?:memories|onthisday)', r'\bmemor(?:y|ies)\b|\blook back\b'),
+    ('Video', r'^/(?:watch|reel|video|live)', r'\b(?:video|reel|live)\b'),
+    ('Gaming', r'^/(?:gaming|games|instantgames)', r'\b(?:game|gaming|play)\b'),
+    ('Pages', r'^/pages/', r'\bpage\b'),
+]]
+CATEGORIES = [name for name, _, _ in CATEGORY_RULES] + ['Other']
+
+
+def classify(df:pd.DataFrame) -> pd.Categorical:
+    """Assigns every notification one of CATEGORIES.
+
+    Each rule in CATEGORY_RULES is matched once against the distinct
+    normalized href paths (host, digits and query values stripped) and
+    once against the distinct texts; the per-value hits are broadcast to
+    all rows through the factorized codes and the first rule that hits a
+    row wins.
 
+    Args:
+        df (pd.DataFrame): notifications_v2 records with 'href' and 'text'.
 
-def weeks_in_year(year:int) -> int:
-    last = date(year, 12, 28)
-    return last.isocalendar().week
-
-def first_week_of_months(year:int) -> list:
-    return [date(year, month, 3).isocalendar().week - 1 for month in range(1, 13)]
-
-def pretty_xlab(year) -> list:
-    out = []
-    m = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    c = 0
-    for i in range(weeks_in_year(year)):
-        if i in first_week_of_months(year):
-            out.append(m[c])
-            c += 1
-        else:
-            out.append('')
-    return out
+    Returns:
+        pd.Categorical: The category of each notification.
+    """
+    href = df['href'] if 'href' in df else pd.Series('', index=df.index)
+    text = df['text'] if 'text' in df else pd.Series('', index=df.index)
+    h_codes, h_uniq = pd.factorize(href.fillna('').astype(str))
+    paths = (pd.Series(h_uniq, dtype=object)
+               .str.replace(r'^[a-z]+://[^/]+', '', regex=True)
+               .str.replace(r'=[^&#]*', '=', regex=True)
+               .str.replace(r'\d+', '#', regex=True))
+    p_codes, p_uniq = pd.factorize(paths)
+    p_codes = p_codes[h_codes]
+    t_codes, t_uniq = pd.factorize(text.fillna('').astype(str))
+    p_uniq = pd.Series(p_uniq, dtype=object)
+    t_uniq = pd.Series(t_uniq, dtype=object)
+
+    hits = np.zeros((len(CATEGORY_RULES) + 1, len(df)), dtype=bool)
+    hits[-1] = True  # 'Other'
+    for i, (_, path_rx, text_rx) in enumerate(CATEGORY_RULES):
+        if path_rx is not None:
+            hits[i] |= p_uniq.str.contains(path_rx).to_numpy(dtype=bool)[p_codes]
+        if text_rx is not None:
+            hits[i] |= t_uniq.str.contains(text_rx).to_numpy(dtype=bool)[t_codes]
+    return pd.Categorical.from_codes(hits.argmax(axis=0), categories=CATEGORIES)
+
+def category_report(df:pd.DataFrame, out_path:Path, logger:BtbLogger) -> int:
+    """Writes the per-category trend lines and calendar heatmaps.
+
+    Outputs notifications_by_category.html (monthly counts per category),
+    one notifications_{category}.html calendar per non-empty category and
+    notification_categories.csv (totals).
 
-def run(in_path:Path, out_path:Path, logger:BtbLogger) -> str:
+    Returns:
+        int: Number of non-empty categories.
+    """
+    dts = pd.to_datetime(df['timestamp'], unit='s')
+    cats = df['category']
+
+    month = dts.dt.to_period('M').dt.to_timestamp()
+    counts = pd.crosstab(month, cats)
+    counts = counts.loc[:, counts.sum().sort_values(ascending=False).index]
+    fig = go.Figure([go.Scatter(x=counts.index, y=counts[c], name=c, mode='lines') for c in counts.columns])
+    fig.update_layout(title='Notifications per Month by Category', xaxis_title='Month',
+                      yaxis_title='Notifications')
+    fig.write_html(out_path / 'notifications_by_category.html', include_plotlyjs='directory')
+    logger.wrote_file(out_path / 'notifications_by_category.html')
+    counts.sum().rename('notifications').to_csv(out_path / 'notification_categories.csv')
+    logger.wrote_file(out_path / 'notification_categories.csv')
+
+    years, grids = calendar_grids(dts, groups=cats.cat.codes, n_groups=len(CATEGORIES))
+    for cat, cat_grids in zip(CATEGORIES, grids):
+        if not cat_grids.any():
+            continue
+        name = cat.lower().replace(' ', '_')
+        fig = calendar_figure(years, cat_grids, f'{cat} Notifications', unit=f'{cat.lower()} notifications')
+        fig.write_html(out_path / f'notifications_{name}.html', include_plotlyjs='directory')
+        logger.wrote_file(out_path / f'notifications_{name}.html')
+    return len(counts.columns)
+
+def run(in_path:Path, out_path:Path, logger:BtbLogger, mode:str='report') -> str:
     """Runs the feature.
 
-    Tells how many ad-topics are on the user profile.
-    (This description should be more verbose in a real feature!)
+    Draws a GitHub-style calendar of how many notifications were sent
+    each day.
 
     Args:
-        bcts (str): path to `other_categories_used_to_reach_you.json` file
+        in_path (Path): path to `notifications.json` file
+        out_path (Path): where to send output(s)
+        logger (BtbLogger): logger for the feature
+        mode (str): 'report' writes one notifications.html with a year
+            selector; 'yearly' writes one {year}_notifications.html per
+            year. Either way, plotly.js is written once as plotly.min.js
+            next to the pages.
     
     Returns:
         str: This feature's contribution to the profile info dashboard datavis thing
@@ -80,67 +159,43 @@ def run(in_path:Path, out_path:Path, logger:BtbLogger) -> str:
         be the only interaction that main.py has with the module.
     """
     logger.info("Starting notifications feature...")
+    if mode not in ('report', 'yearly'):
+        logger.crit(f'Invalid mode {mode}', ValueError)
     out_path = out_path / 'notifications'
     out_path.mkdir(exist_ok=True)
 
     logger.use_file(in_path)
-    with open(in_path) as f:
+    with logger.span('load'), open(in_path) as f:
         data = json.load(f)
     df = pd.DataFrame(data['notifications_v2'])
+    logger.count('notifications_parsed_total', len(df))
 
     # data prep
     logger.info("Prepping data...")
-    dts = pd.to_datetime(df['timestamp'], unit='s')
-    ddf = pd.DataFrame({'timestamp': dts, 'value': 1})
-    ddf.set_index('timestamp', inplace=True)
-    cts = ddf.resample('D').sum()
-    cts = cts.fillna(0)
-
-    logger.debug("Creating colormap...")
-    cl = ['#161b22', '#0e4429', '#006d32', '#26a641', '#39d353']
-    cm = LinearSegmentedColormap.from_list('GyGr', cl, N=256)
-
-
-
-    years = cts.index.year.unique()
-
-    for y in years:
-        logger.info(f"Creating heatmap for year {y}...")
-        grid= np.zeros((7, weeks_in_year(y)))
-        for i, r in cts.loc[str(y)].iterrows():
-            w = i.weekofyear - 1
-            d = i.dayofweek
-            grid[d, w] = r['value']
-        maxv = grid.max()
-        cmapper = lambda x: np.array(cm(x/maxv))*255
-        color_grid = cmapper(grid)
-        date_grid = np.array([date.fromisocalendar(y, j+1, i+1).isoformat()
-                                  for i in range(7)
-                                  for j in range(weeks_in_year(y))]).reshape(7, weeks_in_year(y))
-
-        logger.debug("Building heatmap...")
-        img = go.Image(z=color_grid,
-                       customdata=grid,
-                       text=date_grid,
-                       hovertemplate='%{customdata} notifications on %{text}',
-                       name=str(y))
-        fig = go.Figure(img)
-
-        fig.update_layout(paper_bgcolor="#0d1117",
-                          plot_bgcolor="#0d1117",
-                          font_color="#c9d1d9",
-                          title=f'{y} Notifications')
-        fig.update_xaxes(tickvals=np.arange(weeks_in_year(y)),
-                         ticktext=pretty_xlab(y),
-                         tickmode='array', title='Month')
-        fig.update_yaxes(tickvals=np.arange(7),
-                         ticktext=['M', 'T', 'W', 'R', 'F', 'S', 'U'],
-                         tickmode='array', title='Day of Week')
-        for i in range(grid.shape[0]):
-            fig.add_hline(y=i-0.5, line_width=5, line_color="#0d1117")
-        for i in range(grid.shape[1]):
-            fig.add_vline(x=i-0.5, line_width=5, line_color="#0d1117")
-        fig.write_html(out_path / f'{y}_notifications.html')
+    with logger.span('calendar_grids', notifications=len(df)):
+        dts = pd.to_datetime(df['timestamp'], unit='s')
+        years, grids = calendar_grids(dts)
+
+    logger.info("Classifying notifications...")
+    with logger.span('classify'):
+        df['category'] = classify(df)
+        n_cats = category_report(df, out_path, logger)
+    logger.info("Found notifications in %i categories", n_cats)
+
+    if mode == 'report':
+        logger.info("Creating heatmap report for %i year(s)...", len(years))
+        with logger.span('report', years=len(years)):
+            fig = calendar_figure(years, grids, 'Notifications', unit='notifications')
+            fig.write_html(out_path / 'notifications.html', include_plotlyjs='directory')
+        logger.wrote_file(out_path / 'notifications.html')
+        return f"Created notification heatmap report for {len(years)} year(s) at {out_path}"
+
+    for i, y in enumerate(years):
+        logger.info("Creating heatmap for year %s...", y)
+        with logger.span('report', year=int(y)):
+            fig = calendar_figure(years[i:i+1], grids[i:i+1], 'Notifications', unit='notifications')
+            fig.update_layout(updatemenus=[])
+            fig.write_html(out_path / f'{y}_notifications.html', include_plotlyjs='directory')
         logger.wrote_file(out_path / f'{y}_notifications.html')
 
     return f"Created {len(years)} notification heatmap(s) at {out_path}"
@@ -153,10 +208,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='sample_feature', description='A sample program feature for the purposes of demo-ing code structure and boilerplate')
     parser.add_argument('-i', '--in_file', metavar='JSON_FILE', help='path to notifications json file', required=True)
     parser.add_argument('-o', '--out_path', metavar='OUTPUT_PATH', help='where to send output(s)', required=False, default='.')
+    parser.add_argument('-m', '--mode', choices=['report', 'yearly'], default='report', help='one report or one page per year', required=False)
     parser.add_argument('-v', '--verbose', action='count', default=0, help='increase verbosity', required=False)
     args = parser.parse_args()
 
     logger = RootLogger()
     logger.setup(verb=args.verbose)
 
-    print(run(args.in_file, args.out_path, logger))
\ No newline at end of file
+    print(run(Path(args.in_file), Path(args.out_path), logger, mode=args.mode))
\ No newline at end of file
@@ -1,19 +1,39 @@
-"""A short description of what your code does.
+"""Off-Meta activity feature.
 
-A longer description of what your code does,
-including what csvs it takes in, and what it
-contributes to the final output
+Shows which companies report your activity to Meta, what kind of
+activity it is and how that changed over time, from
+your_activity_off_meta_technologies.json.
+
+The file is streamed one company at a time (core.json_stream) into a
+flat, compact (company, event_type, timestamp) event table, so memory
+stays proportional to the number of events rather than to the size of
+the JSON. Every output is then a vectorized groupby over that table.
+
+Outputs (in off_fb_activity/):
+    top_cos.html: Companies with the most events.
+    company_timeline.html: Monthly events of the top companies.
+    event_types.html: Event types overall and per top company.
+    top_by_period.html/.csv: Top companies of every period, ranked.
+    companies.csv: Per-company totals, first/last event and event types.
+    company_aliases.csv: Names merged into another company's name.
+
+Spelling variants of one company ("Amazon", "amazon.com") are merged
+first unless canonical=False.
 
 Functions:
-    run(off_facebook_activity_v2): Runs the feature.
+    load_events(in_path, logger): Streams the export into an event table.
+    merge_companies(events, logger, cache): Merges company-name variants.
+    company_summary(events): Per-company totals.
+    top_by_period(events, period, top): Top-N companies of every period.
+    run(in_path, out_path, logger, top, period, canonical): Runs the feature.
 
 Example usage:
     >>> from features import off_fb_act as ofa
-    >>> ofa.run(Path(path_to_json_file))
-    filepath to HTML page containing results of analysis
+    >>> ofa.run(Path(path_to_json_file), Path(out_dir), logger)
+    'Found 1234 events from 56 companies, wrote results to out_dir/off_fb_activity'
 
-    $ python3 off_fb_act.py -i /path/to/json_file.json
-    filepath to HTML page containing results of analysis
+    $ python3 off_fb_act.py -i /path/to/json_file.json -n 10 -p Y
+    Found 1234 events from 56 companies, wrote results to ./off_fb_activity
 
 Dependencies:
     pandas for data handling
@@ -23,7 +43,7 @@ Note:
     This sub-module is part of the 'between_bytes' package in the 'features' module.
 
 Version:
-    1.0
+    1.1
 
 Author:
     Noah Duggan Erickson
@@ -31,74 +51,229 @@ Author:
 Acknowledgements:
     Liam Gore
 """
-__version__ = '1.0'
+__version__ = '1.1'
 
 import argparse
 import sys
 from pathlib import Path
-# Add your other built-in imports here
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-# Add your other third-party/external imports here
-# Please update requirements.txt as needed!
 
 from between_bytes.core.log_aud import BtbLogger, RootLogger
+from between_bytes.core.json_stream import iter_array
+from between_bytes.core import company_names
 
-def run(in_path:Path, out_path:Path, logger:BtbLogger) -> str:
-    # Create new output directory
-    out_path /= 'off_fb_activity'
-    out_path.mkdir(exist_ok=True)
+PERIODS = {'Y': 'Year', 'Q': 'Quarter', 'M': 'Month'}
+
+
+def _fix_mojibake(name:str) -> str:
+    # the export stores UTF-8 bytes as latin-1 code points
+    try:
+        return name.encode('latin-1').decode('utf-8')
+    except UnicodeError:
+        return name
+
+def load_events(in_path:Path, logger:BtbLogger) -> pd.DataFrame:
+    """Streams the off-Meta export into a flat event table.
+
+    Only one company record is decoded at a time; its events go straight
+    into typed columns (company code, event type code, epoch seconds).
+
+    Args:
+        in_path (Path): path to your_activity_off_meta_technologies.json
+        logger (BtbLogger): logger for the feature
+
+    Returns:
+        pd.DataFrame: One row per event with categorical 'company' and
+            'event_type' and datetime 'timestamp'. Companies without
+            events are kept as unused categories of 'company'.
+    """
+    logger.use_file(in_path)
+    names, companies, types, stamps = [], [], [], []
+    type_codes = {}
+    for i, site in enumerate(iter_array(in_path, 'off_facebook_activity_v2')):
+        evs = site.get('events') or []
+        n = len(evs)
+        names.append(site.get('name', ''))
+        companies.append(np.full(n, i, dtype=np.int32))
+        types.append(np.fromiter((type_codes.setdefault(e.get('type', 'UNKNOWN'), len(type_codes)) for e in evs),
+                                 dtype=np.int32, count=n))
+        stamps.append(np.fromiter((e.get('timestamp', 0) for e in evs), dtype=np.int64, count=n))
+    logger.debug('Read %d companies, %d event types', len(names), len(type_codes))
+
+    # the same display name can appear under several ids
+    name_codes, uniq = pd.factorize(pd.Series(names, dtype=object))
+    company = name_codes[np.concatenate(companies)] if companies else np.array([], dtype=np.int32)
+    return pd.DataFrame({
+        'company': pd.Categorical.from_codes(company, categories=[_fix_mojibake(u) for u in uniq]),
+        'event_type': pd.Categorical.from_codes(np.concatenate(types) if types else np.array([], dtype=np.int32),
+                                                categories=list(type_codes)),
+        'timestamp': pd.to_datetime(np.concatenate(stamps) if stamps else np.array([], dtype=np.int64), unit='s'),
+    })
+
+def merge_companies(events:pd.DataFrame, logger:BtbLogger, cache:Path=company_names.CACHE_PATH) -> pd.DataFrame:
+    """Merges spelling variants of the same company (see core.company_names).
 
-    # data reading and pre-processing
-    data = pd.read_json(in_path, orient='records')
+    Args:
+        events (pd.DataFrame): As returned by load_events.
+        logger (BtbLogger): logger for the feature
+        cache (Path, optional): name mapping cache (audited as read and,
+            when new names are added, written); None disables it.
 
-    websites = data['off_facebook_activity_v2']
-    websites.index = list(range(len(websites)))
+    Returns:
+        pd.DataFrame: (alias, company) for every name that was renamed.
+    """
+    cats = events['company'].cat.categories
+    weights = np.bincount(events['company'].cat.codes, minlength=len(cats))
+    before = cache.stat().st_mtime_ns if cache is not None and cache.exists() else None
+    canon = company_names.canonicalize(cats, weights=weights, cache=cache)[cats]
+    if before is not None:
+        logger.use_file(cache, 'contents')
+    if cache is not None and cache.exists() and cache.stat().st_mtime_ns != before:
+        logger.wrote_file(cache)
+    codes, merged = pd.factorize(canon)
+    events['company'] = pd.Categorical.from_codes(codes[events['company'].cat.codes], categories=merged)
+    logger.debug('Merged %d company names into %d', len(cats), len(merged))
+    aliases = canon[canon.index != canon.to_numpy()]
+    return pd.DataFrame({'alias': aliases.index, 'company': aliases.to_numpy()})
 
-    site_names = []
-    for w in websites:
-        site_names.append(w['name'])
+def company_summary(events:pd.DataFrame) -> pd.DataFrame:
+    """Per-company event count, first and last event and event type counts.
 
-    num_of_entries_per_website = []
+    Returns:
+        pd.DataFrame: Indexed by company, sorted by 'events' descending.
+    """
+    g = events.groupby('company', observed=False)
+    summary = pd.DataFrame({'events': g.size(),
+                            'first': g['timestamp'].min(),
+                            'last': g['timestamp'].max()})
+    by_type = pd.crosstab(events['company'], events['event_type'], dropna=False)
+    summary = summary.join(by_type.reindex(summary.index, fill_value=0))
+    return summary.sort_values('events', ascending=False, kind='stable')
 
-    for site in websites:
-        num_of_entries_per_website.append(len(site['events']))
-    website_names = []
+def top_by_period(events:pd.DataFrame, period:str='Y', top:int=10) -> pd.DataFrame:
+    """Ranks the top companies of every period.
 
-    for i in range (len(site_names)):
-      input_string = site_names[i]
-      decoded_string = input_string.encode('latin-1').decode('utf-8')
-      website_names.append(((decoded_string), num_of_entries_per_website[i]))
+    Args:
+        events (pd.DataFrame): As returned by load_events.
+        period (str): 'Y', 'Q' or 'M'.
+        top (int): Companies kept per period.
 
-    d = {'Company':[], 'Number of Visits':[]}
-    for w in website_names:
-        d['Company'].append(w[0])
-        d['Number of Visits'].append(w[1])
-    df = pd.DataFrame(data = d)
-    df.sort_values(by='Number of Visits', ascending=False, inplace=True, ignore_index=True)
+    Returns:
+        pd.DataFrame: 'period', 'rank' (1 = most events), 'company'
+            and 'events'.
+    """
+    counts = (events.groupby([events['timestamp'].dt.to_period(period), 'company'], observed=True)
+                    .size().rename('events').reset_index()
+                    .rename(columns={'timestamp': 'period'}))
+    counts = counts.sort_values(['period', 'events'], ascending=[True, False], kind='stable')
+    counts['rank'] = counts.groupby('period').cumcount() + 1
+    return counts[counts['rank'] <= top][['period', 'rank', 'company', 'events']].reset_index(drop=True)
+
+def _write(fig:go.Figure, path:Path, logger:BtbLogger):
+    fig.write_html(path, include_plotlyjs='directory')
+    logger.wrote_file(path)
+
+def run(in_path:Path, out_path:Path, logger:BtbLogger, top:int=10, period:str='Y', canonical:bool=True) -> str:
+    """Runs the feature.
+
+    Args:
+        in_path (Path): path to your_activity_off_meta_technologies.json
+        out_path (Path): where to send output(s)
+        logger (BtbLogger): logger for the feature
+        top (int): number of companies in the timelines and rankings
+        period (str): ranking period, 'Y' (year), 'Q' (quarter) or 'M' (month)
+        canonical (bool): merge spelling variants of company names
+
+    Returns:
+        str: This feature's contribution to the profile info dashboard datavis thing
+    """
+    logger.info("Starting off-Meta activity feature...")
+    if period not in PERIODS:
+        logger.crit(f'Invalid period {period}', ValueError)
+    # Create new output directory
+    out_path /= 'off_fb_activity'
+    out_path.mkdir(exist_ok=True)
+
+    logger.info("Streaming events...")
+    events = load_events(in_path, logger)
+    if canonical:
+        logger.info("Merging company name variants...")
+        aliases = merge_companies(events, logger)
+        aliases.to_csv(out_path/'company_aliases.csv', index=False)
+        logger.wrote_file(out_path/'company_aliases.csv')
+    summary = company_summary(events)
+    summary.to_csv(out_path/'companies.csv', date_format='%Y-%m-%d %H:%M:%S')
+    logger.wrote_file(out_path/'companies.csv')
+    top_cos = summary.index[:top]
 
     # top_cos visualization
     #
-    fig = make_subplots(rows=1, cols=2, subplot_titles=('Top 5 Most Visited Sites', 'Sites with more than 50 views'))
-    tdf = df.head(5)
-    fig.add_trace(go.Bar(x=tdf['Company'], y=tdf['Number of Visits']), row=1, col=1)
-    tdf = df[df['Number of Visits'] >= 50]
-    fig.add_trace(go.Bar(x=tdf['Company'], y=tdf['Number of Visits']), row=1, col=2)
-    fig.write_html(out_path/'top_cos.html')
-    logger.wrote_file(out_path/'top_cos.html')
+    fig = make_subplots(rows=1, cols=2, subplot_titles=(f'Top {top} Companies by Events', 'Companies with 50+ Events'))
+    tdf = summary.head(top)
+    fig.add_trace(go.Bar(x=tdf.index.astype(str), y=tdf['events'], name='Top'), row=1, col=1)
+    tdf = summary[summary['events'] >= 50]
+    fig.add_trace(go.Bar(x=tdf.index.astype(str), y=tdf['events'], name='50+'), row=1, col=2)
+    fig.update_layout(showlegend=False)
+    _write(fig, out_path/'top_cos.html', logger)
 
-    # Add other visualizations here as see fit.
+    # monthly timelines of the top companies
+    #
+    logger.info("Creating timelines...")
+    sel = events[events['company'].isin(top_cos)]
+    monthly = (sel.groupby([sel['timestamp'].dt.to_period('M').dt.to_timestamp(), 'company'], observed=True)
+                  .size().unstack(fill_value=0))
+    fig = go.Figure([go.Scatter(x=monthly.index, y=monthly[c], name=str(c), mode='lines')
+                     for c in top_cos if c in monthly])
+    fig.update_layout(title=f'Monthly Events of the Top {top} Companies', xaxis_title='Month', yaxis_title='Events')
+    _write(fig, out_path/'company_timeline.html', logger)
 
-    return f"Wrote top_cos.html to {out_path}"
+    # event types
+    #
+    type_totals = events['event_type'].value_counts()
+    by_co = summary.loc[top_cos, type_totals.index]
+    fig = make_subplots(rows=1, cols=2, column_widths=[0.3, 0.7],
+                        subplot_titles=('All Events by Type', f'Event Types of the Top {top} Companies'))
+    fig.add_trace(go.Bar(x=type_totals.index.astype(str), y=type_totals.values, showlegend=False), row=1, col=1)
+    for t in by_co.columns:
+        fig.add_trace(go.Bar(x=by_co.index.astype(str), y=by_co[t], name=str(t)), row=1, col=2)
+    fig.update_layout(barmode='stack')
+    _write(fig, out_path/'event_types.html', logger)
+
+    # top-N rankings per period
+    #
+    logger.info("Ranking companies per %s...", PERIODS[period].lower())
+    ranks = top_by_period(events, period, top)
+    ranks.to_csv(out_path/'top_by_period.csv', index=False)
+    logger.wrote_file(out_path/'top_by_period.csv')
+    x = ranks['period'].astype(str)
+    fig = go.Figure([go.Scatter(x=x[grp.index], y=grp['rank'], name=str(co), mode='lines+markers',
+                                customdata=grp['events'],
+                                hovertemplate=f'{co}<br>%{{x}}: #%{{y}} (%{{customdata}} events)<extra></extra>')
+                     for co, grp in ranks.groupby('company', observed=True)])
+    fig.update_layout(title=f'Top {top} Companies per {PERIODS[period]}', xaxis_title=PERIODS[period],
+                      yaxis_title='Rank')
+    fig.update_yaxes(autorange='reversed', dtick=1)
+    _write(fig, out_path/'top_by_period.html', logger)
+
+    return f"Found {len(events)} events from {len(summary)} companies, wrote results to {out_path}"
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='off_fb_act',
-                                     description='A short description of what your code does')
-    parser.add_argument('-i', '--in_file', metavar='(NAME)_JSON', help='path to json file where \'NAME\' is tlk', required=True)
+                                     description='Timelines and rankings of the companies that share your activity with Meta')
+    parser.add_argument('-i', '--in_file', metavar='JSON_FILE', help='path to your_activity_off_meta_technologies.json', required=True)
     parser.add_argument('-o', '--out_path', metavar='OUTPUT_PATH', help='where to send output(s)', required=False, default='.')
-    temp_args = ['-i', '~/Documents/nde-fb-data-2404/apps_and_websites_off_of_facebook/your_activity_off_meta_technologies.json']
-    args = parser.parse_args(temp_args)
+    parser.add_argument('-n', '--top', type=int, default=10, help='companies per timeline/ranking', required=False)
+    parser.add_argument('-p', '--period', choices=list(PERIODS), default='Y', help='ranking period', required=False)
+    parser.add_argument('--raw_names', action='store_true', help='do not merge company name variants', required=False)
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='increase verbosity', required=False)
+    args = parser.parse_args()
+
+    logger = RootLogger()
+    logger.setup(verb=args.verbose)
 
-    print(run(Path(args.in_file), Path(args.out_path)))
\ No newline at end of file
+    print(run(Path(args.in_file), Path(args.out_path), logger, top=args.top, period=args.period,
+              canonical=not args.raw_names))
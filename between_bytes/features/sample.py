@@ -61,7 +61,7 @@ def run(in_path: Path, out_path: Path, logger: BtbLogger) -> str:
     #
     logger.use_file(in_path)
     df = pd.read_json(in_path, orient='records', typ='frame')
-    logger.debug("Read json file into %i x %i dataframe" % df.shape)
+    logger.debug("Read json file into %i x %i dataframe", *df.shape)
 
     # image stuff
     #
@@ -74,17 +74,17 @@ def run(in_path: Path, out_path: Path, logger: BtbLogger) -> str:
     image_url = "https://source.unsplash.com/random"
     logger.use_inet(image_url)
     response = requests.get(image_url, timeout=15)
-    logger.debug('GET request returned with status code %i' % response.status_code)
+    logger.debug('GET request returned with status code %i', response.status_code)
 
     # Save the image to 'random.jpg'
     out_file = out_path / 'random.jpg'
     with open(out_file, 'wb') as file:
         logger.wrote_file(out_file)
         b = file.write(response.content)
-        logger.debug("Wrote %i bytes to %s" % (b, out_file.absolute()))
+        logger.debug("Wrote %i bytes to %s", b, out_file.absolute())
 
     # Confirm that the image has been saved
-    logger.info("Image saved as %s" % out_file)
+    logger.info("Image saved as %s", out_file)
     # raise NotImplementedError("pause point")
     return f"There are {len(df['bcts'])} advertising-related topics in the profile!\nAn image was created at {out_file.absolute()}\nGo do more interesting things..."
 
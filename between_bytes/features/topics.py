@@ -7,12 +7,24 @@ contributes to the final output
 Description:
 1. Reads the given JSON file
 2. Changing all special characters to readable characters for python
-3. Creates a temporary directory for storing images
-4. Uses requests to ask for an image from Google Images given a term from the JSON file
-5. Saves the return images to the temp dir
-6. Creates a collage using the images and their names as the descriptor words
-7. Saves the collage as a .jpg
-8. Removes the temp dir
+3. Looks up each topic in the persistent image cache (core.image_cache)
+4. Asks Google Images for an image for every topic that is not cached,
+   on a thread pool sharing one pooled, retrying requests.Session
+5. Streams each returned image into the cache, which keeps a thumbnail
+6. Creates a collage using the cached thumbnails and their names as the descriptor words
+7. Saves the collage as a .jpg (or as bands of .jpgs plus an .html for very large collages)
+
+With cache=False, a throwaway cache in a temporary directory is used instead.
+
+With mode='text' nothing is downloaded: every topic becomes a tile with a
+colour derived from its hash and a glyph for its category
+(TOPIC_CATEGORIES), laid out as a treemap or word grid (core.text_tiles)
+and saved as topics_tiles.png in a few seconds even for thousands of topics.
+
+The output is always named after OUTPUT_NAME (topics.jpg / topics_tiles.png),
+whether it comes from ads_interests.json alone or from several input files
+(your_topics.json and ads_interests.json) combined; topics listed in both
+weigh more in the treemap.
 
 Input JSON file:
 * your_topics.json (Facebook removed this from its data requests, unable to find after January 2024)
@@ -22,9 +34,14 @@ Contributions:
 Outputs a randomly sorted collage of images with descriptor words
 
 Functions:
-    run(file_path): Runs the feature.
+    run(in_path, out_path, logger, cache, tile_size, mode, layout): Runs the feature on one JSON file or a list of them.
+    read_topics(in_paths, logger): Distinct topics of all files, weighted by how many files list them
+    categorize(topics): Index of each topic's TOPIC_CATEGORIES entry
     special_character(df): Converts the strings in the given DataFrame to latin-1 then to utf-8 to handle any special characters in the names of the topics
-    create_collage(image_folder, output_path, collage_size=(4096, 2160)): Creates a collage of given size using the images from image_folder with the image names under each image and saved to the output_path
+    create_collage(images, output_path, logger, collage_size=(4096, 2160), tile_size=None, workers=None): Creates a collage of given size (or of fixed-size tiles) from (topic, image path) pairs with the topic under each image and saved to the output_path. Tiles are decoded at reduced size and resized on a thread pool and pasted as they finish; collages over MAX_BAND_PIXELS are written as bands of rows (output_000.jpg, ...) plus an output.html that stacks them. Returns the files written
+
+Classes:
+    ImageDownloader: Thread-pooled downloader filling the image cache over one keep-alive session
 
 
 Example usage:
@@ -34,14 +51,19 @@ Example usage:
     $ python3 topics.py -file_path "file path"
     filepath to the json file to be made into a collage
 
+    $ python3 topics.py --check    (or --bench; see topics_check.py)
+
 Dependencies:
     pandas for data handling
     requests and BeautifulSoup4 for webscraping image acquisition
+    concurrent.futures for the download thread pool
     pillow (PIL) for image handling
+    core.text_tiles for the offline text tiles
     os for grabbing path files
     tqdm for progress bars
     random for shuffling images
-    tempfile for the holding the individual images before collage creation
+    core.image_cache for keeping thumbnails between runs
+    tempfile for the holding the individual images when the cache is disabled
 
 
 Note:
@@ -55,22 +77,61 @@ Author:
 """
 
 import argparse
+import base64
 import os
 import sys
 import random
 import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import ExitStack
+from itertools import islice
 from pathlib import Path
+from urllib.parse import urlsplit
 # Add your other built-in imports here
 
+import numpy as np
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 from PIL import Image, ImageDraw, ImageFont
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
-from multiprocessing import Pool
+from urllib3.util.retry import Retry
 # Add your other third-party/external imports here
 
 from between_bytes.core.log_aud import BtbLogger, RootLogger
+from between_bytes.core.image_cache import ImageCache
+from between_bytes.core.text_tiles import render_tiles
+
+SEARCH_URL = "https://www.google.com/search"
+USER_AGENT = "Mozilla/5.0 (compatible; between_bytes)"
+MAX_WORKERS = 16
+PER_HOST = 8
+TIMEOUT = (5, 30)  # connect, read (s)
+RETRIES = 3
+CHUNK_SIZE = 1 << 16
+FONT_PATH = os.path.join(os.path.dirname(__file__), "NotoSans_Local.ttf")
+MAX_BAND_PIXELS = 4096 * 2160 * 2
+OUTPUT_NAME = "topics"  # docs/docify.py expects topics.jpg
+
+# (category, pattern on the case-folded topic) for the text tiles;
+# the first match wins and the last entry catches the rest
+TOPIC_CATEGORIES = [
+    ("Food & Drink", r"food|cook|recipe|restaurant|cuisine|drink|coffee|\btea\b|wine|beer|bak(?:e|ing)|pizza|vegan|dessert|fruit|chocolate"),
+    ("Travel", r"travel|hotel|flight|airline|touris|vacation|beach|resort|cruise|island|backpack"),
+    ("Sports & Fitness", r"sport|football|soccer|basketball|baseball|tennis|golf|fitness|\bgym|yoga|running|hockey|olymp|league|cycling|martial"),
+    ("Music", r"music|song|\bband\b|concert|\brock\b|\bpop\b|jazz|hip hop|\brap\b|guitar|piano|album|singer"),
+    ("Film, TV & Games", r"movie|film|\btv\b|television|series|\bshows?\b|netflix|\bgam(?:e|es|ing)\b|anime|comic|entertainment"),
+    ("Tech & Science", r"tech|computer|software|phone|mobile|internet|science|engineer|\bai\b|artificial|\bdata\b|electronic|\bapps?\b|programming"),
+    ("Shopping & Fashion", r"shop|fashion|cloth|shoe|beauty|cosmetic|jewel|\bstyle|makeup|retail|apparel"),
+    ("Business & Finance", r"business|financ|\bbank|invest|money|market|stock|crypto|insurance|real estate|\bjobs?\b|career|entrepreneur"),
+    ("Family & Home", r"family|parent|baby|\bkids?\b|child|\bhome|garden|\bpets?\b|\bdogs?\b|\bcats?\b|wedding|interior|furniture|diy"),
+    ("Society & Learning", r"news|politic|government|election|\blaw\b|religio|educat|universit|school|charity|culture|books?\b|literature|history"),
+    ("Vehicles", r"\bcars?\b|\bauto|vehicle|motor|truck|bicycle"),
+    ("Other", None),
+]
 
 def special_character (df):
     temp_df = df.copy()
@@ -78,94 +139,269 @@ def special_character (df):
         temp_df.iloc[x] = df.iloc[x].encode("latin-1").decode("utf-8")
     return temp_df
 
-def create_collage(image_folder, output_path, collage_size=(4096, 2160)):
-    # Get all image files from the folder
-    image_files = [f for f in os.listdir(image_folder) if os.path.isfile(os.path.join(image_folder, f))]
-    
-    # Shuffle the order of the image files
-    random.shuffle(image_files)
-    
-    # Create a new blank image for the collage
-    collage = Image.new('RGB', collage_size)
-    draw = ImageDraw.Draw(collage)
-    
+def _tile_image(path, size):
+    # draft() lets the JPEG decoder scale down by up to 8x while decoding
+    with Image.open(path) as img:
+        img.draft("RGB", size)
+        return img.convert("RGB").resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+def _as_finished(pool, fn, args, window):
+    # like as_completed(), but with at most `window` tasks in flight so
+    # finished tiles never pile up in memory; yields (index, future)
+    args = enumerate(args)
+    pending = {pool.submit(fn, *a): i for i, a in islice(args, window)}
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
+            nxt = next(args, None)
+            if nxt is not None:
+                pending[pool.submit(fn, *nxt[1])] = nxt[0]
+
+def create_collage(images, output_path, logger, collage_size=(4096, 2160), tile_size=None, workers=None):
+    # images: (topic, image path) pairs
+    images = list(images)
+    if not images:
+        logger.warn("No images to make a collage from")
+        return []
+
+    # Shuffle the order of the images
+    random.shuffle(images)
+
     # Calculate the width and height for each image tile
-    total_images = len(image_files)
-    width = int(total_images ** 0.5)  # Calculate number of images that can fit horizontally
+    total_images = len(images)
+    width = max(int(total_images ** 0.5), 1)  # Calculate number of images that can fit horizontally
     height = (total_images + width - 1) // width  # Calculate number of images that can fit vertically
-
-    tile_width = collage_size[0] // width
-    tile_height = collage_size[1] // height
-
-    # Paste each image onto the collage
-    for i, image_file in enumerate(image_files):
+    if tile_size:
+        tile_width, tile_height = tile_size
+        collage_size = (width * tile_width, height * tile_height)
+    else:
+        tile_width = collage_size[0] // width
+        tile_height = collage_size[1] // height
+
+    font_size = max(int(tile_height * 0.1), 1)
+    label_height = int(font_size * 1.2)
+    font = ImageFont.truetype(FONT_PATH, font_size)
+    image_size = (tile_width, max(tile_height - label_height, 1))
+
+    # Very large collages are rendered (and written) one band of rows at a
+    # time, so only one band is ever in memory
+    band_rows = max(MAX_BAND_PIXELS // (collage_size[0] * tile_height), 1)
+    n_bands = (height + band_rows - 1) // band_rows
+    if n_bands == 1:
+        outputs = [output_path]
+    else:
+        outputs = [output_path.with_name(f"{output_path.stem}_{b:03d}{output_path.suffix}") for b in range(n_bands)]
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for b, band_path in enumerate(outputs):
+            first_row = b * band_rows
+            rows = min(band_rows, height - first_row)
+            band = Image.new("RGB", (collage_size[0], rows * tile_height) if n_bands > 1 else collage_size)
+            draw = ImageDraw.Draw(band)
+            labels = []
+            band_images = images[first_row * width:(first_row + rows) * width]
+            # Paste each image onto the collage as soon as it is ready
+            tiles = _as_finished(pool, _tile_image, ((path, image_size) for _, path in band_images), 2 * workers)
+            for i, future in tiles:
+                topic, image_path = band_images[i]
+                x, y = (i % width) * tile_width, (i // width) * tile_height
+                try:
+                    band.paste(future.result(), (x, y))
+                except (Image.UnidentifiedImageError, OSError):
+                    logger.warn("Skipping invalid image file: %s", image_path)
+                    continue
+                labels.append(((x, y + tile_height - label_height), topic))
+            # Draw image name under each picture, once no more tiles can cover it
+            for xy, topic in labels:
+                draw.text(xy, topic, font=font, fill=(255, 255, 255))
+            band.save(band_path)
+            del band, draw
+
+    if n_bands > 1:
+        # stack the bands back together for viewing
+        page = output_path.with_suffix(".html")
+        tags = "\n".join(f'<img src="{p.name}" style="display:block;width:100%">' for p in outputs)
+        page.write_text(f"<!DOCTYPE html>\n<html><body style=\"margin:0;background:#000\">\n{tags}\n</body></html>\n")
+        outputs.append(page)
+    return outputs
+
+
+class ImageDownloader:
+    """Fetches the first Google Images result of topics into an ImageCache.
+
+    Downloads run on a thread pool sharing one requests.Session, so
+    connections are kept alive and reused. Each host gets at most
+    `per_host` requests in flight, every request has a (connect, read)
+    timeout, and connection errors and 429/5xx responses are retried with
+    exponential backoff. Images are streamed straight into the cache.
+    """
+    def __init__(self, cache: ImageCache, logger: BtbLogger, workers: int = MAX_WORKERS, per_host: int = PER_HOST,
+                 timeout: tuple = TIMEOUT, retries: int = RETRIES, search_url: str = SEARCH_URL):
+        self.cache = cache
+        self.logger = logger
+        self.workers = workers
+        self.timeout = timeout
+        self.search_url = search_url
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers,
+                              max_retries=Retry(total=retries, backoff_factor=0.5,
+                                                status_forcelist=(429, 500, 502, 503, 504),
+                                                allowed_methods=["GET"]))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._per_host = per_host
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self._per_host)
+            return self._hosts[host]
+
+    def fetch(self, lead: str):
+        """Downloads and caches the image of one topic; returns its path or None."""
+        start = time.perf_counter()
         try:
-            font_size = int(tile_height * 0.1)
-            image_path = os.path.join(image_folder, image_file)
-            img = Image.open(image_path)
-            img = img.resize((tile_width, tile_height - int(font_size * 1.2)))  # Resize image to fit the tile size
-            collage.paste(img, ((i % width) * tile_width, (i // width) * tile_height))  # Paste image onto the collage
-            # Draw image name under each picture
-            font_path = os.path.join(os.path.dirname(__file__), "NotoSans_Local.ttf")
-            font = ImageFont.truetype(font_path, font_size)
-            topic = image_file.replace(".jpg","")
-            # topic = topic[:20]
-            draw.text(((i % width) * tile_width, (i // width) * tile_height + tile_height - int(font_size * 1.2)), topic, font=font, fill=(255, 255, 255))
-        except (Image.UnidentifiedImageError):
-            print(f"Skipping invalid image file: {image_file}")
-
-    # Save the collage
-    collage.save(output_path)
-
-def download_image(params):
-    lead, temp_dir, logger = params
-    try:
-        search_params = {"q": lead, "tbm": "isch"}
-        html = requests.get("https://www.google.com/search", params=search_params, timeout=30)
-        logger.use_inet(html.url)
-        soup = BeautifulSoup(html.content, features="lxml")
-        image = soup.find_all("img")[1]["src"]
-        data = requests.get(image).content
-        with open(os.path.join(temp_dir, f"{lead}.jpg"), "wb") as f:
-            f.write(data)
-        logger.debug(f"Downloaded image for {lead}")
-    except Exception as e:
-        logger.err(f"Failed to download image for {lead}: {e}")
-
-
-def run(in_path: Path, out_path: Path, logger: BtbLogger):
+            with self._host_slot(self.search_url):
+                html = self.session.get(self.search_url, params={"q": lead, "tbm": "isch"}, timeout=self.timeout)
+                html.raise_for_status()
+            self.logger.use_inet(html.url)
+            soup = BeautifulSoup(html.content, features="lxml")
+            image = soup.find_all("img")[1]["src"]
+            if image.startswith("data:"):
+                # some results are inlined as base64
+                path = self.cache.put(lead, base64.b64decode(image.split(",", 1)[1]))
+            else:
+                with self._host_slot(image), self.session.get(image, timeout=self.timeout, stream=True) as r:
+                    r.raise_for_status()
+                    path = self.cache.put_stream(lead, r.iter_content(CHUNK_SIZE))
+            self.logger.debug("Downloaded image for %s", lead)
+            self.logger.count('images_downloaded_total')
+            self.logger.observe('image_download_seconds', time.perf_counter() - start)
+            return path
+        except Exception as e:
+            self.logger.err("Failed to download image for %s: %s", lead, e)
+            self.logger.count('image_download_errors_total')
+            return None
+
+    def fetch_all(self, leads) -> dict:
+        """Downloads the images of many topics; returns {topic: path or None}."""
+        leads = list(leads)
+        # downloads waiting for a free worker, at the start (its peak)
+        self.logger.gauge('download_queue_depth', max(len(leads) - self.workers, 0))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.fetch, lead): lead for lead in leads}
+            return {futures[f]: f.result() for f in tqdm(as_completed(futures), desc="Topics: ", total=len(leads))}
+
+    def close(self):
+        self.session.close()
+
+
+def read_topics(in_paths, logger: BtbLogger) -> pd.DataFrame:
+    # one row per distinct topic; weight = number of files listing it
+    frames = []
+    for in_path in in_paths:
+        topics = pd.read_json(in_path)
+        logger.use_file(in_path)
+        topics.columns = ["Ads_interests"]
+        topics["Ads_interests"] = special_character(topics["Ads_interests"])
+        frames.append(topics.drop_duplicates())
+    topics = pd.concat(frames, ignore_index=True)
+    return topics.groupby("Ads_interests", sort=False).size().rename("weight").reset_index()
+
+def categorize(topics) -> np.ndarray:
+    # index into TOPIC_CATEGORIES; the first matching rule wins
+    topics = pd.Series(topics, dtype=object).str.casefold()
+    cats = np.full(len(topics), len(TOPIC_CATEGORIES) - 1)
+    for i, (_, rx) in reversed(list(enumerate(TOPIC_CATEGORIES[:-1]))):
+        cats[topics.str.contains(rx, regex=True).to_numpy(dtype=bool)] = i
+    return cats
+
+def run(in_path, out_path: Path, logger: BtbLogger, cache: bool = True, tile_size: tuple = None,
+        mode: str = "images", layout: str = "treemap"):
     print("Running the collage feature module")
-
-    topics = pd.read_json(in_path)
-    logger.use_file(in_path)
-    topics.columns = ["Ads_interests"]
-    topics["Ads_interests"] = special_character(topics["Ads_interests"])
-
-    output_path = out_path / (in_path.stem + ".jpg")
-
-    with tempfile.TemporaryDirectory() as temp_dir_topics:
-        logger.debug(f"Created temporary directory: {temp_dir_topics}")
-        
-        params_list = [(row["Ads_interests"], temp_dir_topics, logger) for _, row in topics.iterrows()]
-
-        with Pool(processes=os.cpu_count()) as pool:
-            list(tqdm(pool.imap(download_image, params_list), desc="Topics: ", total=len(params_list)))
-
-        # Create collage using images in the temporary directory
-        create_collage(temp_dir_topics, output_path)
-
-    return "Your collage has been created: " + str(output_path)
+    if mode not in ("images", "text"):
+        logger.crit(f"Invalid mode {mode}", ValueError)
+
+    in_paths = [Path(in_path)] if isinstance(in_path, (str, Path)) else [Path(p) for p in in_path]
+    topics = read_topics(in_paths, logger)
+    logger.info("%i distinct topics in %i file(s)", len(topics), len(in_paths))
+
+    if mode == "text":
+        output_path = out_path / (OUTPUT_NAME + "_tiles.png")
+        labels = topics["Ads_interests"].tolist()
+        img = render_tiles(labels, topics["weight"], categorize(labels), [c for c, _ in TOPIC_CATEGORIES],
+                           FONT_PATH, layout=layout)
+        img.save(output_path)
+        logger.wrote_file(output_path)
+        return "Your topic tiles have been created: " + str(output_path)
+
+    output_path = out_path / (OUTPUT_NAME + ".jpg")
+
+    with ExitStack() as stack:
+        if cache:
+            images = ImageCache()
+        else:
+            temp_dir_topics = stack.enter_context(tempfile.TemporaryDirectory())
+            logger.debug("Created temporary directory: %s", temp_dir_topics)
+            images = ImageCache(temp_dir_topics, max_bytes=float('inf'))
+        stack.callback(images.close)
+
+        found = {lead: images.get(lead) for lead in topics["Ads_interests"]}
+        missing = [lead for lead, path in found.items() if path is None]
+        logger.info("%i of %i topic images cached", len(found) - len(missing), len(found))
+        logger.count('image_cache_hits_total', len(found) - len(missing))
+        logger.count('image_cache_misses_total', len(missing))
+        if cache and len(missing) < len(found):
+            logger.use_file(images.root, 'contents')
+
+        if missing:
+            downloader = ImageDownloader(images, logger)
+            stack.callback(downloader.close)
+            found.update(downloader.fetch_all(missing))
+            if cache:
+                # one record for the persistent cache, not one per thumbnail;
+                # topics with the same image share one thumbnail file
+                new = [found[lead] for lead in missing if found[lead] is not None]
+                size = sum(p.stat().st_size for p in set(new) if p.exists())
+                logger.info("Cached %i topic images (%.1f MB) in %s", len(new), size / 2**20, images.root)
+                logger.wrote_file(images.root)
+
+        # Create collage using the cached thumbnails
+        written = create_collage([(lead, path) for lead, path in found.items() if path is not None],
+                                 output_path, logger, tile_size=tile_size)
+    for p in written:
+        logger.wrote_file(p)
+
+    return "Your collage has been created: " + str(written[-1] if written else output_path)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='topics',
                                      description='A short description of what your code does')
-    parser.add_argument('-i', '--in_file', metavar='JSON', help='path to json file', required=True, nargs='+')
+    parser.add_argument('-i', '--in_file', metavar='JSON', help='path to json file', required=False, nargs='*', default=[])
     parser.add_argument('-o', '--out_path', metavar='OUTPUT_PATH', help='where to send output(s)', required=False, default='.')
+    parser.add_argument('-t', '--tile_px', type=int, nargs=2, metavar=('W', 'H'), default=None, help='fixed tile size (the collage grows to fit)', required=False)
+    parser.add_argument('-m', '--mode', choices=['images', 'text'], default='images', help='image collage (online) or text tiles (offline)', required=False)
+    parser.add_argument('-l', '--layout', choices=['treemap', 'grid'], default='treemap', help='text tile layout', required=False)
+    parser.add_argument('--no_cache', action='store_true', help='do not use or fill the image cache', required=False)
     parser.add_argument('-v', '--verbose', action='count', default=0, help='increase verbosity', required=False)
+    parser.add_argument('--check', action='store_true', help='check the downloader against a local stand-in server instead (topics_check.py)', required=False)
+    parser.add_argument('--bench', action='store_true', help='benchmark the downloader against the old process pool instead (topics_check.py)', required=False)
     args = parser.parse_args()
+    if not (args.in_file or args.check or args.bench):
+        parser.error('give -i JSON files, or --check / --bench')
 
     logger = RootLogger()
     logger.setup(verb=args.verbose)
 
-    for f in args.in_file:
-        print(run(f, args.out_path, logger))
+    if args.check or args.bench:
+        from between_bytes.features import topics_check  # pylint: disable=import-outside-toplevel
+        sys.exit(topics_check.main(logger, bench=args.bench))
+
+    print(run([Path(f) for f in args.in_file], Path(args.out_path), logger, cache=not args.no_cache,
+              tile_size=args.tile_px, mode=args.mode, layout=args.layout))
@@ -0,0 +1,229 @@
+"""topics_check.py checks and benchmarks the topics image downloader offline
+
+A local HTTP server (http.server.ThreadingHTTPServer on 127.0.0.1)
+stands in for Google Images: /search?q=<topic> answers with a results
+page whose second <img> links /img/<topic>, after `latency` seconds.
+Topics named in STAND_IN_FAILURES misbehave on purpose (a 503, a stalled
+image, a 404, an empty page, a body that is not an image), and the
+server counts requests per URL and the most requests in flight at once.
+
+check runs topics.ImageDownloader against it and asserts the retries,
+timeouts, the per-host limit and which fetches fail. benchmark times
+ImageDownloader against the multiprocessing.Pool download it replaced
+(_pool_fetch). Nothing here is imported by topics.run.
+
+Functions:
+    check(logger, per_host): Runs ImageDownloader against the stand-in; raises AssertionError on a failed check
+    benchmark(logger, n, latency): Seconds to fetch n topics from the stand-in with ImageDownloader and with the process pool it replaced
+    main(logger, bench): Runs check (or benchmark) and returns the exit status
+
+Example usage:
+    $ python3 topics_check.py
+    $ python3 topics_check.py --bench
+    $ python3 topics.py --check
+
+Dependencies:
+    http.server for the stand-in server
+    multiprocessing for the old process pool
+    requests, BeautifulSoup4 and pillow (PIL), as topics
+
+Note:
+    This sub-module is part of the 'between_bytes' package in the 'features' module.
+
+Version:
+    1.0
+
+Author:
+    between_bytes contributors
+"""
+
+import argparse
+import base64
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import requests
+from bs4 import BeautifulSoup
+from PIL import Image
+
+from between_bytes.core.log_aud import BtbLogger, RootLogger
+from between_bytes.core.image_cache import ImageCache
+from between_bytes.features.topics import ImageDownloader
+
+STAND_IN_SLOW = 1.0  # s the stand-in stalls on the "slow" image
+# stand-in topics that misbehave, run by --check
+STAND_IN_FAILURES = {
+    "flaky": "503 once, then cached after a retry",
+    "slow": "image stalls past the read timeout on every try; fails after 2 retries",
+    "missing": "404 image; fails without retrying",
+    "blank": "no result on the search page; fails",
+    "broken": "image that is not an image; fails",
+}
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    # /search?q=<topic> links /img/<topic>; topics named after a failure
+    # answer with it (see STAND_IN_FAILURES)
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        srv = self.server
+        url = urlsplit(self.path)
+        kind = url.path.split("/")[1]
+        topic = parse_qs(url.query)["q"][0] if kind == "search" else unquote(url.path[len("/img/"):])
+        with srv.lock:
+            srv.hits[kind, topic] += 1
+            hits = srv.hits[kind, topic]
+        if kind == "img" and topic == "slow":
+            time.sleep(STAND_IN_SLOW)
+            return self._send(200, b"late", "image/jpeg")
+
+        # in flight until the response starts, so a client reusing its slot never counts twice
+        with srv.lock:
+            srv.in_flight += 1
+            srv.peak = max(srv.peak, srv.in_flight)
+        time.sleep(srv.latency)
+        with srv.lock:
+            srv.in_flight -= 1
+
+        if kind == "search":
+            if topic == "flaky" and hits == 1:
+                return self._send(503, b"busy", "text/plain")
+            if topic == "inline":
+                src = "data:image/jpeg;base64," + base64.b64encode(srv.images[None]).decode("ascii")
+            else:
+                src = f"{srv.url}/img/{quote(topic)}"
+            imgs = "" if topic == "blank" else f'<img src="{src}">'
+            return self._send(200, f'<html><body><img src="/logo.png">{imgs}</body></html>'.encode(), "text/html")
+        if topic == "missing":
+            return self._send(404, b"not found", "text/plain")
+        if topic == "broken":
+            return self._send(200, b"not an image", "image/jpeg")
+        self._send(200, srv.images.get(topic, srv.images[None]), "image/jpeg")
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@contextmanager
+def _stand_in(images: dict, latency: float):
+    """Local HTTP server standing in for Google Images; yields it with .url, .hits and .peak set."""
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    srv.handle_error = lambda request, address: None  # clients hang up on the slow topic
+    srv.url = "http://%s:%i" % srv.server_address
+    srv.images = {None: _test_image(0), **images}
+    srv.latency = latency
+    srv.lock = threading.Lock()
+    srv.hits = Counter()
+    srv.in_flight = srv.peak = 0
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield srv
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+def _test_image(i: int) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (640, 480), (i % 256, i // 256 % 256, 128)).save(buf, "JPEG")
+    return buf.getvalue()
+
+def _pool_fetch(params):
+    # the process-pool download ImageDownloader replaced, kept for benchmark()
+    lead, search_url = params
+    try:
+        html = requests.get(search_url, params={"q": lead, "tbm": "isch"}, timeout=30)
+        soup = BeautifulSoup(html.content, features="lxml")
+        return lead, requests.get(soup.find_all("img")[1]["src"]).content
+    except Exception:
+        return lead, None
+
+def check(logger: BtbLogger, per_host: int = 4):
+    """Runs ImageDownloader against the local stand-in; raises AssertionError on a failed check."""
+    topics = [f"topic {i}" for i in range(32)] + ["inline"] + list(STAND_IN_FAILURES)
+    with _stand_in({t: _test_image(i + 1) for i, t in enumerate(topics)}, latency=0.05) as srv, \
+            tempfile.TemporaryDirectory() as tmp:
+        cache = ImageCache(tmp, max_bytes=float('inf'))
+        downloader = ImageDownloader(cache, logger, workers=16, per_host=per_host, timeout=(1, STAND_IN_SLOW / 4),
+                                     retries=2, search_url=srv.url + "/search")
+        try:
+            got = downloader.fetch_all(topics)
+        finally:
+            downloader.close()
+            cache.close()
+    failed = sorted(t for t, p in got.items() if p is None)
+    for topic, expected in STAND_IN_FAILURES.items():
+        print(f"{topic:>8}: {expected}")
+    assert failed == sorted(["blank", "broken", "missing", "slow"]), f"failed fetches: {failed}"
+    assert srv.hits["search", "flaky"] == 2, "503 not retried"
+    assert srv.hits["img", "slow"] == 3, "read timeout not retried twice"
+    assert srv.hits["img", "missing"] == 1, "404 retried"
+    assert srv.peak <= per_host, f"{srv.peak} requests in flight to one host, limit {per_host}"
+    print(f"{len(topics) - len(failed)} of {len(topics)} topics cached, "
+          f"at most {srv.peak} requests in flight (limit {per_host})")
+
+def benchmark(logger: BtbLogger, n: int = 200, latency: float = 0.05) -> dict:
+    """Seconds to fetch `n` topics from the stand-in (`latency` s per request),
+    with ImageDownloader and with the process pool it replaced."""
+    images = {f"topic {i}": _test_image(i + 1) for i in range(n)}
+    out = {}
+    with _stand_in(images, latency) as srv:
+        search_url = srv.url + "/search"
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ImageCache(tmp, max_bytes=float('inf'))
+            start = time.perf_counter()
+            with Pool(processes=os.cpu_count()) as pool:
+                for lead, data in pool.imap_unordered(_pool_fetch, [(lead, search_url) for lead in images]):
+                    cache.put(lead, data)
+            out["process pool"] = time.perf_counter() - start
+            cache.close()
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ImageCache(tmp, max_bytes=float('inf'))
+            downloader = ImageDownloader(cache, logger, search_url=search_url)
+            start = time.perf_counter()
+            got = downloader.fetch_all(images)
+            out["ImageDownloader"] = time.perf_counter() - start
+            downloader.close()
+            cache.close()
+    assert all(p is not None for p in got.values()), "ImageDownloader missed topics"
+    return out
+
+
+def main(logger: BtbLogger, bench: bool = False) -> int:
+    """Runs check (or benchmark); returns the exit status."""
+    if not bench:
+        check(logger)
+        print("All download checks passed")
+        return 0
+    results = benchmark(logger)
+    for case, seconds in results.items():
+        print(f"{case:>16}: {seconds:6.2f} s")
+    return int(results["ImageDownloader"] > results["process pool"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='topics_check',
+                                     description='Check and benchmark the topics image downloader against a local stand-in server')
+    parser.add_argument('--bench', action='store_true', help='benchmark against the old process pool instead', required=False)
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='increase verbosity', required=False)
+    args = parser.parse_args()
+
+    logger = RootLogger()
+    logger.setup(verb=args.verbose)
+    sys.exit(main(logger, args.bench))
@@ -31,6 +31,8 @@ from between_bytes.features import off_fb_act as ofa
 from between_bytes.features import topics as tps
 from between_bytes.features import facebook_act as fba
 from between_bytes.features import filesize_sunburst as fsb
+from between_bytes.features import dup_media as dmd
+from between_bytes.features import media_meta as mmd
 from between_bytes.features import notifs as ntf
 
 from between_bytes.core.log_aud import RootLogger
@@ -93,7 +95,9 @@ def main(in_path: Path, out_path: Path, mods: dict, verbose: int = 0, log: str =
     # print(f"Modules: {mods}\nVerbose: {verbose}")
     
     logger = RootLogger()
-    logger.setup(verb=verbose, output=log)
+    logger.setup(verb=verbose, output=log, trace=kwargs.get('trace'),
+                 metrics=kwargs.get('metrics'), audit_detail=kwargs.get('audit_detail'),
+                 audit=kwargs.get('audit'), audit_format=kwargs.get('audit_format', 'ndjson'))
     logger.info("Main runner version: {}".format(__version__))
 
     feat_outs = []
@@ -106,19 +110,49 @@ def main(in_path: Path, out_path: Path, mods: dict, verbose: int = 0, log: str =
             fsb_mode = kwargs['fsb_mode']
         else:
             fsb_mode = 0
-        feat_outs.append(fsb.run(path, out_path, logger.get_child('fsb'), fsb_mode))
+        with logger.span('fsb'):
+            feat_outs.append(fsb.run(path, out_path, logger.get_child('fsb'), fsb_mode,
+                                     min_share=kwargs.get('fsb_min_share', 0.001),
+                                     max_depth=kwargs.get('fsb_max_depth'),
+                                     max_nodes=kwargs.get('fsb_max_nodes', fsb.MAX_NODES),
+                                     use_index=not kwargs.get('fsb_no_index', False),
+                                     dups=kwargs.get('fsb_dups', False)))
     else:
         logger.info("Filesize_sunburst module not run.")
     
+    # dup_media module
+    #
+    if mods.get('dmd'):
+        with logger.span('dmd'):
+            feat_outs.append(dmd.run(in_path, out_path, logger.get_child('dmd'),
+                                     media_only=not kwargs.get('dmd_all_files', False),
+                                     use_index=not kwargs.get('fsb_no_index', False)))
+    else:
+        logger.info("Dup_media module not run.")
+
+    # media_meta module
+    #
+    media = None
+    if mods.get('mmd'):
+        with logger.span('mmd.build_table'):
+            media = mmd.build_table(in_path, logger.get_child('mmd'),
+                                    use_index=not kwargs.get('fsb_no_index', False),
+                                    cache=None if kwargs.get('mmd_no_cache', False) else mmd.CACHE_PATH)
+        with logger.span('mmd'):
+            feat_outs.append(mmd.run(in_path, out_path, logger.get_child('mmd'), table=media))
+    else:
+        logger.info("Media_meta module not run.")
+
     # sample module
     #
     if mods['smp']:
         path = in_path / 'ads_information' / 'other_categories_used_to_reach_you.json'
         if path.exists():
-            feat_outs.append(smp.run(path, out_path, logger.get_child('smp')))
+            with logger.span('smp'):
+                feat_outs.append(smp.run(path, out_path, logger.get_child('smp')))
         else:
-            logger.err("The file for the sample module (%s) does not exist! Skipping..." % path.name)
-            logger.debug("Expected path: %s" % path)
+            logger.err("The file for the sample module (%s) does not exist! Skipping...", path.name)
+            logger.debug("Expected path: %s", path)
     else:
         logger.info("Sample module not run.")
 
@@ -127,20 +161,29 @@ def main(in_path: Path, out_path: Path, mods: dict, verbose: int = 0, log: str =
     if mods['ntf']:
         path = in_path / 'logged_information' / 'notifications' / 'notifications.json'
         if path.exists():
-            feat_outs.append(ntf.run(path, out_path, logger.get_child('ntf')))
+            with logger.span('ntf'):
+                feat_outs.append(ntf.run(path, out_path, logger.get_child('ntf'),
+                                         mode=kwargs.get('ntf_mode', 'report')))
         else:
-            logger.err("The file for the Notifications module (%s) does not exist! Skipping..." % path.name)
-            logger.debug("Expected path: %s" % path)
+            logger.err("The file for the Notifications module (%s) does not exist! Skipping...", path.name)
+            logger.debug("Expected path: %s", path)
 
     # ip_loc module
     #
     if mods['ipl']:
         path = in_path / 'security_and_login_information' / 'account_activity.json'
         if path.exists():
-            feat_outs.append(ipl.run(path, out_path, logger.get_child('ipl')))
+            photos = media is not None and media['lat'].notna().any()
+            with logger.span('ipl'):
+                feat_outs.append(ipl.run(path, out_path, logger.get_child('ipl'),
+                                         popup_mode=kwargs.get('ipl_popups', 'js'),
+                                         geoip_db=kwargs.get('ipl_geoip'),
+                                         use_inet=kwargs.get('ipl_inet', False),
+                                         max_speed_kmh=kwargs.get('ipl_max_speed', ipl.MAX_SPEED_KMH),
+                                         layers=[mmd.photo_layer(media)] if photos else []))
         else:
-            logger.err("The file for the IP Location module (%s) does not exist! Skipping..." % path.name)
-            logger.debug("Expected path: %s" % path)
+            logger.err("The file for the IP Location module (%s) does not exist! Skipping...", path.name)
+            logger.debug("Expected path: %s", path)
     else:
         logger.info("IP Location module not run.")
 
@@ -149,10 +192,14 @@ def main(in_path: Path, out_path: Path, mods: dict, verbose: int = 0, log: str =
     if mods['ofa']:
         path = in_path / 'apps_and_websites_off_of_facebook' / 'your_activity_off_meta_technologies.json'
         if path.exists():
-            feat_outs.append(ofa.run(path, out_path, logger.get_child('ofa')))
+            with logger.span('ofa'):
+                feat_outs.append(ofa.run(path, out_path, logger.get_child('ofa'),
+                                         top=kwargs.get('ofa_top', 10),
+                                         period=kwargs.get('ofa_period', 'Y'),
+                                         canonical=not kwargs.get('ofa_raw_names', False)))
         else:
-            logger.err("The file for the Off-Facebook Activity module (%s) does not exist! Skipping..." % path.name)
-            logger.debug("Expected path: %s" % path)
+            logger.err("The file for the Off-Facebook Activity module (%s) does not exist! Skipping...", path.name)
+            logger.debug("Expected path: %s", path)
     else:
         logger.info("Off-Facebook Activity module not run.")
 
@@ -161,12 +208,18 @@ def main(in_path: Path, out_path: Path, mods: dict, verbose: int = 0, log: str =
     if mods['tps']:
         path = [in_path / 'logged_information' / 'your_topics' / 'your_topics.json',
                 in_path / 'logged_information' / 'other_logged_information' / 'ads_interests.json']
-        for p in path: # make tps.run() only take one path at a time
-            if p.exists():
-                feat_outs.append(tps.run(p, out_path, logger.get_child('tps')))
-            else:
-                logger.err("A file for the Topics module (%s) does not exist! Skipping..." % p.name)
-                logger.debug("Expected path: %s" % p)
+        for p in path:
+            if not p.exists():
+                logger.err("A file for the Topics module (%s) does not exist! Skipping...", p.name)
+                logger.debug("Expected path: %s", p)
+        path = [p for p in path if p.exists()]
+        if path:
+            with logger.span('tps'):
+                feat_outs.append(tps.run(path, out_path, logger.get_child('tps'),
+                                         cache=not kwargs.get('tps_no_cache', False),
+                                         tile_size=kwargs.get('tps_tile_px'),
+                                         mode=kwargs.get('tps_mode', 'images'),
+                                         layout=kwargs.get('tps_layout', 'treemap')))
     else:
         logger.info("Topics module not run.")
 
@@ -174,7 +227,8 @@ def main(in_path: Path, out_path: Path, mods: dict, verbose: int = 0, log: str =
     #
     if mods['fba']:
         path = in_path
-        feat_outs.append(fba.run(path, out_path, logger.get_child('fba')))
+        with logger.span('fba'):
+            feat_outs.append(fba.run(path, out_path, logger.get_child('fba')))
     else:
         logger.info("On-Facebook Activity module not run.")
 
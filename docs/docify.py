@@ -43,8 +43,9 @@ import hashlib
 
 from rstcloth import RstCloth
 
-EXP_VIS = ['ads_interests.jpg',
-           'notifications/2024_notifications.html',
+EXP_VIS = ['topics.jpg',
+           'notifications/notifications.html',
+           'notifications/plotly.min.js',
            'ip_loc/interactive_occurance.html',
            'facebook_act/Facebook_Use_by_Year.png',
            'filesize_sunburst/sunburst.html',
@@ -91,11 +92,11 @@ def build_nav_cards(rc, ghh:str):
     rc.newline()
     build_nav_card(rc, 'Topics', 'campaign',
                    'See what Facebook thinks I am interested in.',
-                   f'../../../_static/{ghh}/ads_interests.jpg')
+                   f'../../../_static/{ghh}/topics.jpg')
     rc.newline()
     build_nav_card(rc, 'Notifications', 'notifications',
                    'See how frequently Facebook sends notifications',
-                   f'../../../_static/{ghh}/2024_notifications.html')
+                   f'../../../_static/{ghh}/notifications.html')
     rc.newline()
     build_nav_card(rc, 'Off-Facebook Activity', 'share',
                    'See what Facebook knows about my activity off of Facebook.',